@@ -0,0 +1,308 @@
+"""Техническая проверка всей библиотеки: разрешение, битрейт, длительность, число дорожек и VFR.
+
+`get_meta` выполняется в пуле процессов, в работе одновременно не больше
+`jobs` файлов, поэтому даже для десятков тысяч файлов запущено не больше
+`jobs` ffprobe. Для каждого файла действует таймаут: ffprobe останавливается
+в рабочем процессе, а если рабочий процесс не вернул результат и через
+`KILL_GRACE` секунд после таймаута (например, завис на чтении с недоступного
+сетевого диска), файл записывается со статусом timeout, пул с этим процессом
+останавливается и создаётся заново. Если рабочий процесс завершился аварийно,
+файлы из его пула проверяются повторно по одному, и файл, на котором процесс
+падает снова, записывается со статусом error. Строки отчёта (CSV или JSON lines) дописываются по мере
+готовности, прерванная проверка продолжается с того же места - файлы, уже
+записанные в отчёт, пропускаются. С `retry_failed` строки с ошибками и
+таймаутами удаляются из отчёта, и эти файлы проверяются заново.
+"""
+
+import os
+import csv
+import json
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from engine import get_meta, ProbeCancelled
+from scanner import scan
+
+__all__ = ["AuditStats", "AUDIT_FIELDS", "audit_file", "run_audit", "DEFAULT_TIMEOUT"]
+
+log = logging.getLogger("KL_Tag")
+
+DEFAULT_TIMEOUT = 60  # секунды на файл
+KILL_GRACE = 5  # секунды сверх таймаута, после которых зависший рабочий процесс останавливается
+
+AUDIT_FIELDS = (
+    "path",
+    "status",
+    "size",
+    "video",
+    "width",
+    "height",
+    "bit_rate",
+    "running_time",
+    "audio_streams",
+    "subtitle_streams",
+    "framerate",
+    "vfr",
+    "elapsed",
+    "error",
+)
+
+
+@dataclass
+class AuditStats:
+    total: int = 0
+    skipped: int = 0  # уже есть в отчёте
+    ok: int = 0
+    vfr: int = 0
+    errors: int = 0
+    timeouts: int = 0
+
+
+def audit_file(path, timeout=DEFAULT_TIMEOUT, use_cache=True) -> dict:
+    """Строка отчёта для файла. Выполняется в рабочем процессе."""
+    row = dict.fromkeys(AUDIT_FIELDS)
+    row["path"] = path
+    start = time.perf_counter()
+    cancel = threading.Event()
+    timer = threading.Timer(timeout, cancel.set)
+    timer.daemon = True
+    timer.start()
+    try:
+        row["size"] = os.path.getsize(path)
+        meta = get_meta(path, use_cache=use_cache, cancel=cancel)
+    except ProbeCancelled:
+        row["status"] = "timeout"
+        row["error"] = f"нет ответа за {timeout} с"
+    except Exception as e:
+        row["status"] = "error"
+        row["error"] = str(e) or type(e).__name__
+    else:
+        if not meta.get("ffprobe"):
+            row["status"] = "error"
+            row["error"] = "не удалось получить информацию о файле"
+        else:
+            row["status"] = "ok"
+            for name in ("video", "width", "height", "bit_rate", "running_time", "audio_streams", "subtitle_streams", "framerate"):
+                row[name] = meta.get(name)
+            if meta.get("video"):
+                row["vfr"] = not meta["framerate_check"]
+    finally:
+        timer.cancel()
+    row["elapsed"] = round(time.perf_counter() - start, 3)
+    return row
+
+
+def _report_format(path, format=None) -> str:
+    if format:
+        return format
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def _trim_partial_line(path):
+    """Удаление недописанной последней строки (отчёт прерван во время записи)."""
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def _read_rows(path, format=None) -> list[dict]:
+    with open(path, encoding="utf-8", newline="") as f:
+        if _report_format(path, format) == "csv":
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def done_paths(path, format=None, retry_failed=False) -> set[str]:
+    """Файлы, уже записанные в отчёт.
+
+    `retry_failed`: строки со статусом, отличным от "ok", удаляются из отчёта,
+    эти файлы не считаются проверенными.
+    """
+    if not os.path.exists(path):
+        return set()
+    _trim_partial_line(path)
+    rows = _read_rows(path, format)
+    if retry_failed:
+        ok = [row for row in rows if row["status"] == "ok"]
+        if len(ok) < len(rows):
+            tmp = path + ".tmp"
+            writer = _ReportWriter(tmp, _report_format(path, format), append=False)
+            try:
+                for row in ok:
+                    writer.write(row)
+            finally:
+                writer.close()
+            os.replace(tmp, path)
+        rows = ok
+    return {row["path"] for row in rows}
+
+
+class _ReportWriter:
+    def __init__(self, path, format=None, append=True):
+        self.format = _report_format(path, format)
+        new = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a" if append else "w", encoding="utf-8", newline="")
+        if self.format == "csv":
+            self.csv = csv.DictWriter(self.file, AUDIT_FIELDS)
+            if new:
+                self.csv.writeheader()
+
+    def write(self, row: dict):
+        if self.format == "csv":
+            self.csv.writerow(row)
+        else:
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+@dataclass
+class _Task:
+    path: str
+    start: float
+    deadline: float
+    suspect: bool = False  # проверяется отдельно после аварийного завершения пула
+
+
+def run_audit(
+    roots,
+    output,
+    format=None,
+    jobs=None,
+    timeout=DEFAULT_TIMEOUT,
+    resume=True,
+    use_cache=True,
+    on_row=None,
+    retry_failed=False,
+    audit=audit_file,
+) -> AuditStats:
+    """Проверка всех медиафайлов в `roots` с записью отчёта в `output`.
+
+    `format` - "csv" или "jsonl" (по умолчанию по расширению `output`),
+    `resume=False` перезаписывает отчёт, `retry_failed=True` повторяет
+    проверку файлов с ошибкой или таймаутом. `on_row(row)` вызывается для
+    каждой готовой строки. `audit(path, timeout, use_cache)` - проверка
+    одного файла в рабочем процессе.
+    """
+    stats = AuditStats()
+    roots = [roots] if isinstance(roots, str) else roots
+    done = done_paths(output, format, retry_failed) if resume else set()
+    jobs = jobs or os.cpu_count()
+    writer = _ReportWriter(output, format, append=resume)
+
+    def new_paths():
+        for root in roots:
+            for path in scan(root):
+                if path in done:
+                    stats.skipped += 1
+                    continue
+                yield path
+
+    paths = new_paths()
+    retry = deque()  # файлы из пересозданного пула, проверка которых не завершилась
+    suspects = deque()  # файлы из пула, рабочий процесс которого завершился аварийно
+    pending: dict = {}  # future -> _Task
+    executor = ProcessPoolExecutor(max_workers=jobs)
+
+    def submit(path, suspect=False):
+        now = time.monotonic()
+        future = executor.submit(audit, path, timeout, use_cache)
+        pending[future] = _Task(path, now, now + timeout + KILL_GRACE, suspect)
+
+    def collect(row):
+        _collect(row, stats, writer, on_row)
+
+    try:
+        while True:
+            if suspects:
+                # по одному, чтобы аварийное завершение относилось к конкретному файлу
+                if not pending:
+                    submit(suspects.popleft(), suspect=True)
+            else:
+                while len(pending) < jobs:
+                    path = retry.popleft() if retry else next(paths, None)
+                    if path is None:
+                        break
+                    submit(path)
+            if not pending:
+                break
+
+            deadline = min(task.deadline for task in pending.values())
+            finished, _ = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            broken = False
+            for future in finished:
+                task = pending.pop(future)
+                try:
+                    row = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    if not task.suspect:
+                        suspects.append(task.path)
+                        continue
+                    row = _failed_row(task, "error", "рабочий процесс завершился аварийно")
+                except Exception as e:
+                    row = _failed_row(task, "error", str(e) or type(e).__name__)
+                collect(row)
+
+            now = time.monotonic()
+            expired = [future for future, task in pending.items() if task.deadline <= now]
+            for future in expired:
+                task = pending.pop(future)
+                log.warning(f"Проверка {task.path} не завершилась за {timeout} с, рабочий процесс будет остановлен")
+                collect(_failed_row(task, "timeout", f"нет ответа за {timeout} с"))
+
+            if broken or expired:
+                # зависший или упавший процесс не освобождается, пул заменяется целиком,
+                # незавершённые файлы проверяются в новом пуле
+                for task in pending.values():
+                    (suspects if broken or task.suspect else retry).append(task.path)
+                pending.clear()
+                _kill_pool(executor)
+                executor = ProcessPoolExecutor(max_workers=jobs)
+    finally:
+        if pending:
+            _kill_pool(executor)
+        else:
+            executor.shutdown()
+        writer.close()
+    return stats
+
+
+def _failed_row(task: _Task, status, error) -> dict:
+    """Строка отчёта для файла, проверка которого не вернула результат."""
+    row = dict.fromkeys(AUDIT_FIELDS)
+    row.update(path=task.path, status=status, error=error, elapsed=round(time.monotonic() - task.start, 3))
+    return row
+
+
+def _kill_pool(executor: ProcessPoolExecutor):
+    """Остановка пула вместе с рабочими процессами, которые не закончат задачу сами."""
+    kill = getattr(executor, "kill_workers", None)  # Python 3.14
+    if kill:
+        kill()
+        return
+    for process in list((executor._processes or {}).values()):
+        process.kill()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _collect(row: dict, stats: AuditStats, writer: _ReportWriter, on_row):
+    stats.total += 1
+    if row["status"] == "ok":
+        stats.ok += 1
+        stats.vfr += bool(row["vfr"])
+    elif row["status"] == "timeout":
+        stats.timeouts += 1
+    else:
+        stats.errors += 1
+    writer.write(row)
+    if on_row:
+        on_row(row)
@@ -0,0 +1,59 @@
+"""Размер постера и время подготовки для разных политик кодирования (`CoverPolicy`).
+
+    python benchmarks/bench_covers.py
+    python benchmarks/bench_covers.py poster1.jpg poster2.jpg
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from covers import CoverPolicy, LazyCover, prepare_cover  # noqa: E402
+from synthetic import make_poster  # noqa: E402
+
+POLICIES = {
+    "png": CoverPolicy("PNG"),
+    "jpeg-85": CoverPolicy("JPEG", 85),
+    "jpeg-90": CoverPolicy("JPEG", 90),
+    "jpeg-95": CoverPolicy("JPEG", 95),
+    "source": CoverPolicy("source"),
+}
+
+
+def measure(data, policy, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cover = prepare_cover(LazyCover(data), policy)
+        times.append(time.perf_counter() - start)
+    return len(cover.data), statistics.median(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="*", help="файлы постеров (по умолчанию синтетические JPEG)")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.images:
+        sources = []
+        for path in args.images:
+            with open(path, "rb") as f:
+                sources.append((os.path.basename(path), f.read()))
+    else:
+        # постер Кинопоиска уже нужного размера и оригинал, который надо уменьшать
+        sources = [("kp-360x540", make_poster((360, 540))), ("kp-1000x1500", make_poster((1000, 1500)))]
+
+    print(f"{'постер':<16} {'политика':<8} {'размер, Кб':>11} {'время, мс':>10}")
+    for name, data in sources:
+        for policy_name, policy in POLICIES.items():
+            size, elapsed = measure(data, policy, args.repeat)
+            print(f"{name:<16} {policy_name:<8} {size / 1024:>11.1f} {elapsed * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
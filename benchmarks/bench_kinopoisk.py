@@ -0,0 +1,99 @@
+"""Пакетная загрузка данных Кинопоиска на записанных ответах, без сети и токена.
+
+Фикстуры записываются с локальной заглушки API (или берётся каталог, записанный
+`cli.py --kp-record`), затем `get_film_info` выполняется для всех фильмов в пуле
+потоков через `ReplayTransport`: с пустым дисковым кэшем и с заполненным.
+
+    python benchmarks/bench_kinopoisk.py --films 200 --latency-ms 80 -j 8
+    python benchmarks/bench_kinopoisk.py --fixtures fixtures --latency-ms 150
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import glob
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kinopoisk import KinopoiskClient  # noqa: E402
+from kpcache import FilmCache, set_cache  # noqa: E402
+from transport import RecordTransport, ReplayTransport  # noqa: E402
+from synthetic import make_poster  # noqa: E402
+from suite import FILM_ID, start_stub_server  # noqa: E402
+
+
+def record_stub(directory, films, preview_size):
+    """Запись ответов локальной заглушки API для `films` фильмов."""
+    server, base_url = start_stub_server(make_poster((1000, 1500)), 0.0, make_poster(preview_size))
+    set_cache(None)
+    try:
+        with KinopoiskClient(api_url=base_url, transport=RecordTransport(directory), token="stub") as client:
+            ids = list(range(FILM_ID, FILM_ID + films))
+            for film_id in ids:
+                assert client.get_film_info(film_id), film_id
+    finally:
+        server.shutdown()
+        server.server_close()
+    return ids
+
+
+def recorded_films(directory):
+    ids = []
+    for file in glob.glob(os.path.join(directory, "*.json")):
+        with open(file, encoding="utf-8") as f:
+            match = re.search(r"/api/v2\.2/films/(\d+)$", json.load(f)["url"])
+        if match:
+            ids.append(int(match.group(1)))
+    return sorted(ids)
+
+
+def run(client, ids, jobs):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(client.get_film_info, ids))
+    elapsed = time.perf_counter() - start
+    covers = [len(r["cover"].data) for r in results if r and r["cover"]]
+    return elapsed, sum(1 for r in results if not r), sum(covers) / max(1, len(covers))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", help="каталог с записанными ответами (по умолчанию - запись с заглушки)")
+    parser.add_argument("--films", type=int, default=100, help="число фильмов для записи с заглушки")
+    parser.add_argument("--latency-ms", type=float, default=50, help="задержка каждого ответа")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="число потоков")
+    parser.add_argument("--preview", default="400x600", help="размер превью постера на заглушке, например 300x450")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.fixtures:
+            directory = args.fixtures
+            ids = recorded_films(directory)
+        else:
+            directory = os.path.join(tmp, "fixtures")
+            ids = record_stub(directory, args.films, tuple(int(x) for x in args.preview.split("x")))
+        print(f"Фильмов: {len(ids)}, задержка {args.latency_ms:.0f} мс, потоков: {args.jobs}")
+
+        transport = ReplayTransport(directory, args.latency_ms / 1000)
+        cache = FilmCache(os.path.join(tmp, "kinopoisk"))
+        set_cache(cache)
+        with KinopoiskClient(pool_size=args.jobs, transport=transport) as client:
+            for case in ("cold", "cached"):
+                requests_before = transport.hits + transport.misses
+                elapsed, failed, poster_bytes = run(client, ids, args.jobs)
+                print(
+                    f"{case:<7} {elapsed:>7.2f} с, {len(ids) / elapsed:>8.1f} фильмов/с, "
+                    f"запросов: {transport.hits + transport.misses - requests_before}, ошибок: {failed}, "
+                    f"постер: {poster_bytes / 1024:.0f} Кб/фильм"
+                )
+        print(f"Кэш: попаданий {sum(cache.hits.values())}, промахов {sum(cache.misses.values())}")
+        set_cache(None)
+
+
+if __name__ == "__main__":
+    main()
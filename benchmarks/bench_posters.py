@@ -0,0 +1,107 @@
+"""Подготовка постера: `image_cut` (полное декодирование) против `normalize_poster` (draft).
+
+Время - медиана на одно изображение, память - прирост пикового RSS процесса
+(VmHWM, только Linux), каждый вариант запускается в отдельном процессе.
+
+    python benchmarks/bench_posters.py
+    python benchmarks/bench_posters.py poster1.jpg poster2.jpg
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import statistics
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from covers import image_cut, normalize_poster, normalize_posters, CoverPolicy  # noqa: E402
+from synthetic import make_poster  # noqa: E402
+
+
+def old_path(data):
+    return image_cut(Image.open(io.BytesIO(data))).convert("RGB")
+
+
+def new_path(data):
+    return normalize_poster(data)
+
+
+METHODS = {"image_cut": old_path, "normalize": new_path}
+
+
+def peak_rss_kb():
+    # ru_maxrss в Linux наследуется через exec от родителя, поэтому читаем VmHWM
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def run(method, data, repeat, queue):
+    func = METHODS[method]
+    base = peak_rss_kb()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        times.append(time.perf_counter() - start)
+    queue.put((statistics.median(times), peak_rss_kb() - base))
+
+
+def measure(method, data, repeat):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=run, args=(method, data, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("images", nargs="*", help="файлы постеров (по умолчанию синтетические JPEG)")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=32, help="число постеров для пакетной обработки")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    if args.images:
+        sources = []
+        for path in args.images:
+            with open(path, "rb") as f:
+                sources.append((os.path.basename(path), f.read()))
+    else:
+        sources = [(f"{w}x{h}", make_poster((w, h))) for w, h in ((2000, 3000), (3000, 2000), (1920, 1080), (1000, 1500))]
+
+    print(f"{'постер':<16} {'вариант':<10} {'время, мс':>10} {'пик RSS, Мб':>12}")
+    for name, data in sources:
+        for method in METHODS:
+            elapsed, rss = measure(method, data, args.repeat)
+            print(f"{name:<16} {method:<10} {elapsed * 1000:>10.1f} {rss / 1024:>12.1f}")
+
+    batch = [data for _, data in sources] * (args.batch // len(sources) or 1)
+    start = time.perf_counter()
+    for data in batch:
+        CoverPolicy().encode(old_path(data), "JPEG")
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    normalize_posters(batch, jobs=args.jobs)
+    parallel = time.perf_counter() - start
+    print(
+        f"Пакет из {len(batch)}: image_cut последовательно {serial:.2f} с, "
+        f"normalize_posters (-j {args.jobs}) {parallel:.2f} с"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Сравнение быстрого чтения тегов (mmap + ilst) с чтением через mutagen.
+
+    python benchmarks/bench_read_tags.py --frames 170000 --mdat-mb 2048
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from engine import Mp4TagsClass, read_tags, write_tags  # noqa: E402
+from synthetic import make_mp4  # noqa: E402
+
+
+def tag_file(path):
+    tags = Mp4TagsClass(
+        title="Сталкер",
+        year="1979",
+        kpid="43911",
+        country=["СССР"],
+        rating="8.1",
+        directors=["Андрей Тарковский"],
+        actors=["Александр Кайдановский", "Анатолий Солоницын", "Николай Гринько"],
+        description="Описание фильма " * 40,
+        genres=["фантастика", "драма"],
+        main_genre="фантастика",
+        has_cover=True,
+        cover=Image.new("RGB", (360, 540), "gray"),
+    )
+    write_tags(path, tags)
+
+
+def measure(func, path, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(path)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=170000, help="число видеокадров (размер таблиц сэмплов)")
+    parser.add_argument("--mdat-mb", type=int, default=2048, help="размер mdat в мегабайтах")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--dir", help="каталог для тестовых файлов (по умолчанию временный)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        print(f"{'файл':<12} {'mutagen, мс':>12} {'mmap, мс':>10} {'ускорение':>10}")
+        for name, moov_at_end in (("moov-front", False), ("moov-end", True)):
+            path = os.path.join(tmp, f"{name}.mp4")
+            make_mp4(path, frames=args.frames, mdat_size=args.mdat_mb * 1024 * 1024, moov_at_end=moov_at_end)
+            tag_file(path)
+            assert read_tags(path).title == read_tags(path, fast=False).title
+            slow = measure(lambda p: read_tags(p, fast=False), path, args.repeat)
+            fast = measure(read_tags, path, args.repeat)
+            print(f"{name:<12} {slow * 1000:>12.2f} {fast * 1000:>10.2f} {slow / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Набор бенчмарков kl_tag на синтетическом корпусе, без доступа к сети.
+
+Замеряются чтение тегов (`ReadTags`), сохранение (`onSaveTags`), `get_meta`,
+подготовка постера (`image_cut`), разбор страницы из буфера обмена
+(`get_from_buffer`) и `get_film_info` с локальной заглушкой API Кинопоиска.
+Результаты записываются в JSON для сравнения запусков.
+
+    python benchmarks/suite.py -o before.json
+    python benchmarks/suite.py -o after.json --large-mdat-mb 2048
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import threading
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image  # noqa: E402
+
+from engine import get_meta, read_tags, write_tags  # noqa: E402
+from covers import image_cut, normalize_poster  # noqa: E402
+from metacache import MetaCache, set_meta_cache  # noqa: E402
+from kpcache import FilmCache, set_cache  # noqa: E402
+from synthetic import make_corpus, make_mp4, make_poster, make_tags  # noqa: E402
+
+FILM_ID = 43911
+
+PAGE_TEXT = "\n".join(
+    [
+        "Сталкер (1979)",
+        "Stalker",
+        "Год производства",
+        "1979",
+        "Страна",
+        "СССР",
+        "Жанр",
+        "фантастика, драма, детектив",
+        "Режиссер",
+        "Андрей Тарковский",
+        "В главных ролях",
+        *[f"Актёр Актёрович Кайдановский-{i}" for i in range(10)],
+        "15 актеров",
+        "Рейтинг Кинопоиска",
+        "8.1",
+        "Видно только вам",
+        *["Где-то в глубине Зоны есть комната, в которой исполняются самые сокровенные желания."] * 5,
+        "Рейтинг фильма",
+        "8.1",
+    ]
+)
+
+
+# --- заглушка API Кинопоиска ---
+
+
+def film_json(film_id, base_url):
+    return {
+        "kinopoiskId": film_id,
+        "nameRu": "Сталкер",
+        "nameOriginal": "Stalker",
+        "year": 1979,
+        "countries": [{"country": "СССР"}],
+        "ratingKinopoisk": 8.1,
+        "ratingImdb": 8.0,
+        "description": "Где-то в глубине Зоны есть комната, в которой исполняются самые сокровенные желания. " * 5,
+        "genres": [{"genre": "фантастика"}, {"genre": "драма"}, {"genre": "детектив"}],
+        "posterUrl": f"{base_url}/posters/{film_id}.jpg",
+        "posterUrlPreview": f"{base_url}/posters/preview/{film_id}.jpg",
+    }
+
+
+STAFF_JSON = [{"professionText": "Режиссеры", "nameRu": "Андрей Тарковский", "nameEn": "Andrei Tarkovsky"}] + [
+    {"professionText": "Актеры", "nameRu": f"Актёр Актёрович Кайдановский-{i}", "nameEn": ""} for i in range(20)
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+    # заголовки и тело уходят одной записью без задержки Nagle: иначе ответ
+    # на keep-alive соединении ждёт отложенного ACK (~40 мс) и замер показывает заглушку
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    poster = b""
+    preview = b""
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        base_url = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+        if url.path.startswith("/api/v2.2/films/"):
+            body = json.dumps(film_json(int(url.path.rsplit("/", 1)[1]), base_url)).encode()
+            content_type = "application/json"
+        elif url.path == "/api/v1/staff" and "filmId" in parse_qs(url.query):
+            body = json.dumps(STAFF_JSON).encode()
+            content_type = "application/json"
+        elif url.path.startswith("/posters/preview/"):
+            body = self.preview
+            content_type = "image/jpeg"
+        elif url.path.startswith("/posters/"):
+            body = self.poster
+            content_type = "image/jpeg"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # клиент обрывает загрузку мелкого превью после заголовка изображения
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_stub_server(poster: bytes, latency: float, preview: bytes | None = None):
+    handler = type("Handler", (StubHandler,), {"poster": poster, "preview": preview or poster, "latency": latency})
+    server = StubServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# --- замеры ---
+
+
+def measure(func, repeat, setup=None) -> dict:
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        "repeat": repeat,
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": times[0] * 1000,
+        "p95_ms": times[min(len(times) - 1, round(len(times) * 0.95))] * 1000,
+        "mean_ms": statistics.fmean(times) * 1000,
+    }
+
+
+class Suite:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, name, case, func, repeat=None, setup=None, **params):
+        result = {"name": name, "case": case, **params, **measure(func, repeat or self.repeat, setup)}
+        self.results.append(result)
+        print(f"{name:<22} {case:<28} {result['median_ms']:>10.3f} мс (p95 {result['p95_ms']:.3f})", flush=True)
+
+
+def bench_files(suite, corpus, tmp):
+    for item in corpus:
+        case = f"{item.size}/{item.moov}/{'cover' if item.cover else 'nocover'}"
+        suite.run("read_tags", case, lambda: read_tags(item.path))
+        suite.run("read_tags_mutagen", case, lambda: read_tags(item.path, fast=False))
+        suite.run("get_meta", case, lambda: get_meta(item.path, use_cache=False))
+
+        # сохранение как в onSaveTags: изменён один тег, запись на месте в запас
+        tags = read_tags(item.path)
+        counter = iter(range(10**9))
+
+        def edit():
+            tags.title = f"Сталкер. Редакция {next(counter)}"
+
+        suite.run("write_tags", case, lambda: write_tags(item.path, tags), setup=edit)
+
+    # первое сохранение в файл без запаса - перезапись файла целиком
+    source = os.path.join(tmp, "untagged.mp4")
+    make_mp4(source)
+    target = os.path.join(tmp, "untagged-copy.mp4")
+    tags = make_tags(0, make_poster())
+    suite.run("write_tags_rewrite", "small/front/cover", lambda: write_tags(target, tags, force=True), setup=lambda: shutil.copyfile(source, target))
+
+    cache = MetaCache(os.path.join(tmp, "meta.sqlite"))
+    set_meta_cache(cache)
+    path = corpus[-1].path
+    get_meta(path)
+    suite.run("get_meta_cached", "large/end/cover", lambda: get_meta(path))
+    set_meta_cache(None)
+    cache.close()
+
+
+def bench_covers(suite):
+    for size in ((360, 540), (1000, 1500), (2000, 3000), (1920, 1080)):
+        data = make_poster(size)
+        case = f"{size[0]}x{size[1]}"
+        suite.run("image_cut", case, lambda: image_cut(Image.open(io.BytesIO(data))).convert("RGB"))
+        suite.run("normalize_poster", case, lambda: normalize_poster(data))
+
+
+def bench_buffer(suite):
+    from kinopoisk import parse_page_text
+
+    assert parse_page_text(PAGE_TEXT)["title"] == "Сталкер"
+    suite.run("get_from_buffer", "page_text", lambda: parse_page_text(PAGE_TEXT), repeat=suite.repeat * 10)
+
+
+def bench_kinopoisk(suite, tmp, latency):
+    from kinopoisk import KinopoiskClient
+
+    server, base_url = start_stub_server(make_poster((1000, 1500)), latency, make_poster((400, 600)))
+    cache = FilmCache(os.path.join(tmp, "kinopoisk"))
+    set_cache(cache)
+    try:
+        with KinopoiskClient(api_url=base_url, token="stub") as client:
+            assert client.get_film_info(FILM_ID)["title"] == "Сталкер"
+            case = f"stub/latency={latency * 1000:.0f}ms"
+            suite.run("get_film_info_cold", case, lambda: client.get_film_info(FILM_ID), setup=cache.clear, latency_ms=latency * 1000)
+            suite.run("get_film_info_cached", case, lambda: client.get_film_info(FILM_ID), latency_ms=latency * 1000)
+    finally:
+        set_cache(None)
+        server.shutdown()
+        server.server_close()
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="файл для результатов JSON (по умолчанию bench-<время>.json)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--large-frames", type=int, default=170000, help="число кадров большого файла")
+    parser.add_argument("--large-mdat-mb", type=int, default=512, help="размер mdat большого файла, Мб")
+    parser.add_argument("--latency-ms", type=float, default=20, help="задержка ответа заглушки API")
+    parser.add_argument("--only", nargs="*", choices=["files", "covers", "buffer", "kinopoisk"], help="запустить только эти группы")
+    parser.add_argument("--dir", help="каталог для корпуса (по умолчанию временный)")
+    args = parser.parse_args(argv)
+    groups = set(args.only or ["files", "covers", "buffer", "kinopoisk"])
+
+    suite = Suite(args.repeat)
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        if "files" in groups:
+            corpus = make_corpus(tmp, large_frames=args.large_frames, large_mdat_mb=args.large_mdat_mb)
+            bench_files(suite, corpus, tmp)
+        if "covers" in groups:
+            bench_covers(suite)
+        if "buffer" in groups:
+            bench_buffer(suite)
+        if "kinopoisk" in groups:
+            bench_kinopoisk(suite, tmp, args.latency_ms / 1000)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {"repeat": args.repeat, "large_frames": args.large_frames, "large_mdat_mb": args.large_mdat_mb, "latency_ms": args.latency_ms},
+        "results": suite.results,
+    }
+    output = args.output or f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Генерация синтетических MP4 файлов для бенчмарков (без сети и без ffmpeg).
+
+Файлы содержат корректную структуру `moov` с таблицами сэмплов нужного размера,
+а `mdat` заполняется нулями (на большинстве файловых систем - разреженно).
+"""
+
+import io
+import os
+import struct
+from typing import NamedTuple
+
+from PIL import Image, ImageFilter
+
+__all__ = ["make_mp4", "make_poster", "make_tags", "make_corpus", "CorpusFile"]
+
+
+def box(box_type: bytes, payload=b"") -> bytes:
+    return struct.pack(">I", 8 + len(payload)) + box_type + payload
+
+
+def full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return box(box_type, struct.pack(">I", (version << 24) | flags) + payload)
+
+
+MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+def visual_entry(width, height, codec=b"avc1") -> bytes:
+    payload = b"\0" * 6 + struct.pack(">H", 1) + b"\0" * 16 + struct.pack(">HH", width, height)
+    payload += struct.pack(">II", 0x480000, 0x480000) + b"\0" * 4 + struct.pack(">H", 1) + b"\0" * 32 + struct.pack(">Hh", 24, -1)
+    return box(codec, payload)
+
+
+def audio_entry() -> bytes:
+    payload = b"\0" * 6 + struct.pack(">H", 1) + b"\0" * 8 + struct.pack(">HHHHI", 2, 16, 0, 0, 48000 << 16)
+    return box(b"mp4a", payload + box(b"btrt", b"\0" * 12))
+
+
+def text_entry() -> bytes:
+    return box(b"tx3g", b"\0" * 6 + struct.pack(">H", 1) + b"\0" * 30)
+
+
+def trak(track_id, handler, entry, timescale, deltas, sample_size, chunk_offset) -> bytes:
+    """Дорожка: `deltas` - список пар (число сэмплов, длительность), все сэмплы в одном чанке."""
+    sample_count = sum(count for count, _ in deltas)
+    duration = sum(count * delta for count, delta in deltas)
+    tkhd = full_box(b"tkhd", 0, 3, struct.pack(">5I", 0, 0, track_id, 0, duration) + b"\0" * 16 + MATRIX + struct.pack(">II", 0, 0))
+    mdhd = full_box(b"mdhd", 0, 0, struct.pack(">4I", 0, 0, timescale, duration) + struct.pack(">HH", 0x55C4, 0))
+    hdlr = full_box(b"hdlr", 0, 0, b"\0" * 4 + handler + b"\0" * 12 + b"\0")
+    stsd = full_box(b"stsd", 0, 0, struct.pack(">I", 1) + entry)
+    stts = full_box(b"stts", 0, 0, struct.pack(">I", len(deltas)) + b"".join(struct.pack(">II", c, d) for c, d in deltas))
+    stsc = full_box(b"stsc", 0, 0, struct.pack(">4I", 1, 1, sample_count, 1))
+    # явная таблица размеров, как в реальных файлах (основная часть размера moov)
+    stsz = full_box(b"stsz", 0, 0, struct.pack(">II", 0, sample_count) + struct.pack(">I", sample_size) * sample_count)
+    stco = full_box(b"stco", 0, 0, struct.pack(">II", 1, chunk_offset))
+    stbl = box(b"stbl", stsd + stts + stsc + stsz + stco)
+    minf = box(b"minf", stbl)
+    return box(b"trak", tkhd + box(b"mdia", mdhd + hdlr + minf))
+
+
+def make_mp4(
+    path,
+    frames=2000,
+    mdat_size=1024 * 1024,
+    moov_at_end=False,
+    width=1920,
+    height=800,
+    audio_tracks=1,
+    subtitle_tracks=0,
+    vfr=False,
+    codec=b"avc1",
+):
+    """Создание файла MP4 без тегов. `mdat_size` может быть больше 4 Гб.
+
+    `codec` - тип описания видеодорожки; сэмплы нулевые, поэтому для сравнения
+    с ffprobe нужен `b"raw "`, который ffprobe не пытается декодировать.
+    """
+    ftyp = box(b"ftyp", b"isom" + struct.pack(">I", 0x200) + b"isomiso2avc1mp41")
+    video_deltas = [(frames, 1001)] if not vfr else [(frames // 2, 1001), (frames - frames // 2, 2002)]
+    audio_frames = frames * 2
+
+    def build_moov(chunk_offset):
+        # как у муксеров: длительность самой длинной дорожки
+        durations = [sum(c * d for c, d in video_deltas) * 1000 // 24000]
+        if audio_tracks:
+            durations.append(audio_frames * 1024 * 1000 // 48000)
+        if subtitle_tracks:
+            durations.append(10 * 1000)
+        mvhd_duration = max(durations)
+        mvhd = full_box(
+            b"mvhd",
+            0,
+            0,
+            struct.pack(">4IIH", 0, 0, 1000, mvhd_duration, 0x10000, 0x100)
+            + b"\0" * 10
+            + MATRIX
+            + b"\0" * 24
+            + struct.pack(">I", 2 + audio_tracks + subtitle_tracks),
+        )
+        tracks = trak(1, b"vide", visual_entry(width, height, codec), 24000, video_deltas, max(1, mdat_size // frames), chunk_offset)
+        for i in range(audio_tracks):
+            tracks += trak(2 + i, b"soun", audio_entry(), 48000, [(audio_frames, 1024)], 32, chunk_offset)
+        for i in range(subtitle_tracks):
+            tracks += trak(2 + audio_tracks + i, b"sbtl", text_entry(), 1000, [(10, 1000)], 16, chunk_offset)
+        return box(b"moov", mvhd + tracks)
+
+    large = mdat_size + 8 > 0xFFFFFFFF
+    mdat_header = struct.pack(">I4sQ", 1, b"mdat", mdat_size + 16) if large else struct.pack(">I4s", mdat_size + 8, b"mdat")
+
+    with open(path, "wb") as f:
+        if moov_at_end:
+            f.write(ftyp + mdat_header)
+            f.seek(mdat_size, os.SEEK_CUR)
+            f.write(build_moov(len(ftyp) + len(mdat_header)))
+        else:
+            moov_size = len(build_moov(0))
+            chunk_offset = len(ftyp) + moov_size + len(mdat_header)
+            f.write(ftyp + build_moov(chunk_offset) + mdat_header)
+            f.truncate(chunk_offset + mdat_size)
+    return path
+
+
+def make_poster(size=(360, 540), quality=90) -> bytes:
+    """JPEG, похожий на фотографию: градиент с размытым шумом."""
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 60).filter(ImageFilter.GaussianBlur(2))
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_TOP_BOTTOM)))
+    image_file = io.BytesIO()
+    image.save(image_file, format="JPEG", quality=quality)
+    return image_file.getvalue()
+
+
+def make_tags(n=0, cover: bytes | None = None):
+    """Теги с большим объёмом кириллицы (длинное описание, 10 актёров)."""
+    from engine import Mp4TagsClass
+    from covers import LazyCover
+
+    return Mp4TagsClass(
+        title=f"Сталкер. Фильм номер {n}",
+        year=str(1970 + n % 50),
+        kpid=str(43911 + n),
+        country=["СССР", "Германия (ФРГ)"],
+        rating="8.1",
+        directors=["Андрей Тарковский"],
+        actors=[f"Актёр Актёрович Кайдановский-{i}" for i in range(10)],
+        description="Где-то в глубине Зоны есть комната, в которой исполняются самые сокровенные желания. " * 25,
+        genres=["фантастика", "драма", "детектив"],
+        main_genre="фантастика",
+        has_cover=cover is not None,
+        cover=LazyCover(cover) if cover is not None else None,
+        is_ok=True,
+    )
+
+
+class CorpusFile(NamedTuple):
+    path: str
+    size: str  # "small" или "large"
+    moov: str  # "front" или "end"
+    cover: bool
+
+
+def make_corpus(directory, large_frames=170000, large_mdat_mb=512) -> list[CorpusFile]:
+    """Все сочетания: маленький/большой файл, `moov` в начале/в конце, с постером/без."""
+    from engine import write_tags
+
+    poster = make_poster()
+    corpus = []
+    n = 0
+    for size, frames, mdat_size in (("small", 2000, 1024 * 1024), ("large", large_frames, large_mdat_mb * 1024 * 1024)):
+        for moov in ("front", "end"):
+            for cover in (False, True):
+                path = os.path.join(directory, f"{size}-{moov}-{'cover' if cover else 'nocover'}.mp4")
+                make_mp4(path, frames=frames, mdat_size=mdat_size, moov_at_end=moov == "end")
+                write_tags(path, make_tags(n, poster if cover else None), force=True)
+                corpus.append(CorpusFile(path, size, moov, cover))
+                n += 1
+    return corpus
@@ -0,0 +1,251 @@
+"""Консольный интерфейс kl_tag для пакетной обработки файлов.
+
+Примеры:
+    python cli.py read "D:\\Films\\Film (2000).mp4"
+    python cli.py apply D:\\Films --from-kp -j 8
+    python cli.py --kp-replay fixtures --kp-latency-ms 50 apply D:\\Films --from-kp --dry-run
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from dataclasses import fields
+
+import metrics
+from engine import DEFAULT_PADDING, BatchStats, CoverPolicy, list_media, read_tags, repad, run_batch, warm_meta_cache
+
+
+def cmd_read(args):
+    for path in list_media(args.path, args.recursive):
+        tags = read_tags(path)
+        # без asdict(): он копирует все поля, включая байты постера
+        data = {f.name: getattr(tags, f.name) for f in fields(tags) if f.name != "cover"}
+        data["path"] = path
+        print(json.dumps(data, ensure_ascii=False))
+    return 0
+
+
+def cmd_apply(args):
+    paths = list_media(args.path, args.recursive)
+    if not paths:
+        print(f"Не найдено файлов MP4: {args.path}", file=sys.stderr)
+        return 1
+
+    stats = BatchStats()
+    start = time.perf_counter()
+    cover_policy = CoverPolicy(args.cover_format.upper() if args.cover_format != "source" else "source", args.cover_quality)
+    batch = run_batch(paths, jobs=args.jobs, from_kp=args.from_kp, dry_run=args.dry_run, padding=args.padding * 1024, cover_policy=cover_policy)
+    for result in batch:
+        stats.add(result)
+        message = f": {result.message}" if result.message else ""
+        print(f"[{result.status}] {os.path.basename(result.path)} ({result.elapsed:.2f} с){message}", flush=True)
+    stats.elapsed = time.perf_counter() - start
+
+    counts = ", ".join(f"{status}: {count}" for status, count in stats.counts.items())
+    print(f"Файлов: {stats.total} ({counts}), время: {stats.elapsed:.1f} с, {stats.throughput:.2f} файлов/с")
+    return 1 if stats.counts["error"] else 0
+
+
+def cmd_repad(args):
+    errors = 0
+    for path in list_media(args.path, args.recursive):
+        try:
+            report = repad(path, args.padding * 1024)
+        except Exception as error:
+            errors += 1
+            print(f"[error] {os.path.basename(path)}: {error}", flush=True)
+            continue
+        print(f"[ok] {os.path.basename(path)}: {report}", flush=True)
+    return 1 if errors else 0
+
+
+def cmd_probe(args):
+    start = time.perf_counter()
+    probed = sum(warm_meta_cache(path, jobs=args.jobs, recursive=args.recursive) for path in args.paths)
+    print(f"Получена информация о файлах: {probed}, время: {time.perf_counter() - start:.1f} с")
+    return 0
+
+
+def cmd_index(args):
+    from library import LibraryIndex
+
+    index = LibraryIndex(args.db)
+    start = time.perf_counter()
+    on_file = (lambda path, status: print(f"[{status}] {path}", flush=True)) if args.verbose else None
+    stats = index.rescan(args.paths, jobs=args.jobs, on_file=on_file)
+    print(
+        f"Добавлено: {stats.added}, обновлено: {stats.updated}, удалено: {stats.removed}, "
+        f"без изменений: {stats.unchanged}, ошибок: {stats.errors}, время: {time.perf_counter() - start:.1f} с"
+    )
+    if args.watch:
+        return watch_index(index, args.paths, args.interval, on_file)
+    return 1 if stats.errors else 0
+
+
+def watch_index(index, paths, interval, on_file=None):
+    """Обновление индекса по изменениям в каталогах до Ctrl+C."""
+    from queue import Queue, Empty
+    from watcher import DirectoryWatcher
+
+    # изменения из потоков отслеживания применяются по очереди в основном потоке
+    queue = Queue()
+    watchers = [DirectoryWatcher(path, queue.put, interval=interval).start() for path in paths]
+    print("Отслеживание изменений, Ctrl+C - выход", flush=True)
+    try:
+        while True:
+            try:
+                changes = queue.get(timeout=1)
+            except Empty:
+                continue
+            stats = index.apply(changes, on_file=on_file)
+            print(f"Добавлено: {stats.added}, обновлено: {stats.updated}, удалено: {stats.removed}, ошибок: {stats.errors}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for watcher in watchers:
+            watcher.stop()
+    return 0
+
+
+def cmd_query(args):
+    from library import LibraryIndex
+
+    index = LibraryIndex(args.db)
+    if args.no_cover:
+        rows = index.without_cover()
+    elif args.no_kpid:
+        rows = index.without_kpid()
+    else:
+        year_from, _, year_to = (args.years or "").partition("-")
+        rows = index.find(args.genre, int(year_from) if year_from else None, int(year_to or year_from) if args.years else None)
+    for row in rows:
+        if args.json:
+            print(json.dumps(row, ensure_ascii=False))
+        else:
+            print(f"{row['path']}\t{row['title']}\t{row['year']}\t{row['kpid']}")
+    return 0
+
+
+def cmd_audit(args):
+    from audit import run_audit
+
+    start = time.perf_counter()
+
+    def on_row(row):
+        if args.verbose or row["status"] != "ok":
+            message = f": {row['error']}" if row["error"] else ""
+            print(f"[{row['status']}] {row['path']} ({row['elapsed']:.2f} с){message}", flush=True)
+
+    stats = run_audit(
+        args.paths,
+        args.output,
+        args.format,
+        jobs=args.jobs,
+        timeout=args.timeout,
+        resume=not args.restart,
+        use_cache=not args.no_cache,
+        on_row=on_row,
+        retry_failed=args.retry_failed,
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"Проверено: {stats.total} (ok: {stats.ok}, VFR: {stats.vfr}, ошибок: {stats.errors}, таймаутов: {stats.timeouts}), "
+        f"пропущено (уже в отчёте): {stats.skipped}, время: {elapsed:.1f} с, {stats.total / elapsed if elapsed else 0:.2f} файлов/с"
+    )
+    return 1 if stats.errors or stats.timeouts else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="kl-tag", description="Kinolist Tag Editor: пакетная обработка тегов MP4")
+    parser.add_argument("--metrics", metavar="FILE", help="записать время этапов и счётчики (.prom - формат Prometheus, иначе JSON lines)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--kp-record", metavar="DIR", help="сохранять ответы API Кинопоиска и постеры в каталог с фикстурами")
+    group.add_argument("--kp-replay", metavar="DIR", help="отвечать на запросы к Кинопоиску из каталога с фикстурами, без сети и токена")
+    parser.add_argument("--kp-latency-ms", type=float, default=0, help="задержка ответов при --kp-replay, мс")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_read = subparsers.add_parser("read", help="вывести теги в формате JSON (по строке на файл)")
+    p_read.add_argument("path", help="файл MP4 или каталог")
+    p_read.add_argument("-r", "--recursive", action="store_true", help="включая подкаталоги")
+    p_read.set_defaults(func=cmd_read)
+
+    p_apply = subparsers.add_parser("apply", help="прочитать, обновить и записать теги всех файлов")
+    p_apply.add_argument("path", help="файл MP4 или каталог")
+    p_apply.add_argument("-r", "--recursive", action="store_true", help="включая подкаталоги")
+    p_apply.add_argument("--from-kp", action="store_true", help="загрузить теги из Кинопоиска по kpid файла")
+    p_apply.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="число рабочих процессов (по умолчанию: число ядер)")
+    p_apply.add_argument("--dry-run", action="store_true", help="не записывать изменения в файлы")
+    p_apply.add_argument("--padding", type=int, default=DEFAULT_PADDING // 1024, help="запас места под теги при перезаписи, Кб")
+    p_apply.add_argument("--cover-format", choices=["source", "jpeg", "png"], default="source", help="формат постеров (по умолчанию как у исходника)")
+    p_apply.add_argument("--cover-quality", type=int, default=90, help="качество JPEG для постеров")
+    p_apply.set_defaults(func=cmd_apply)
+
+    p_repad = subparsers.add_parser("repad", help="один раз выделить запас места под теги, чтобы следующие сохранения шли на месте")
+    p_repad.add_argument("path", help="файл MP4 или каталог")
+    p_repad.add_argument("-r", "--recursive", action="store_true", help="включая подкаталоги")
+    p_repad.add_argument("--padding", type=int, default=DEFAULT_PADDING // 1024, help="размер запаса, Кб")
+    p_repad.set_defaults(func=cmd_repad)
+
+    p_probe = subparsers.add_parser("probe", help="заранее заполнить кэш технической информации (ffprobe) для каталогов")
+    p_probe.add_argument("paths", nargs="+", help="каталоги или файлы MP4")
+    p_probe.add_argument("-r", "--recursive", action="store_true", help="включая подкаталоги")
+    p_probe.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="число потоков")
+    p_probe.set_defaults(func=cmd_probe)
+
+    p_index = subparsers.add_parser("index", help="обновить индекс библиотеки (перечитываются только изменённые файлы)")
+    p_index.add_argument("paths", nargs="+", help="каталоги библиотеки")
+    p_index.add_argument("--db", help="файл индекса SQLite")
+    p_index.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="число рабочих процессов")
+    p_index.add_argument("-v", "--verbose", action="store_true", help="выводить каждый перечитанный файл")
+    p_index.add_argument("--watch", action="store_true", help="после обновления отслеживать изменения в каталогах и обновлять индекс")
+    p_index.add_argument("--interval", type=float, default=5, help="период опроса каталогов, где недоступен inotify, с")
+    p_index.set_defaults(func=cmd_index)
+
+    p_audit = subparsers.add_parser("audit", help="техническая проверка всех файлов (разрешение, битрейт, длительность, дорожки, VFR)")
+    p_audit.add_argument("paths", nargs="+", help="каталоги или файлы")
+    p_audit.add_argument("-o", "--output", required=True, help="файл отчёта (.csv или JSON lines)")
+    p_audit.add_argument("--format", choices=["csv", "jsonl"], help="формат отчёта (по умолчанию по расширению файла)")
+    p_audit.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="число рабочих процессов")
+    p_audit.add_argument("--timeout", type=float, default=60, help="время на один файл, с")
+    p_audit.add_argument("--restart", action="store_true", help="перезаписать отчёт вместо продолжения прерванной проверки")
+    p_audit.add_argument("--retry-failed", action="store_true", help="при продолжении проверить заново файлы с ошибкой или таймаутом")
+    p_audit.add_argument("--no-cache", action="store_true", help="не использовать кэш get_meta")
+    p_audit.add_argument("-v", "--verbose", action="store_true", help="выводить каждый файл, а не только ошибки")
+    p_audit.set_defaults(func=cmd_audit)
+
+    p_query = subparsers.add_parser("query", help="поиск по индексу библиотеки")
+    p_query.add_argument("--db", help="файл индекса SQLite")
+    group = p_query.add_mutually_exclusive_group()
+    group.add_argument("--no-cover", action="store_true", help="файлы без постера")
+    group.add_argument("--no-kpid", action="store_true", help="файлы без kpid")
+    p_query.add_argument("--genre", help="жанр, например «драма»")
+    p_query.add_argument("--years", help="год или диапазон, например 1970-1980")
+    p_query.add_argument("--json", action="store_true", help="вывод в формате JSON (по строке на файл)")
+    p_query.set_defaults(func=cmd_query)
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s]%(levelname)s:%(name)s:%(message)s", datefmt="%d.%m.%Y %H:%M:%S")
+    args = build_parser().parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+    if args.kp_record or args.kp_replay:
+        import transport
+
+        if args.kp_record:
+            transport.configure("record", args.kp_record)
+        else:
+            transport.configure("replay", args.kp_replay, args.kp_latency_ms / 1000)
+    try:
+        return args.func(args)
+    finally:
+        if args.metrics:
+            metrics.registry.dump(args.metrics)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""Работа с постерами: ленивое декодирование и подготовка изображения для записи."""
+
+import io
+import math
+import struct
+import threading
+from itertools import repeat
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from metrics import span, timed
+
+__all__ = [
+    "LazyCover",
+    "CoverPolicy",
+    "get_cover_policy",
+    "set_cover_policy",
+    "prepare_cover",
+    "normalize_poster",
+    "normalize_posters",
+    "fits_poster",
+    "large_enough",
+    "image_size",
+    "as_image",
+    "image_to_file",
+    "image_cut",
+]
+
+POSTER_SIZE = (360, 540)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# маркеры SOF, содержащие размеры кадра (кроме DHT, JPG и DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _png_header(data) -> tuple[int, int] | None:
+    if len(data) >= 24 and data[:8] == PNG_SIGNATURE and data[12:16] == b"IHDR":
+        return struct.unpack_from(">II", data, 16)
+    return None
+
+
+def _jpeg_header(data) -> tuple[int, int] | None:
+    if data[:2] != b"\xff\xd8":
+        return None
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:  # заполняющий байт
+            offset += 1
+            continue
+        (length,) = struct.unpack_from(">H", data, offset + 2)
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > len(data):
+                return None
+            height, width = struct.unpack_from(">HH", data, offset + 5)
+            return (width, height)
+        offset += 2 + length
+    return None
+
+
+def image_size(data) -> tuple[int, int] | None:
+    """Размер JPEG или PNG по заголовку (достаточно начала файла), иначе None."""
+    return _png_header(data) or _jpeg_header(data)
+
+
+class LazyCover:
+    """Постер, хранящийся в виде исходных байтов.
+
+    Формат и размер определяются по заголовку файла, пиксели декодируются только
+    при первом обращении к `image`.
+    """
+
+    __slots__ = ("data", "format", "size", "_image")
+
+    def __init__(self, data: bytes):
+        self.data = data  # без копирования: MP4Cover из mutagen - это bytes
+        self._image = None
+        if (size := _png_header(data)) is not None:
+            self.format = "PNG"
+            self.size = size
+        elif (size := _jpeg_header(data)) is not None:
+            self.format = "JPEG"
+            self.size = size
+        else:
+            # PIL читает только заголовок, декодирование происходит при load()
+            with Image.open(io.BytesIO(data)) as image:
+                self.format = image.format
+                self.size = image.size
+
+    @property
+    def image(self) -> Image.Image:
+        if self._image is None:
+            with span("cover_decode"):
+                self._image = Image.open(io.BytesIO(self.data))
+                self._image.load()
+        return self._image
+
+    @property
+    def decoded(self) -> bool:
+        return self._image is not None
+
+    def save(self, path):
+        """Сохранение в файл. Если формат файла совпадает с исходным, байты пишутся как есть."""
+        extension = path.rsplit(".", 1)[-1].lower()
+        if Image.registered_extensions().get(f".{extension}") == self.format:
+            with open(path, "wb") as f:
+                f.write(self.data)
+        else:
+            self.image.save(path)
+
+    def __repr__(self):
+        return f"LazyCover({self.format}, {self.size[0]}×{self.size[1]}, {len(self.data)} bytes)"
+
+
+def as_image(cover: "LazyCover | Image.Image") -> Image.Image:
+    """PIL изображение для постера любого вида."""
+    if isinstance(cover, LazyCover):
+        return cover.image
+    return cover
+
+
+def image_to_file(image):
+    """Return `image` as PNG file-like object."""
+    image_file = io.BytesIO()
+    as_image(image).save(image_file, format="PNG")
+    return image_file
+
+
+def image_cut(image: Image.Image):
+    width, height = image.size
+    # обрезка до соотношения сторон 1x1.5
+    if width > (height / 1.5):
+        image = image.crop((((width - height / 1.5) / 2), 0, ((width - height / 1.5) / 2) + height / 1.5, height))
+    elif height > (1.5 * width):
+        image = image.crop((0, ((height - width * 1.5) / 2), width, ((height + width * 1.5) / 2)))
+    image.thumbnail((360, 540))
+    return image
+
+
+def _cut_box(width, height) -> tuple[int, int, int, int]:
+    """Область обрезки до 1x1.5 как в `image_cut` (с округлением как в `Image.crop`)."""
+    if width > (height / 1.5):
+        box = (((width - height / 1.5) / 2), 0, ((width - height / 1.5) / 2) + height / 1.5, height)
+    elif height > (1.5 * width):
+        box = (0, ((height - width * 1.5) / 2), width, ((height + width * 1.5) / 2))
+    else:
+        box = (0, 0, width, height)
+    return tuple(round(x) for x in box)
+
+
+def _thumbnail_size(size, max_size) -> tuple[int, int]:
+    """Размер, который получится после `Image.thumbnail(max_size)`."""
+    width, height = size
+    x, y = max_size
+    if x >= width and y >= height:
+        return size
+    aspect = width / height
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    if x / y >= aspect:
+        x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else:
+        y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+    return (x, y)
+
+
+@timed("cover_normalize")
+def normalize_poster(source: "bytes | str | Image.Image", size=POSTER_SIZE, draft_gap=1.0, reducing_gap=2.0) -> Image.Image:
+    """Постер в RGB, обрезанный до 1x1.5 и уменьшенный до `size` так же, как `image_cut`.
+
+    JPEG сразу декодируется в уменьшенном виде (1/2, 1/4 или 1/8, `Image.draft`),
+    так чтобы обрезанная область была не меньше `size * draft_gap`, поэтому
+    оригиналы 2000×3000 не распаковываются в полном разрешении.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(source))
+    elif isinstance(source, str):
+        image = Image.open(source)
+    else:
+        image = source
+    width, height = image.size
+    left, top, right, bottom = box = _cut_box(width, height)
+    crop_size = (right - left, bottom - top)
+    final_size = _thumbnail_size(crop_size, size)
+    if final_size == crop_size:
+        return (image if crop_size == (width, height) else image.crop(box)).convert("RGB")
+
+    # запрашиваемый размер: после обрезки остаётся не меньше final_size * draft_gap
+    draft_size = (int(width * final_size[0] * draft_gap / crop_size[0]), int(height * final_size[1] * draft_gap / crop_size[1]))
+    draft = image.draft(None, draft_size)
+    if draft is not None:
+        scale = draft[1][2] / width
+        box = (left * scale, top * scale, right * scale, bottom * scale)
+    image = image.resize(final_size, Image.Resampling.BICUBIC, box=box, reducing_gap=reducing_gap)
+    return image.convert("RGB")
+
+
+def fits_poster(size) -> bool:
+    """Изображение уже имеет пропорции 1x1.5 и не больше `POSTER_SIZE`, обрезка не нужна."""
+    width, height = size
+    return width <= POSTER_SIZE[0] and height <= POSTER_SIZE[1] and abs(width - height / 1.5) < 1
+
+
+def large_enough(size, target=POSTER_SIZE) -> bool:
+    """После обрезки до 1x1.5 изображение не меньше `target`, постер не потеряет в разрешении."""
+    left, top, right, bottom = _cut_box(*size)
+    return right - left >= target[0] and bottom - top >= target[1]
+
+
+@dataclass(frozen=True)
+class CoverPolicy:
+    """Формат постеров, записываемых в файл.
+
+    `format`: "PNG", "JPEG" (с качеством `quality`) или "source" - формат исходного
+    изображения (JPEG для фотографий, PNG для PNG/GIF/BMP).
+    """
+
+    format: str = "source"
+    quality: int = 90
+
+    def target_format(self, source_format: str | None) -> str:
+        if self.format != "source":
+            return self.format
+        return "PNG" if source_format in ("PNG", "GIF", "BMP") else "JPEG"
+
+    def keeps(self, source_format: str | None) -> bool:
+        """Можно ли записать исходные байты без перекодирования."""
+        return source_format in ("JPEG", "PNG") and self.target_format(source_format) == source_format
+
+    def encode(self, image: Image.Image, source_format: str | None = None) -> LazyCover:
+        image_format = self.target_format(source_format)
+        image_file = io.BytesIO()
+        with span("cover_encode"):
+            if image_format == "JPEG":
+                image.convert("RGB").save(image_file, format="JPEG", quality=self.quality, optimize=True)
+            else:
+                image.save(image_file, format="PNG")
+        return LazyCover(image_file.getvalue())
+
+
+_policy = CoverPolicy()
+_policy_lock = threading.Lock()
+
+
+def get_cover_policy() -> CoverPolicy:
+    return _policy
+
+
+def set_cover_policy(policy: CoverPolicy):
+    global _policy
+    with _policy_lock:
+        _policy = policy
+
+
+def prepare_cover(cover: "LazyCover | Image.Image | bytes", policy: CoverPolicy | None = None) -> LazyCover:
+    """Постер для записи в файл: обрезка до 1x1.5, уменьшение и кодирование по `policy`.
+
+    Если изображение уже нужного размера и в подходящем формате, исходные
+    байты используются как есть, без декодирования.
+    """
+    policy = policy or get_cover_policy()
+    if isinstance(cover, (bytes, bytearray, memoryview)):
+        cover = LazyCover(bytes(cover))
+    if isinstance(cover, LazyCover):
+        if fits_poster(cover.size) and policy.keeps(cover.format):
+            return cover
+        source_format = cover.format
+        # отдельное декодирование, уже уменьшенное для JPEG (пиксели LazyCover не используются)
+        image = normalize_poster(cover.data)
+    else:
+        source_format = cover.format
+        image = normalize_poster(cover)
+    return policy.encode(image, source_format)
+
+
+def _prepare_cover_data(source, policy) -> bytes:
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            source = f.read()
+    return prepare_cover(source, policy).data
+
+
+def normalize_posters(sources, jobs=None, policy: CoverPolicy | None = None) -> list[LazyCover]:
+    """`prepare_cover` для нескольких постеров (байты или пути к файлам) в пуле процессов.
+
+    Порядок результатов совпадает с порядком `sources`.
+    """
+    policy = policy or get_cover_policy()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return [LazyCover(data) for data in executor.map(_prepare_cover_data, sources, repeat(policy))]
@@ -0,0 +1,641 @@
+"""Чтение и запись тегов MP4 без графического интерфейса.
+
+Модуль не зависит от wx и `ctypes.windll`, поэтому используется как из
+`kl_tag.py`, так и из консольной утилиты `cli.py` (в том числе на Linux).
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import logging
+import shutil
+import struct
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm, AtomDataType
+from PIL import Image
+
+from covers import CoverPolicy, LazyCover, as_image, get_cover_policy, set_cover_policy, prepare_cover
+from metacache import get_meta_cache, file_key
+from mp4box import Mp4ParseError, read_stream_info, read_ilst
+from metrics import span, count, timed, registry, enabled as metrics_enabled
+from scanner import scan, sort_key
+
+log = logging.getLogger("KL_Tag")
+
+
+def get_resource_path(relative_path):
+    try:
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+    return os.path.join(base_path, relative_path)
+
+
+def find_ffprobe():
+    """Путь к ffprobe: сначала поставляемый `ffprobe.exe`, затем найденный в PATH."""
+    bundled = get_resource_path("ffprobe.exe")
+    if os.path.isfile(bundled):
+        return bundled
+    return shutil.which("ffprobe") or bundled
+
+
+FFPROBE = find_ffprobe()
+
+
+def convert_bytes(num, is_rate=False):
+    for x in ["б", "Кб", "Мб", "Гб", "Тб"]:
+        if num < 1024.0:
+            if is_rate:
+                return f"{num:3.1f} {x}ит/с"
+            else:
+                return f"{num:3.1f} {x}"
+        num /= 1024.0
+
+
+def convert_seconds(input: str):
+    duration = int(float(input))
+    hours = int(duration // 3600)
+    remaining_seconds = duration % 3600
+    minutes = int(remaining_seconds // 60)
+    seconds = remaining_seconds % 60
+
+    # Форматирование строки вывода
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def check_framerate(r_frame_rate: str, avg_frame_rate: str):
+    """Проерка разницы между `r_frame_rate` и `avg_frame_rate`"""
+    THREASHOLD = 0.05
+    x, y = r_frame_rate.split("/")
+    r_frame_rate_float = float(x) / float(y)
+    x, y = avg_frame_rate.split("/")
+    avg_frame_rate_float = float(x) / float(y)
+    if abs(r_frame_rate_float - avg_frame_rate_float) > r_frame_rate_float * THREASHOLD:
+        return (avg_frame_rate_float, False)
+    return (avg_frame_rate_float, True)
+
+
+class ProbeCancelled(Exception):
+    """Получение информации о файле отменено (`cancel` установлен)."""
+
+
+def run_ffprobe_json(args: list[str], cancel: threading.Event | None = None) -> dict:
+    """Запуск ffprobe. Если установлен `cancel`, процесс завершается и бросается `ProbeCancelled`."""
+    try:
+        with subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            encoding="utf-8",
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+        ) as p, span("ffprobe"):
+            while True:
+                try:
+                    stdout, stderr = p.communicate(timeout=0.1 if cancel else None)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel.is_set():
+                        p.kill()
+                        p.communicate()
+                        raise ProbeCancelled(args[-1])
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, args, stdout, stderr)
+        if not stdout.strip():
+            return {}
+        return json.loads(stdout)
+    except ProbeCancelled:
+        raise
+    except Exception as e:
+        log.error(f"Не удалось выполнить ffprobe: {e}")
+        return {}
+
+
+def probe_meta(file, cancel: threading.Event | None = None):
+    """Техническая информация о файле (без кэша).
+
+    MP4 разбирается напрямую (`mp4box`), ffprobe запускается только для
+    контейнеров, которые не удалось разобрать.
+    """
+    try:
+        with span("mp4_parse"):
+            return read_stream_info(file)
+    except (Mp4ParseError, OSError, struct.error) as e:
+        log.info(f"Разбор MP4 не удался ({e}), используется ffprobe: {os.path.basename(file)}")
+    if cancel and cancel.is_set():
+        raise ProbeCancelled(file)
+    return ffprobe_meta(file, cancel)
+
+
+def ffprobe_meta(file, cancel: threading.Event | None = None):
+    """Техническая информация о файле через ffprobe."""
+    if not os.path.isfile(FFPROBE):
+        log.error(f'Не наден файл: "{FFPROBE}"!')
+        return {"ffprobe": False}
+    out_json = run_ffprobe_json([FFPROBE, "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", file], cancel)
+    audio_streams = 0
+    subtitle_streams = 0
+    for stream in out_json["streams"]:
+        if stream["codec_type"] == "audio":
+            audio_streams += 1
+        elif stream["codec_type"] == "subtitle":
+            subtitle_streams += 1
+
+    result = {}
+    if out_json["streams"][0]["codec_type"] != "video":
+        result["video"] = False
+        return result
+    else:
+        result["video"] = True
+
+    result["width"] = out_json["streams"][0]["width"]
+    result["height"] = out_json["streams"][0]["height"]
+    result["size"] = convert_bytes(int(out_json["format"]["size"]))
+    result["bit_rate"] = convert_bytes(int(out_json["format"]["bit_rate"]), is_rate=True)
+    result["audio_streams"] = audio_streams
+    result["subtitle_streams"] = subtitle_streams
+    result["running_time"] = convert_seconds(out_json["format"]["duration"])
+    result["framerate"], result["framerate_check"] = check_framerate(
+        out_json["streams"][0]["r_frame_rate"], out_json["streams"][0]["avg_frame_rate"]
+    )
+    return {"ffprobe": True, **result}
+
+
+def get_meta(file, use_cache=True, cancel: threading.Event | None = None):
+    """Техническая информация о файле. Повторный запуск ffprobe для неизменённого файла не выполняется.
+
+    Запущенный ffprobe завершается при установке `cancel`, в этом случае бросается `ProbeCancelled`.
+    """
+    cache = get_meta_cache() if use_cache else None
+    if cache:
+        result = cache.get(file)
+        if result is not None:
+            count("meta_cache_hit")
+            return result
+        count("meta_cache_miss")
+    key = file_key(file)
+    result = probe_meta(file, cancel)
+    if cache and result.get("ffprobe"):
+        cache.put(file, result, key)
+    return result
+
+
+def _probe_with_key(file):
+    key = file_key(file)
+    try:
+        return key, probe_meta(file)
+    except Exception as e:
+        log.error(f"Не удалось получить информацию о файле {file}: {e}")
+        return key, None
+
+
+def warm_meta_cache(paths, jobs=None, recursive=True) -> int:
+    """Параллельное заполнение кэша `get_meta` для каталога или списка файлов.
+
+    `paths` - каталог (файлы ищутся `scan`, с подкаталогами при `recursive`)
+    или список файлов. Файлы с актуальной записью в кэше пропускаются.
+    Возвращает число запусков ffprobe.
+    """
+    cache = get_meta_cache()
+    if cache is None:
+        return 0
+    if isinstance(paths, str):
+        paths = scan(paths, recursive)
+    paths = [path for path in paths if not cache.is_fresh(path)]
+    if not paths:
+        return 0
+    items = []
+    # разбор MP4 упирается в чтение с диска, а ffprobe - отдельный процесс, поэтому достаточно пула потоков
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        for key, result in executor.map(_probe_with_key, paths):
+            if key and result and result.get("ffprobe"):
+                items.append((key, result))
+    cache.put_many(items)
+    return len(paths)
+
+
+@dataclass
+class Mp4TagsClass:
+    title: str = ""
+    kpid: str = ""
+    year: str = ""
+    country: list | str = ""
+    rating: str = ""
+    directors: list | str = ""
+    actors: list | str = ""
+    description: str = ""
+    long_descriplion: str = ""
+    has_cover: bool = False
+    genres: list | str = ""
+    main_genre: str = ""
+    is_ok: bool = False
+    cover: LazyCover | Image.Image | str | None = None
+
+    def __setattr__(self, name, value):
+        # после mark_clean() запоминаем поля, значение которых действительно изменилось
+        if self.__dict__.get("_tracking") and name in TRACKED_FIELDS and name not in self._dirty:
+            if not _same_value(name, self.__dict__.get(name), value):
+                self._dirty.add(name)
+        object.__setattr__(self, name, value)
+
+    def mark_clean(self):
+        """Текущие значения считаются записанными в файл, дальше отслеживаются изменения."""
+        object.__setattr__(self, "_dirty", set())
+        object.__setattr__(self, "_tracking", True)
+
+    def copy(self) -> "Mp4TagsClass":
+        """Копия для редактирования: списки и набор изменённых полей не разделяются с оригиналом."""
+        other = copy.copy(self)
+        for name in LIST_FIELDS:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                object.__setattr__(other, name, list(value))
+        if "_dirty" in self.__dict__:
+            object.__setattr__(other, "_dirty", set(self._dirty))
+        return other
+
+    @property
+    def dirty(self) -> set[str] | None:
+        """Изменённые поля или `None`, если изменения не отслеживаются (теги не из файла)."""
+        if not self.__dict__.get("_tracking"):
+            return None
+        return set(self._dirty)
+
+
+# поля, от которых зависит содержимое атомов в файле
+TRACKED_FIELDS = {"title", "kpid", "year", "country", "rating", "directors", "actors", "description", "has_cover", "cover", "genres", "main_genre"}
+LIST_FIELDS = {"country", "directors", "actors", "genres"}
+
+
+def _same_value(name, old, new) -> bool:
+    if name == "cover":
+        # сравнение изображений попиксельно слишком дорогое
+        return old is new
+    if name in LIST_FIELDS:
+        # "" и [""] из интерфейса означают пустой список
+        def norm(value):
+            return tuple(x for x in value if x) if isinstance(value, list) else ((value,) if value else ())
+
+        return norm(old) == norm(new)
+    return old == new
+
+
+# атомы, из которых заполняется Mp4TagsClass
+TAG_ATOMS = {
+    "\xa9nam",
+    "\xa9day",
+    "desc",
+    "covr",
+    "\xa9gen",
+    "----:com.apple.iTunes:kpra",
+    "----:com.apple.iTunes:countr",
+    "----:com.apple.iTunes:DIRECTOR",
+    "----:com.apple.iTunes:Actors",
+    "----:com.apple.iTunes:kpid",
+    "----:com.apple.iTunes:genre",
+}
+
+
+@timed("read_tags")
+def read_tags(file_path, fast=True) -> Mp4TagsClass:
+    """Чтение тегов из файла. При ошибке открытия возвращает объект с `is_ok=False`.
+
+    По умолчанию теги читаются напрямую из `ilst` (`mp4box.read_ilst`), mutagen
+    используется, только если файл не удалось разобрать.
+    """
+    if fast:
+        try:
+            return tags_from_atoms(read_ilst(file_path, TAG_ATOMS))
+        except (Mp4ParseError, OSError, ValueError, struct.error) as error:
+            log.info(f"Быстрое чтение тегов не удалось ({error}), используется mutagen: {os.path.basename(file_path)}")
+    try:
+        with span("mp4_open"):
+            video = MP4(file_path)
+    except Exception as error:
+        log.error(f"Ошибка! Не удалось открыть файл ({error}): {os.path.basename(file_path)}")
+        return Mp4TagsClass()
+    return tags_from_atoms(video)
+
+
+def tags_from_atoms(video) -> Mp4TagsClass:
+    """Заполнение Mp4TagsClass из `mutagen.mp4.MP4` или словаря `mp4box.read_ilst`."""
+    result = Mp4TagsClass()
+    if "\xa9nam" in video:
+        result.title = video["\xa9nam"][0]
+    else:
+        result.title = ""
+
+    if "\xa9day" in video:
+        result.year = video["\xa9day"][0]
+    else:
+        result.year = ""
+
+    if "----:com.apple.iTunes:kpra" in video:
+        result.rating = video["----:com.apple.iTunes:kpra"][0].decode()
+    else:
+        result.rating = ""
+
+    if "----:com.apple.iTunes:countr" in video:
+        result.country = video["----:com.apple.iTunes:countr"][0].decode().split(";")
+    else:
+        result.country = ""
+
+    if "desc" in video:
+        result.description = video["desc"][0]
+    else:
+        result.description = ""
+
+    if "----:com.apple.iTunes:DIRECTOR" in video:
+        result.directors = video["----:com.apple.iTunes:DIRECTOR"][0].decode().split(";")
+    else:
+        result.directors = ""
+
+    if "----:com.apple.iTunes:Actors" in video:
+        result.actors = video["----:com.apple.iTunes:Actors"][0].decode().split("\r\n")[1::2]
+    else:
+        result.actors = ""
+
+    try:
+        result.cover = LazyCover(video["covr"][0])
+        result.has_cover = True
+    except Exception:
+        result.cover = None
+        result.has_cover = False
+
+    if "----:com.apple.iTunes:kpid" in video:
+        result.kpid = video["----:com.apple.iTunes:kpid"][0].decode()
+    else:
+        result.kpid = ""
+
+    if "----:com.apple.iTunes:genre" in video:
+        result.genres = video["----:com.apple.iTunes:genre"][0].decode().split(";")
+    else:
+        result.genres = ""
+
+    if "\xa9gen" in video:
+        result.main_genre = video["\xa9gen"][0]
+    else:
+        result.main_genre = ""
+
+    result.is_ok = True
+    result.mark_clean()
+    return result
+
+
+# запас места (бокс `free` после `ilst`), чтобы следующие сохранения не сдвигали данные файла
+DEFAULT_PADDING = 512 * 1024
+
+
+@dataclass
+class SaveReport:
+    in_place: bool = False
+    moved_bytes: int = 0  # объём данных после тегов, сдвинутых при перезаписи
+    padding: int = 0
+    skipped: bool = False  # изменений не было, файл не открывался
+
+    def __str__(self):
+        if self.skipped:
+            return "без изменений"
+        if self.in_place:
+            return f"запись на месте (запас {convert_bytes(self.padding)})"
+        return f"перезапись файла (сдвинуто {convert_bytes(self.moved_bytes)}, запас {convert_bytes(self.padding)})"
+
+
+def padding_policy(report: SaveReport, reserve=DEFAULT_PADDING, minimum=0):
+    """Функция выбора размера `free` для `MP4.save(padding=...)`.
+
+    Если новые теги помещаются в старое место и остаётся не меньше `minimum` байт,
+    размер сохраняется, и файл перезаписывается на месте. Иначе выделяется `reserve` байт.
+    """
+
+    def padding(info):
+        if info.padding >= minimum:
+            report.in_place = True
+            report.padding = info.padding
+        else:
+            report.in_place = False
+            report.moved_bytes = info.size
+            report.padding = max(reserve, minimum)
+        return report.padding
+
+    return padding
+
+
+def cover_atom(cover) -> MP4Cover:
+    """Атом `covr`. Постеры в JPEG и PNG записываются без перекодирования."""
+    if not isinstance(cover, LazyCover) or cover.format not in ("JPEG", "PNG"):
+        image = as_image(cover)
+        cover = get_cover_policy().encode(image, getattr(image, "format", None))
+    image_format = MP4Cover.FORMAT_JPEG if cover.format == "JPEG" else MP4Cover.FORMAT_PNG
+    return MP4Cover(cover.data, imageformat=image_format)
+
+
+@timed("write_tags")
+def write_tags(file_path, tags: Mp4TagsClass, padding=DEFAULT_PADDING, force=False) -> SaveReport:
+    """Запись тегов в файл.
+
+    Если теги прочитаны из файла, записываются только изменённые поля, а при
+    отсутствии изменений файл не открывается (`SaveReport.skipped`). `force`
+    записывает все поля.
+
+    Исключения mutagen не перехватываются: `MP4StreamInfoError` при открытии
+    файла и любые ошибки при сохранении обрабатывает вызывающий код.
+    """
+    dirty = None if force else tags.dirty
+    if dirty is not None and not dirty:
+        return SaveReport(skipped=True)
+
+    def changed(*names):
+        return dirty is None or not dirty.isdisjoint(names)
+
+    with span("mp4_open"):
+        video = MP4(file_path)
+    if changed("title"):
+        video["\xa9nam"] = tags.title  # title
+    if changed("description"):
+        if tags.description:
+            video["desc"] = tags.description  # description
+            video["ldes"] = tags.description  # long description
+        else:
+            video["desc"] = " "  # description
+            video["ldes"] = " "  # long description
+    if tags.year and changed("year"):
+        video["\xa9day"] = tags.year  # year
+
+    if changed("has_cover", "cover"):
+        if tags.has_cover:
+            video["covr"] = [cover_atom(tags.cover)]
+        else:
+            video["covr"] = b""
+
+    if changed("directors"):
+        video["----:com.apple.iTunes:DIRECTOR"] = MP4FreeForm((";".join(tags.directors)).encode(), AtomDataType.UTF8)
+    if changed("actors"):
+        bufferlist = []
+        for item in tags.actors:
+            bufferlist.append("")
+            bufferlist.append(item)
+        video["----:com.apple.iTunes:Actors"] = MP4FreeForm(("\r\n".join(bufferlist)).encode(), AtomDataType.UTF8)
+    if changed("rating"):
+        if tags.rating:
+            video["----:com.apple.iTunes:kpra"] = MP4FreeForm(tags.rating.encode(), AtomDataType.UTF8)
+        else:
+            video["----:com.apple.iTunes:kpra"] = MP4FreeForm(("").encode(), AtomDataType.UTF8)
+    if tags.country and changed("country"):
+        video["----:com.apple.iTunes:countr"] = MP4FreeForm((";".join(tags.country)).encode(), AtomDataType.UTF8)
+    if tags.kpid and changed("kpid"):
+        video["----:com.apple.iTunes:kpid"] = MP4FreeForm((tags.kpid).encode(), AtomDataType.UTF8)
+    if tags.genres and changed("genres"):
+        video["----:com.apple.iTunes:genre"] = MP4FreeForm((";".join(tags.genres)).encode(), AtomDataType.UTF8)
+    if tags.main_genre and changed("main_genre"):
+        video["\xa9gen"] = tags.main_genre
+    report = SaveReport()
+    with span("save"):
+        video.save(padding=padding_policy(report, padding))
+    tags.mark_clean()
+    return report
+
+
+def repad(file_path, padding=DEFAULT_PADDING) -> SaveReport:
+    """Однократное выделение запаса `padding` байт, если его ещё нет."""
+    video = MP4(file_path)
+    report = SaveReport()
+    video.save(padding=padding_policy(report, padding, minimum=padding))
+    return report
+
+
+def apply_film_info(tags: Mp4TagsClass, film_info: dict):
+    """Перенос данных о фильме (из буфера обмена или Кинопоиска) в теги.
+
+    Постер обновляется, только если в `film_info` есть ключ `cover`.
+    """
+    tags.title = film_info["title"]
+    tags.year = film_info["year"]
+    tags.country = film_info["country"]
+    if film_info["rating"] and film_info["is_rating_kp"]:
+        tags.rating = film_info["rating"]
+    elif not film_info["is_rating_kp"] and film_info["rating"]:
+        tags.rating = "i" + film_info["rating"]
+    else:
+        tags.rating = film_info["rating"]
+    tags.directors = film_info["director"]
+    tags.actors = film_info["actors"]
+    tags.description = film_info["description"]
+    tags.genres = film_info["genres"]
+    tags.main_genre = film_info["main_genre"]
+    if "cover" not in film_info:
+        return
+    if film_info["cover"]:
+        tags.cover = prepare_cover(film_info["cover"])
+        tags.has_cover = True
+    else:
+        tags.cover = ""
+        tags.has_cover = False
+
+
+def list_media(path, recursive=False) -> list[str]:
+    """Список MP4 файлов: сам `path`, если это файл, или содержимое каталога."""
+    if os.path.isfile(path):
+        return [path]
+    return sorted(scan(path, recursive), key=sort_key)
+
+
+@dataclass
+class FileResult:
+    path: str
+    status: str  # "ok", "skipped" или "error"
+    message: str = ""
+    elapsed: float = 0.0
+    metrics: dict | None = None  # замеры рабочего процесса (metrics.Registry.take)
+
+
+def process_file(file_path, from_kp=False, dry_run=False, padding=DEFAULT_PADDING, cover_policy: CoverPolicy | None = None) -> FileResult:
+    """Обработка одного файла в пакетном режиме: чтение, загрузка из Кинопоиска, запись.
+
+    Функция не бросает исключений, результат всегда возвращается в виде `FileResult`,
+    поэтому её можно запускать в пуле процессов.
+    """
+    start = time.perf_counter()
+    if cover_policy:
+        set_cover_policy(cover_policy)
+
+    def done(status, message=""):
+        return FileResult(file_path, status, message, time.perf_counter() - start)
+
+    tags = read_tags(file_path)
+    if not tags.is_ok:
+        return done("error", "не удалось прочитать теги")
+
+    if from_kp:
+        if not tags.kpid:
+            return done("skipped", "нет kpid")
+        try:
+            film_id = int(tags.kpid)
+        except ValueError:
+            return done("error", f"некорректный kpid: {tags.kpid}")
+        try:
+            # импорт здесь: клиент Кинопоиска (requests, лимитер) нужен только для --from-kp
+            from kinopoisk import get_film_info
+
+            film_info = get_film_info(film_id)
+        except Exception as error:
+            return done("error", f"ошибка Кинопоиска: {error}")
+        if not film_info:
+            return done("error", "не удалось получить информацию о фильме")
+        apply_film_info(tags, film_info)
+
+    if dry_run:
+        return done("ok", "без записи")
+    try:
+        report = write_tags(file_path, tags, padding)
+    except Exception as error:
+        return done("error", f"ошибка при сохранении тегов: {error}")
+    return done("ok", str(report))
+
+
+def run_batch(paths, jobs=None, from_kp=False, dry_run=False, padding=DEFAULT_PADDING, cover_policy: CoverPolicy | None = None):
+    """Параллельная обработка файлов в пуле из `jobs` процессов.
+
+    Генератор выдаёт `FileResult` по мере завершения файлов.
+    """
+    if jobs == 1:
+        for path in paths:
+            yield process_file(path, from_kp, dry_run, padding, cover_policy)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_process_in_worker, path, from_kp, dry_run, padding, cover_policy) for path in paths]
+        for future in as_completed(futures):
+            result = future.result()
+            if result.metrics:
+                registry.merge(result.metrics)
+            yield result
+
+
+def _process_in_worker(*args) -> FileResult:
+    result = process_file(*args)
+    if metrics_enabled():
+        result.metrics = registry.take()
+    return result
+
+
+@dataclass
+class BatchStats:
+    total: int = 0
+    counts: dict = field(default_factory=lambda: {"ok": 0, "skipped": 0, "error": 0})
+    elapsed: float = 0.0
+
+    def add(self, result: FileResult):
+        self.total += 1
+        self.counts[result.status] = self.counts.get(result.status, 0) + 1
+
+    @property
+    def throughput(self) -> float:
+        """Файлов в секунду."""
+        return self.total / self.elapsed if self.elapsed else 0.0
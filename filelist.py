@@ -0,0 +1,259 @@
+"""Данные виртуального списка файлов: название, год, kpid, постер и разрешение.
+
+Строки берутся из индекса библиотеки (`library.LibraryIndex`), новые и
+изменённые файлы читаются в фоновом потоке и дописываются в индекс, поэтому в
+потоке GUI нет обращений к диску. В памяти хранятся только недавно показанные
+строки (LRU), память не растёт с размером библиотеки.
+
+Сортировка по колонкам тегов выполняется по значениям из индекса, файлы, ещё
+не попавшие в индекс, идут в конце списка. Индекс всех файлов списка
+заполняется в фоне, после его заполнения сортировка повторяется.
+"""
+
+import os
+import logging
+import threading
+from dataclasses import dataclass
+from collections import OrderedDict, deque
+
+from library import LibraryIndex, index_entry
+from scanner import sort_key
+
+__all__ = ["FileListModel", "Row", "COLUMNS", "COLUMN_TITLES"]
+
+log = logging.getLogger("KL_Tag")
+
+COLUMNS = ("name", "title", "year", "kpid", "cover", "resolution")
+COLUMN_TITLES = ("Файл", "Название", "Год", "kpid", "Постер", "Разрешение")
+
+# значения для сортировки по колонкам тегов (выражения SQL над таблицей индекса)
+SORT_EXPRESSIONS = {
+    "title": "LOWER(COALESCE(title, ''))",
+    "year": "CAST(COALESCE(year, '') AS INTEGER)",
+    "kpid": "CAST(COALESCE(kpid, '') AS INTEGER)",
+    "cover": "COALESCE(has_cover, 0)",
+    "resolution": "COALESCE(width * height, 0)",
+}
+
+MAX_WANTED = 256  # запросы строк, ожидающие чтения; более старые отбрасываются
+
+
+@dataclass(frozen=True, slots=True)
+class Row:
+    title: str = ""
+    year: str = ""
+    kpid: str = ""
+    has_cover: bool = False
+    width: int | None = None
+    height: int | None = None
+
+    @classmethod
+    def from_entry(cls, entry: dict) -> "Row":
+        return cls(entry["title"] or "", entry["year"] or "", entry["kpid"] or "", bool(entry["has_cover"]), entry["width"], entry["height"])
+
+    def text(self, column: str) -> str:
+        if column == "cover":
+            return "✔" if self.has_cover else ""
+        if column == "resolution":
+            return f"{self.width}×{self.height}" if self.width else ""
+        return getattr(self, column)
+
+
+class FileListModel:
+    """Порядок файлов и строки списка.
+
+    `paths` изменяется только из потока GUI. `on_rows(paths)` (строки прочитаны)
+    и `on_sorted()` (порядок изменился) вызываются через `dispatch` (в GUI это
+    `wx.CallAfter`).
+    """
+
+    def __init__(self, index: LibraryIndex | None = None, on_rows=None, on_sorted=None, dispatch=None, max_rows=1000, batch_size=32):
+        self.index = index
+        self.on_rows = on_rows
+        self.on_sorted = on_sorted
+        self.dispatch = dispatch or (lambda func, *args: func(*args))
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.paths: list[str] = []
+        self.sort_column = "name"
+        self.ascending = True
+        self._rows: OrderedDict[str, Row] = OrderedDict()
+        self._wanted: OrderedDict[str, None] = OrderedDict()
+        self._fill: deque[str] = deque()
+        self._indexed = 0  # файлов добавлено в индекс при фоновом заполнении
+        self._sort_job = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="FileListModel", daemon=True)
+        self._thread.start()
+
+    # --- поток GUI ---
+
+    def __len__(self):
+        return len(self.paths)
+
+    def row(self, path) -> Row | None:
+        """Строка из памяти. Если её нет - None, строка будет прочитана в фоне (`on_rows`)."""
+        with self._cond:
+            row = self._rows.get(path)
+            if row is not None:
+                self._rows.move_to_end(path)
+                return row
+            self._wanted[path] = None
+            self._wanted.move_to_end(path)
+            while len(self._wanted) > MAX_WANTED:
+                self._wanted.popitem(last=False)
+            self._cond.notify()
+        return None
+
+    def add(self, paths) -> list[str]:
+        """Новые файлы: по имени - на своё место, при сортировке по тегам - в конец.
+
+        Файлы, которые уже есть в списке (например, переименованные в окне, о
+        которых потом сообщает `watcher`), пропускаются. Возвращает добавленные.
+        """
+        present = set(self.paths)
+        paths = [path for path in dict.fromkeys(paths) if path not in present]
+        if not paths:
+            return paths
+        if self.sort_column == "name":
+            # упорядоченный список и пачка сливаются за линейное время
+            self.paths.extend(paths)
+            self.paths.sort(key=sort_key, reverse=not self.ascending)
+        else:
+            self.paths.extend(sorted(paths, key=sort_key))
+        with self._cond:
+            self._fill.extend(paths)
+            self._cond.notify()
+        return paths
+
+    def remove(self, paths) -> None:
+        """Файлы удалены с диска."""
+        gone = set(paths)
+        self.paths[:] = [path for path in self.paths if path not in gone]
+        with self._cond:
+            for path in gone:
+                self._rows.pop(path, None)
+                self._wanted.pop(path, None)
+            if self._fill:
+                self._fill = deque(path for path in self._fill if path not in gone)
+
+    def invalidate(self, path):
+        """Файл изменён (например, сохранены теги): строка будет прочитана заново."""
+        with self._cond:
+            self._rows.pop(path, None)
+
+    def rename(self, old_path, new_path):
+        index = self.paths.index(old_path)
+        self.paths[index] = new_path
+        with self._cond:
+            self._rows.pop(old_path, None)
+
+    def sort(self, column: str, ascending=True):
+        """Сортировка по колонке. По имени - сразу, по тегам - после чтения значений из индекса."""
+        self.sort_column = column
+        self.ascending = ascending
+        if column == "name":
+            self.paths.sort(key=sort_key, reverse=not ascending)
+            if self.on_sorted:
+                self.on_sorted()
+            return
+        with self._cond:
+            self._sort_job = (column, ascending)
+            self._cond.notify()
+
+    def _apply_sort(self, column, ascending, values: dict):
+        if (column, ascending) != (self.sort_column, self.ascending):
+            return  # пока читались значения, выбрана другая сортировка
+        known = [path for path in self.paths if values.get(path) is not None]
+        unknown = [path for path in self.paths if values.get(path) is None]
+        known.sort(key=lambda path: (values[path], sort_key(path)), reverse=not ascending)
+        unknown.sort(key=sort_key)
+        self.paths[:] = known + unknown
+        if self.on_sorted:
+            self.on_sorted()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    # --- фоновый поток ---
+
+    def _next_job(self):
+        with self._cond:
+            while not self._closed:
+                if self._sort_job:
+                    job, self._sort_job = self._sort_job, None
+                    return "sort", job
+                if self._wanted:
+                    # последние запрошенные строки - это видимая сейчас часть списка
+                    paths = []
+                    while self._wanted and len(paths) < self.batch_size:
+                        paths.append(self._wanted.popitem()[0])
+                    return "rows", paths
+                if self._fill:
+                    paths = [self._fill.popleft() for _ in range(min(self.batch_size, len(self._fill)))]
+                    return "fill", paths
+                self._cond.wait()
+            return None, None
+
+    def _run(self):
+        if self.index is None:
+            try:
+                self.index = LibraryIndex()
+            except Exception as e:
+                log.error(f"Не удалось открыть индекс библиотеки: {e}")
+                return
+        while True:
+            kind, job = self._next_job()
+            if kind is None:
+                break
+            try:
+                if kind == "sort":
+                    column, ascending = job
+                    values = self.index.values(SORT_EXPRESSIONS[column])
+                    self.dispatch(self._apply_sort, column, ascending, values)
+                elif kind == "rows":
+                    rows = self._load(job)
+                    with self._cond:
+                        for path, row in rows.items():
+                            self._rows[path] = row
+                            self._rows.move_to_end(path)
+                        while len(self._rows) > self.max_rows:
+                            self._rows.popitem(last=False)
+                    if self.on_rows:
+                        self.dispatch(self.on_rows, list(rows))
+                else:
+                    self._load(job, fill=True)
+                    with self._cond:
+                        if not self._fill:
+                            if self._indexed and self.sort_column != "name":
+                                self._sort_job = (self.sort_column, self.ascending)
+                            self._indexed = 0
+            except Exception as e:
+                log.error(f"Ошибка при чтении данных для списка файлов: {e}")
+        self.index.close()
+
+    def _load(self, paths, fill=False) -> dict[str, Row]:
+        entries = self.index.lookup(paths)
+        new = []
+        for path in paths:
+            if path in entries:
+                continue
+            try:
+                entry = index_entry(path)
+            except Exception as e:
+                log.error(f"Не удалось прочитать файл ({e}): {os.path.basename(path)}")
+                continue
+            entries[path] = entry
+            new.append(entry)
+        if new:
+            self.index.update(new)
+            if fill:
+                with self._cond:
+                    self._indexed += len(new)
+        return {path: Row.from_entry(entry) for path, entry in entries.items()}
@@ -1,9 +1,22 @@
-from requests import get
-from PIL import Image
+import os
+import re
+import time
+import random
+import sqlite3
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from config import KINOPOISK_API_TOKEN as api
+from requests.exceptions import ConnectionError, Timeout
 
-__all__ = ["get_film_info", "get_main_genre", "genres_hierarchy", "common_genres"]
+from covers import POSTER_SIZE, LazyCover, large_enough, image_size
+from kpcache import get_cache, default_cache_dir
+from metrics import span, count, timed
+from ratelimit import TokenBucket, SharedRateLimiter
+from transport import LiveTransport, ResponseRejected, transport_from_env
+
+__all__ = ["KinopoiskClient", "get_client", "get_limiter", "api_token", "get_film_info", "parse_page_text", "get_main_genre", "genres_hierarchy", "common_genres"]
 
 genres_hierarchy = [
     "мультфильм",
@@ -40,21 +53,65 @@ common_genres = [
 ]
 
 
-def get_film_info(film_id: int):
-    result = {}
-    payload = {"filmId": film_id}
-    headers = {"X-API-KEY": api, "Content-Type": "application/json"}
+API_URL = "https://kinopoiskapiunofficial.tech"
+API_RATE_LIMIT = 20  # запросов в секунду для неофициального API
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRIES = 4
+BACKOFF_BASE = 0.5  # секунды, первая пауза перед повтором
+BACKOFF_MAX = 30.0
+POSTER_MAX_BYTES = 8 * 1024 * 1024
+POSTER_TIMEOUT = 20  # секунды на загрузку постера целиком
+PREVIEW_MISSES = 3  # после стольких мелких превью подряд превью на время не загружаются
+PREVIEW_PAUSE = 600  # секунды, на которые превью отключаются
+PREVIEW_HEAD_BYTES = 64 * 1024  # если в начале файла нет размеров, превью загружается целиком
+
+log = logging.getLogger("KL_Tag")
+
+_token: str | None = None
+
+
+def api_token() -> str:
+    """Токен API: переменная окружения `KINOPOISK_API_TOKEN` или `config.py`.
+
+    Читается при первом запросе к API, поэтому без токена модуль импортируется
+    и работает с записанными ответами (`transport.ReplayTransport`).
+    """
+    global _token
+    if _token is None:
+        token = os.environ.get("KINOPOISK_API_TOKEN")
+        if not token:
+            try:
+                from config import KINOPOISK_API_TOKEN as token
+            except ImportError:
+                raise RuntimeError("Не задан токен API Кинопоиска: переменная окружения KINOPOISK_API_TOKEN или config.py") from None
+        _token = token
+    return _token
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Значение заголовка `Retry-After` в секундах: число секунд или HTTP-дата."""
+    if not value:
+        return None
     try:
-        r = get("https://kinopoiskapiunofficial.tech/api/v1/staff", headers=headers, params=payload)
-        if r.status_code == 200:
-            resp_json = r.json()
-        else:
-            print(f"Статус код API: {r.status_code}")
-            return
-    except Exception as e:
-        print(e)
-        return
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
 
+def preview_accept(head: bytes) -> bool | None:
+    """Проверка превью по заголовку: `False` - после обрезки оно меньше `POSTER_SIZE`."""
+    size = image_size(head)
+    if size is not None:
+        return large_enough(size)
+    return None if len(head) < PREVIEW_HEAD_BYTES else True
+
+
+def parse_staff(resp_json) -> dict:
+    result = {}
     actors = []
     director = []
     num = 0
@@ -72,19 +129,11 @@ def get_film_info(film_id: int):
                 director.append(i["nameEn"])
     result["actors"] = actors
     result["director"] = director
+    return result
 
-    headers = {"X-API-KEY": api, "Content-Type": "application/json"}
-    try:
-        r = get(f"https://kinopoiskapiunofficial.tech/api/v2.2/films/{film_id}", headers=headers)
-        if r.status_code == 200:
-            resp_json = r.json()
-        else:
-            print(f"Статус код API: {r.status_code}")
-            return
-    except Exception as e:
-        print(e)
-        return
 
+def parse_film(resp_json) -> dict:
+    result = {}
     if resp_json["nameRu"]:
         result["title"] = resp_json["nameRu"]
     else:
@@ -113,15 +162,307 @@ def get_film_info(film_id: int):
         result["genres"] = [x.get("genre") for x in resp_json["genres"]]
 
     result["main_genre"] = get_main_genre(result["genres"], genres_hierarchy)
+    return result
 
-    cover = get(resp_json["posterUrl"], stream=True)
-    if cover.status_code == 200:
-        cover.raw.decode_content = True
-        result["cover"] = Image.open(cover.raw)
-    else:
-        result["cover"] = ""
 
-    return result
+class KinopoiskClient:
+    """Клиент API Кинопоиска.
+
+    Использует одну `requests.Session` с пулом keep-alive соединений, поэтому TLS
+    рукопожатие выполняется один раз на хост. Запросы `staff` и `films/{id}`
+    выполняются параллельно, загрузка постера начинается сразу после получения
+    данных фильма, не дожидаясь списка актёров. Постер загружается целиком в
+    память с ограничением размера и времени, вместо оригинала берётся
+    `posterUrlPreview`, если его разрешения хватает для `POSTER_SIZE` (размер
+    определяется по заголовку, загрузка мелкого превью обрывается).
+
+    Ответы 429 и 5xx повторяются с экспоненциальной паузой, `Retry-After`
+    соблюдается. Запросы к API проходят через `limiter`, загрузка постеров
+    (статические файлы) квоту не расходует.
+
+    `transport` - источник ответов (`transport.LiveTransport` по умолчанию,
+    запись или воспроизведение фикстур). `token` - токен API, по умолчанию
+    `api_token()`.
+    """
+
+    def __init__(self, pool_size=10, timeout=15, limiter: "TokenBucket | SharedRateLimiter | None" = None, api_url=API_URL, retries=RETRIES, transport=None, token=None):
+        self.api_url = api_url
+        self.token = token
+        self.timeout = timeout
+        self.retries = retries
+        self.limiter = limiter
+        self.transport = transport or LiveTransport(pool_size)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="kinopoisk")
+        self._preview_lock = threading.Lock()
+        self._small_previews = 0
+        self._previews_off_until = 0.0
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def backoff(self, attempt: int) -> float:
+        """Пауза перед повтором: экспоненциальная, со случайным разбросом (full jitter)."""
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+    def request(self, url: str, part: str, **kwargs):
+        """GET к API через лимитер, с повторами при 429, 5xx и сетевых ошибках.
+
+        Пауза из заголовка `Retry-After` передаётся лимитеру, поэтому её соблюдают
+        все потоки (и процессы, если лимитер общий). Возвращает последний ответ,
+        сетевая ошибка последней попытки пробрасывается.
+        """
+        for attempt in range(self.retries + 1):
+            if self.limiter:
+                with span("kinopoisk_rate_wait"):
+                    self.limiter.acquire()
+            try:
+                with span(f"kinopoisk_{part}"):
+                    r = self.transport.get(url, timeout=self.timeout, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff(attempt)
+                log.warning(f"Ошибка запроса к API ({e}), повтор через {delay:.1f} с")
+            else:
+                count(f"kinopoisk_status_{r.status_code}")
+                if r.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return r
+                delay = max(parse_retry_after(r.headers.get("Retry-After")) or 0.0, self.backoff(attempt))
+                log.warning(f"Статус код API: {r.status_code}, повтор через {delay:.1f} с")
+                if r.status_code == 429 and self.limiter:
+                    self.limiter.pause(delay)
+                    delay = 0.0  # пауза выдерживается в acquire
+            count("kinopoisk_retry")
+            time.sleep(delay)
+
+    def fetch_json(self, film_id: int, part: str, url: str, params: dict | None = None):
+        """Запрос к API с использованием дискового кэша. Возвращает `None` при ошибке."""
+        cache = get_cache()
+        if cache:
+            resp_json = cache.get_json(film_id, part)
+            if resp_json is not None:
+                count("kinopoisk_cache_hit")
+                return resp_json
+            count("kinopoisk_cache_miss")
+
+        headers = {"Content-Type": "application/json"}
+        if not self.transport.offline:
+            try:
+                headers["X-API-KEY"] = self.token or api_token()
+            except RuntimeError as e:
+                print(e)
+                return
+        try:
+            r = self.request(url, part, headers=headers, params=params)
+            if r.status_code == 200:
+                resp_json = r.json()
+            else:
+                if r.status_code == 402 and hasattr(self.limiter, "exhaust"):
+                    # дневной лимит ключа исчерпан, остальные процессы узнают об этом через общий лимитер
+                    self.limiter.exhaust()
+                print(f"Статус код API: {r.status_code}")
+                return
+        except Exception as e:
+            print(e)
+            return
+
+        if cache:
+            cache.put_json(film_id, part, resp_json)
+        return resp_json
+
+    def download_poster(self, url: str, accept=None) -> bytes | None:
+        """Байты изображения или None при ошибке. Отказ `accept` пробрасывается (`ResponseRejected`)."""
+        try:
+            with span("kinopoisk_poster"):
+                r = self.transport.get(url, timeout=POSTER_TIMEOUT, max_bytes=POSTER_MAX_BYTES, accept=accept)
+        except ResponseRejected:
+            raise
+        except Exception as e:
+            print(e)
+            return
+        if r.status_code != 200:
+            print(f"Статус код загрузки постера: {r.status_code}")
+            return
+        count("kinopoisk_poster_bytes", len(r.content))
+        return r.content
+
+    def fetch_poster(self, film_id: int, film_json: dict) -> bytes | None:
+        """Загрузка постера (байты исходного файла) с использованием дискового кэша.
+
+        Сначала пробуется превью (`posterUrlPreview`): если после обрезки оно не
+        меньше `POSTER_SIZE`, оригинал не нужен. После `PREVIEW_MISSES` мелких
+        превью подряд они не загружаются `PREVIEW_PAUSE` секунд.
+        """
+        cache = get_cache()
+        if cache:
+            data = cache.get(film_id, "poster")
+            if data is not None:
+                return data
+
+        data = None
+        preview_url = film_json.get("posterUrlPreview")
+        if preview_url and self.previews_enabled():
+            try:
+                data = self.download_poster(preview_url, accept=preview_accept)
+            except ResponseRejected:
+                self.preview_result(False)
+            else:
+                if data is not None:
+                    try:
+                        big = large_enough(LazyCover(data).size)
+                    except Exception:
+                        big = False
+                    self.preview_result(big)
+                    if big:
+                        count("kinopoisk_poster_preview")
+                    else:
+                        data = None
+        if data is None and film_json.get("posterUrl"):
+            data = self.download_poster(film_json["posterUrl"])
+        if data is None:
+            return
+        if cache:
+            cache.put(film_id, "poster", data)
+        return data
+
+    def previews_enabled(self) -> bool:
+        with self._preview_lock:
+            return time.monotonic() >= self._previews_off_until
+
+    def preview_result(self, big: bool):
+        """Учёт проверенного превью: мелкие превью подряд отключают их на `PREVIEW_PAUSE` секунд."""
+        with self._preview_lock:
+            if big:
+                self._small_previews = 0
+                return
+            count("kinopoisk_poster_preview_small")
+            self._small_previews += 1
+            if self._small_previews >= PREVIEW_MISSES:
+                self._small_previews = 0
+                self._previews_off_until = time.monotonic() + PREVIEW_PAUSE
+                log.info(f"Превью постеров меньше {POSTER_SIZE[0]}×{POSTER_SIZE[1]}, {PREVIEW_PAUSE} с загружаются оригиналы")
+
+    @timed("get_film_info")
+    def get_film_info(self, film_id: int):
+        staff_future = self.executor.submit(self.fetch_json, film_id, "staff", f"{self.api_url}/api/v1/staff", {"filmId": film_id})
+        film_json = self.fetch_json(film_id, "film", f"{self.api_url}/api/v2.2/films/{film_id}")
+        if film_json is None:
+            staff_future.cancel()
+            return
+        poster_future = self.executor.submit(self.fetch_poster, film_id, film_json)
+
+        staff_json = staff_future.result()
+        if staff_json is None:
+            poster_future.cancel()
+            return
+
+        result = {**parse_staff(staff_json), **parse_film(film_json)}
+        poster = poster_future.result()
+        try:
+            # байты постера без декодирования: если обрезка не нужна, они записываются в файл как есть
+            result["cover"] = LazyCover(poster) if poster else ""
+        except Exception as e:
+            print(e)
+            result["cover"] = ""
+        return result
+
+    def prefetch(self, film_id: int) -> bool:
+        """Заполнение кэша данными фильма без декодирования постера."""
+        film_json = self.fetch_json(film_id, "film", f"{self.api_url}/api/v2.2/films/{film_id}")
+        staff_json = self.fetch_json(film_id, "staff", f"{self.api_url}/api/v1/staff", {"filmId": film_id})
+        if film_json is None or staff_json is None:
+            return False
+        return self.fetch_poster(film_id, film_json) is not None
+
+
+_client: KinopoiskClient | None = None
+_limiter: "TokenBucket | SharedRateLimiter | None" = None
+_client_lock = threading.Lock()
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> "TokenBucket | SharedRateLimiter":
+    """Общий для всех процессов лимитер запросов с учётом дневной квоты.
+
+    Если файл состояния недоступен, используется лимитер в памяти процесса.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            try:
+                _limiter = SharedRateLimiter(default_cache_dir("ratelimit.sqlite"), API_RATE_LIMIT * 0.75)
+            except (sqlite3.Error, OSError) as e:
+                log.warning(f"Общий лимитер запросов недоступен ({e}), используется локальный")
+                _limiter = TokenBucket(API_RATE_LIMIT * 0.75)
+        return _limiter
+
+
+def get_client() -> KinopoiskClient:
+    """Общий клиент процесса (создаётся при первом обращении, транспорт - по `KL_TAG_KP_TRANSPORT`)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            transport = transport_from_env()
+            # воспроизведение записанных ответов не расходует квоту API
+            limiter = None if transport.offline else get_limiter()
+            _client = KinopoiskClient(limiter=limiter, transport=transport)
+        return _client
+
+
+def get_film_info(film_id: int):
+    return get_client().get_film_info(film_id)
+
+
+def parse_page_text(text: str) -> dict | None:
+    """Данные фильма из текста страницы Кинопоиска, скопированного в буфер обмена."""
+    try:
+        result = {}
+        list = text.split("\n")
+        result["title"] = re.findall(r"(.*)\s\(\d{4}\)", text)[0]
+        result["year"] = list[list.index("Год производства") + 1]
+        result["country"] = list[list.index("Страна") + 1].split(", ")
+        result["director"] = list[list.index("Режиссер") + 1].split(", ")
+
+        actors_start = list.index("В главных ролях") + 1
+        for i in range(actors_start, len(list)):
+            if list[i][0].isdigit():  # ищем следующую строку типа `15 актеров`
+                actors_stop = i
+                break
+
+        result["actors"] = list[actors_start:actors_stop]
+        genres_start = list.index("Жанр") + 1
+        result["genres"] = list[genres_start].split(", ")
+        result["main_genre"] = get_main_genre(result["genres"], genres_hierarchy)
+
+        if re.findall(r"Рейтинг Кинопоиска\s(\d+\.\d+)", text):
+            result["rating"] = re.findall(r"Рейтинг Кинопоиска\s(\d+\.\d+)", text)[0]
+            result["is_rating_kp"] = True
+        elif re.findall(r"IMDb:\s(\d\.\d{2})", text):
+            result["rating"] = re.findall(r"IMDb:\s(\d\.\d{2})", text)[0]
+            result["is_rating_kp"] = False
+        else:
+            result["rating"] = ""
+            result["is_rating_kp"] = True
+
+        try:
+            desc_start = list.index("Видно только вам") + 1
+        except Exception:
+            desc_start = list.index("Сиквелы, приквелы и ремейки") + 1
+
+        desc_stop = list.index("Рейтинг фильма")
+        result["description"] = "\n".join(list[desc_start:desc_stop]).strip("\n")
+
+        return result
+    except Exception as e:
+        print(e)
+        return
 
 
 def get_main_genre(genres: list, genres_hierarchy: list) -> str:
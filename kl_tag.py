@@ -2,21 +2,27 @@ import os
 import sys
 import ctypes
 import logging
-import io
 import re
 import webbrowser
-import json
-import threading
 import subprocess
-from dataclasses import dataclass
-from glob import glob
-from subprocess import check_output
+from functools import partial
 
 import wx
-from mutagen.mp4 import MP4, MP4Cover, MP4StreamInfoError, MP4FreeForm, AtomDataType
+from mutagen.mp4 import MP4StreamInfoError
 from PIL import Image
 
-from kinopoisk import get_film_info, get_main_genre, common_genres, genres_hierarchy
+from kinopoisk import get_film_info, parse_page_text, common_genres
+from engine import Mp4TagsClass, get_resource_path, get_meta, write_tags, apply_film_info
+from covers import prepare_cover
+from prefetch import PrefetchQueue, PRIORITY_SELECTED
+from selection import SelectionWorker
+from tagcache import TagCache, neighbors
+from preview import Preview, PreviewRenderer
+from scanner import Scanner
+from watcher import DirectoryWatcher
+from metacache import file_key
+from filelist import FileListModel, COLUMNS, COLUMN_TITLES
+from metrics import timed, configure_from_env
 
 ctypes.windll.shcore.SetProcessDpiAwareness(2)
 
@@ -30,113 +36,6 @@ wildcard_png = "Изображения (*.png)|*.png|Все файлы (*.*)|*.*
 wildcard_png_jpg = "Изображения PNG (*.png)|*.png|Изображения JPG (*.jpg)|*.jpg|Все файлы (*.*)|*.*"
 
 
-def get_resource_path(relative_path):
-    try:
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.abspath(".")
-    return os.path.join(base_path, relative_path)
-
-
-FFPROBE = get_resource_path("ffprobe.exe")
-
-
-def convert_bytes(num, is_rate=False):
-    for x in ["б", "Кб", "Мб", "Гб", "Тб"]:
-        if num < 1024.0:
-            if is_rate:
-                return f"{num:3.1f} {x}ит/с"
-            else:
-                return f"{num:3.1f} {x}"
-        num /= 1024.0
-
-
-def convert_seconds(input: str):
-    duration = int(float(input))
-    hours = int(duration // 3600)
-    remaining_seconds = duration % 3600
-    minutes = int(remaining_seconds // 60)
-    seconds = remaining_seconds % 60
-
-    # Форматирование строки вывода
-    return f"{hours}:{minutes:02d}:{seconds:02d}"
-
-
-def check_framerate(r_frame_rate: str, avg_frame_rate: str):
-    """Проерка разницы между `r_frame_rate` и `avg_frame_rate`"""
-    THREASHOLD = 0.05
-    x, y = r_frame_rate.split("/")
-    r_frame_rate_float = float(x) / float(y)
-    x, y = avg_frame_rate.split("/")
-    avg_frame_rate_float = float(x) / float(y)
-    if abs(r_frame_rate_float - avg_frame_rate_float) > r_frame_rate_float * THREASHOLD:
-        return (avg_frame_rate_float, False)
-    return (avg_frame_rate_float, True)
-
-
-def run_ffprobe_json(args: list[str]) -> dict:
-    try:
-        p = subprocess.run(
-            args, capture_output=True, text=True, check=True, errors="replace", encoding="utf-8", creationflags=subprocess.CREATE_NO_WINDOW
-        )
-        if not p.stdout.strip():
-            return {}
-        return json.loads(p.stdout)
-    except Exception as e:
-        log.error(f"Не удалось выполнить ffprobe: {e}")
-        return {}
-
-
-def get_meta(file):
-    if not os.path.isfile(FFPROBE):
-        log.error(f'Не наден файл: "{FFPROBE}"!')
-        return {"ffprobe": False}
-    out_json = run_ffprobe_json([FFPROBE, "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", file])
-    audio_streams = 0
-    subtitle_streams = 0
-    for stream in out_json["streams"]:
-        if stream["codec_type"] == "audio":
-            audio_streams += 1
-        elif stream["codec_type"] == "subtitle":
-            subtitle_streams += 1
-
-    result = {}
-    if out_json["streams"][0]["codec_type"] != "video":
-        result["video"] = False
-        return result
-    else:
-        result["video"] = True
-
-    result["width"] = out_json["streams"][0]["width"]
-    result["height"] = out_json["streams"][0]["height"]
-    result["size"] = convert_bytes(int(out_json["format"]["size"]))
-    result["bit_rate"] = convert_bytes(int(out_json["format"]["bit_rate"]), is_rate=True)
-    result["audio_streams"] = audio_streams
-    result["subtitle_streams"] = subtitle_streams
-    result["running_time"] = convert_seconds(out_json["format"]["duration"])
-    result["framerate"], result["framerate_check"] = check_framerate(
-        out_json["streams"][0]["r_frame_rate"], out_json["streams"][0]["avg_frame_rate"]
-    )
-    return {"ffprobe": True, **result}
-
-
-@dataclass
-class Mp4TagsClass:
-    title: str = ""
-    kpid: str = ""
-    year: str = ""
-    country: list | str = ""
-    rating: str = ""
-    directors: list | str = ""
-    actors: list | str = ""
-    description: str = ""
-    long_descriplion: str = ""
-    has_cover: bool = False
-    genres: list | str = ""
-    main_genre: str = ""
-    is_ok: bool = False
-
-
 def read_from_buffer():
     text_data = wx.TextDataObject()
     if wx.TheClipboard.Open():
@@ -147,55 +46,10 @@ def read_from_buffer():
 
 
 def get_from_buffer():
-    try:
-        result = {}
-        text: str = read_from_buffer()
-        list = text.split("\n")
-        result["title"] = re.findall(r"(.*)\s\(\d{4}\)", text)[0]
-        result["year"] = list[list.index("Год производства") + 1]
-        result["country"] = list[list.index("Страна") + 1].split(", ")
-        result["director"] = list[list.index("Режиссер") + 1].split(", ")
-
-        actors_start = list.index("В главных ролях") + 1
-        for i in range(actors_start, len(list)):
-            if list[i][0].isdigit():  # ищем следующую строку типа `15 актеров`
-                actors_stop = i
-                break
-
-        result["actors"] = list[actors_start:actors_stop]
-        genres_start = list.index("Жанр") + 1
-        result["genres"] = list[genres_start].split(", ")
-        result["main_genre"] = get_main_genre(result["genres"], genres_hierarchy)
-
-        if re.findall(r"Рейтинг Кинопоиска\s(\d+\.\d+)", text):
-            result["rating"] = re.findall(r"Рейтинг Кинопоиска\s(\d+\.\d+)", text)[0]
-            result["is_rating_kp"] = True
-        elif re.findall(r"IMDb:\s(\d\.\d{2})", text):
-            result["rating"] = re.findall(r"IMDb:\s(\d\.\d{2})", text)[0]
-            result["is_rating_kp"] = False
-        else:
-            result["rating"] = ""
-            result["is_rating_kp"] = True
-
-        try:
-            desc_start = list.index("Видно только вам") + 1
-        except Exception:
-            desc_start = list.index("Сиквелы, приквелы и ремейки") + 1
-
-        desc_stop = list.index("Рейтинг фильма")
-        result["description"] = "\n".join(list[desc_start:desc_stop]).strip("\n")
-
-        return result
-    except Exception as e:
-        print(e)
+    text = read_from_buffer()
+    if not text:
         return
-
-
-def image_to_file(image):
-    """Return `image` as PNG file-like object."""
-    image_file = io.BytesIO()
-    image.save(image_file, format="PNG")
-    return image_file
+    return parse_page_text(text)
 
 
 class CharValidator(wx.Validator):
@@ -281,11 +135,45 @@ def GetTextFromUserEx(message, caption="Ввод текста", default_value=""
     return result
 
 
-class EditableListBox(wx.ListBox):
-    def __init__(self, parent, frame, choices=None, **kwargs):
-        super().__init__(parent, choices=choices or [], style=wx.LB_SINGLE, **kwargs)
-        self.Bind(wx.EVT_CONTEXT_MENU, self.on_right_click)
+class FileListCtrl(wx.ListCtrl):
+    """Виртуальный список файлов: строки запрашиваются у `FileListModel` только для видимой части."""
+
+    COLUMN_WIDTHS = (170, 130, 45, 65, 50, 80)
+
+    def __init__(self, parent, frame, **kwargs):
+        super().__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL, **kwargs)
         self.frame = frame
+        self.model: FileListModel | None = None
+        for i, (title, width) in enumerate(zip(COLUMN_TITLES, self.COLUMN_WIDTHS)):
+            self.InsertColumn(i, title, width=self.FromDIP(width))
+        self.Bind(wx.EVT_CONTEXT_MENU, self.on_right_click)
+        self.Bind(wx.EVT_LIST_COL_CLICK, self.on_col_click)
+
+    def OnGetItemText(self, item, column):
+        path = self.model.paths[item]
+        if column == 0:
+            return os.path.basename(path)
+        row = self.model.row(path)  # None - строка ещё читается в фоне
+        return row.text(COLUMNS[column]) if row else ""
+
+    def GetSelection(self):
+        return self.GetFirstSelected()
+
+    def SetSelection(self, index):
+        self.Select(index)
+        self.Focus(index)
+
+    def RefreshVisible(self):
+        if not self.GetItemCount():
+            return
+        top = self.GetTopItem()
+        self.RefreshItems(top, min(self.GetItemCount() - 1, top + self.GetCountPerPage()))
+
+    def on_col_click(self, event):
+        column = COLUMNS[event.GetColumn()]
+        ascending = not self.model.ascending if column == self.model.sort_column else True
+        self.model.sort(column, ascending)
+        self.ShowSortIndicator(event.GetColumn(), ascending)
 
     def on_right_click(self, event):
         selection = self.GetSelection()
@@ -302,10 +190,23 @@ class EditableListBox(wx.ListBox):
             self.PopupMenu(menu)
             menu.Destroy()
 
+    def rename_file(self, file_path, new_file_name):
+        new_file_path = os.path.join(os.path.dirname(file_path), new_file_name)
+        try:
+            os.rename(file_path, new_file_path)
+        except Exception as e:
+            wx.MessageDialog(None, f"Ошибка при переименовании файла!\n{e}", "Ошибка!", wx.OK | wx.ICON_ERROR).ShowModal()
+            return
+        if os.path.isfile(new_file_path):
+            self.model.rename(file_path, new_file_path)
+            self.frame.current_file = new_file_path
+            self.RefreshItem(self.GetSelection())
+
     def on_rename_item(self, event):
         selection = self.GetSelection()
         if selection != wx.NOT_FOUND:
-            current_value = self.GetString(selection)
+            file_path = self.model.paths[selection]
+            current_value = os.path.basename(file_path)
             name, ext = os.path.splitext(current_value)
             new_value = GetTextFromUserEx("Новое имя файла без расширения:", "Переименование", name, self, size=(self.FromDIP((400, 150))))
             if not new_value:
@@ -314,38 +215,16 @@ class EditableListBox(wx.ListBox):
             new_value = new_value.translate(trtable)  # отфильтровываем запрещенные символы в новом имени файла
             new_value = new_value + ext
             if new_value and new_value != current_value:
-                file_path = self.frame.list_paths[selection]
-                new_file_path = os.path.join(os.path.dirname(file_path), new_value)
-                try:
-                    os.rename(file_path, new_file_path)
-                except Exception as e:
-                    wx.MessageDialog(None, f"Ошибка при переименовании файла!\n{e}", "Ошибка!", wx.OK | wx.ICON_ERROR).ShowModal()
-                    return
-                if os.path.isfile(new_file_path):
-                    self.frame.list_paths[selection] = new_file_path
-                    self.SetString(selection, new_value)
-                else:
-                    self.SetString(selection, current_value)
+                self.rename_file(file_path, new_value)
 
     def on_reanme_tag_item(self, event):
         selection = self.GetSelection()
         if selection != wx.NOT_FOUND:
-            file_name = self.GetString(selection)
-            file_path = self.frame.list_paths[selection]
+            file_path = self.model.paths[selection]
             new_file_name = f"{self.frame.t_title.GetValue()} ({self.frame.t_year.GetValue()}){os.path.splitext(file_path)[1]}"
             trtable = new_file_name.maketrans("", "", R'\/:*?"<>')
             new_file_name = new_file_name.translate(trtable)  # отфильтровываем запрещенные символы в новом имени файла
-            new_file_path = os.path.join(os.path.dirname(file_path), new_file_name)
-            try:
-                os.rename(file_path, new_file_path)
-            except Exception as e:
-                wx.MessageDialog(None, f"Ошибка при переименовании файла!\n{e}", "Ошибка!", wx.OK | wx.ICON_ERROR).ShowModal()
-                return
-            if os.path.isfile(new_file_path):
-                self.frame.list_paths[selection] = new_file_path
-                self.SetString(selection, new_file_name)
-            else:
-                self.SetString(selection, file_name)
+            self.rename_file(file_path, new_file_name)
 
 
 class MyFrame(wx.Frame):
@@ -353,9 +232,9 @@ class MyFrame(wx.Frame):
         super().__init__(parent, title=title, style=(wx.DEFAULT_FRAME_STYLE | wx.WANTS_CHARS))
 
         self.panel = wx.Panel(self)
-        self.list_files = EditableListBox(self.panel, self, size=self.FromDIP(wx.Size(350, 30)))
-        self.Bind(wx.EVT_LISTBOX, self.onListClick, id=self.list_files.GetId())
-        self.Bind(wx.EVT_LISTBOX_DCLICK, self.onListDoubleClick, id=self.list_files.GetId())
+        self.list_files = FileListCtrl(self.panel, self, size=self.FromDIP(wx.Size(560, 30)))
+        self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.onListClick, id=self.list_files.GetId())
+        self.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.onListDoubleClick, id=self.list_files.GetId())
         self.tag_box_sizer = wx.StaticBoxSizer(wx.VERTICAL, self.panel)
 
         # title + year
@@ -432,7 +311,8 @@ class MyFrame(wx.Frame):
 
         # poster
         self.placeholder = Image.open(get_resource_path(R".\images\placeholder.png"))
-        self.image = wx.StaticBitmap(self.panel, wx.ID_ANY, self.scale_picture(self.placeholder), size=self.FromDIP((200, 300)))
+        self.renderer = PreviewRenderer(self.placeholder)
+        self.image = wx.StaticBitmap(self.panel, wx.ID_ANY, self.PreviewBitmap(self.renderer.placeholder(self.GetDPIScaleFactor())), size=self.FromDIP((200, 300)))
         self.image.Bind(wx.EVT_CONTEXT_MENU, self.OnPosterContextMenu)
         self.image.Bind(wx.EVT_LEFT_DCLICK, self.OnPosterDoubleClick)
         self.l_image_size = wx.StaticText(self.panel, label="Нет постера")
@@ -468,8 +348,23 @@ class MyFrame(wx.Frame):
         self.statusbar.SetStatusWidths([self.FromDIP(350), -1])
         self.statusbar.SetStatusText("")
 
-        self.list_paths = []
+        # строки списка читаются в фоне из индекса библиотеки, в памяти - только видимые
+        self.file_model = FileListModel(on_rows=self.onRowsLoaded, on_sorted=self.onFilesSorted, dispatch=wx.CallAfter)
+        self.list_files.model = self.file_model
+        self.list_paths = self.file_model.paths
+        self.current_file = None
         self.tags = Mp4TagsClass()
+        self.prefetch = None
+        self.scanner = None
+        # после поиска файлов список обновляется по изменениям в каталоге
+        self.watcher = None
+        self.saved_key = None  # файл после последнего сохранения: своё изменение не перечитывается
+        # ffprobe для выбранного файла: один поток, результаты устаревших выборов отбрасываются
+        self.selection_worker = SelectionWorker(dispatch=wx.CallAfter)
+        # теги и превью соседних файлов читаются заранее, пока редактируется текущий
+        self.tag_cache = TagCache()
+        self.neighbor_worker = SelectionWorker(delay=0.3)
+        self.Bind(wx.EVT_CLOSE, self.onClose)
         self.OpenFiles()
 
     def statusbar_status(self, event):
@@ -479,94 +374,19 @@ class MyFrame(wx.Frame):
         film_info = get_from_buffer()
         if not film_info:
             return
-        self.tags.title = film_info["title"]
-        self.tags.year = film_info["year"]
-        self.tags.country = film_info["country"]
-        if film_info["rating"] and film_info["is_rating_kp"]:
-            self.tags.rating = film_info["rating"]
-        elif not film_info["is_rating_kp"] and film_info["rating"]:
-            self.tags.rating = "i" + film_info["rating"]
-        else:
-            self.tags.rating = film_info["rating"]
-        self.tags.directors = film_info["director"]
-        self.tags.actors = film_info["actors"]
-        self.tags.description = film_info["description"]
-        self.tags.genres = film_info["genres"]
-        self.tags.main_genre = film_info["main_genre"]
+        apply_film_info(self.tags, film_info)
         self.ShowTags()
 
+    @timed("gui_read_tags")
     def ReadTags(self, file_path) -> Mp4TagsClass | None:
-        result = Mp4TagsClass()
-        try:
-            video = MP4(file_path)
-        except Exception as error:
-            log.error(f"Ошибка! Не удалось открыть файл ({error}): {os.path.basename(file_path)}")
-            return result
-
-        if "\xa9nam" in video:
-            result.title = video["\xa9nam"][0]
-        else:
-            result.title = ""
-
-        if "\xa9day" in video:
-            result.year = video["\xa9day"][0]
-        else:
-            result.year = ""
-
-        if "----:com.apple.iTunes:kpra" in video:
-            result.rating = video["----:com.apple.iTunes:kpra"][0].decode()
-        else:
-            result.rating = ""
-
-        if "----:com.apple.iTunes:countr" in video:
-            result.country = video["----:com.apple.iTunes:countr"][0].decode().split(";")
-        else:
-            result.country = ""
-
-        if "desc" in video:
-            result.description = video["desc"][0]
-        else:
-            result.description = ""
+        return self.tag_cache.load(file_path)
 
-        if "----:com.apple.iTunes:DIRECTOR" in video:
-            result.directors = video["----:com.apple.iTunes:DIRECTOR"][0].decode().split(";")
-        else:
-            result.directors = ""
-
-        if "----:com.apple.iTunes:Actors" in video:
-            result.actors = video["----:com.apple.iTunes:Actors"][0].decode().split("\r\n")[1::2]
-        else:
-            result.actors = ""
-
-        try:
-            if Image.open(io.BytesIO(video["covr"][0])):
-                result.cover = Image.open(io.BytesIO(video["covr"][0]))
-                result.has_cover = True
-            else:
-                result.cover = self.placeholder
-                result.has_cover = False
-        except Exception:
-            result.cover = self.placeholder
-            result.has_cover = False
-
-        if "----:com.apple.iTunes:kpid" in video:
-            result.kpid = video["----:com.apple.iTunes:kpid"][0].decode()
-        else:
-            result.kpid = ""
-
-        if "----:com.apple.iTunes:genre" in video:
-            result.genres = video["----:com.apple.iTunes:genre"][0].decode().split(";")
-        else:
-            result.genres = ""
-
-        if "\xa9gen" in video:
-            result.main_genre = video["\xa9gen"][0]
-        else:
-            result.main_genre = ""
-
-        result.is_ok = True
-        return result
+    def PrefetchNeighbors(self):
+        paths = list(neighbors(self.list_paths, self.list_files.GetSelection()))
+        on_cover = partial(self.renderer.render, scale=self.GetDPIScaleFactor())
+        self.neighbor_worker.submit(partial(self.tag_cache.prefetch, on_cover=on_cover), paths)
 
+    @timed("gui_show_tags")
     def ShowTags(self):
         self.t_title.ChangeValue(self.tags.title)
         self.t_year.ChangeValue(self.tags.year)
@@ -589,27 +409,30 @@ class MyFrame(wx.Frame):
         self.t_genres.ChangeValue(", ".join(self.tags.genres))
         self.c_main_genre.SetItems(self.tags.genres or common_genres)
         self.c_main_genre.SetValue(self.tags.main_genre)
-        threading.Thread(target=self.ShowStatusbar).start()
+        self.RequestFileInfo()
         self.ShowPoster()
 
+    @timed("gui_show_poster")
     def ShowPoster(self):
         if self.tags.has_cover:
-            self.image.Bitmap = self.scale_picture(self.tags.cover)
+            self.image.Bitmap = self.PreviewBitmap(self.renderer.render(self.tags.cover, self.GetDPIScaleFactor()))
             self.l_image_size.Label = f"{self.tags.cover.size[0]}×{self.tags.cover.size[1]}"
             self.panel.Layout()
         else:
-            self.image.Bitmap = self.scale_picture(self.placeholder)
+            self.image.Bitmap = self.PreviewBitmap(self.renderer.placeholder(self.GetDPIScaleFactor()))
             self.l_image_size.Label = "Нет постера"
             self.panel.Layout()
 
-    def ShowStatusbar(self):
-        self.statusbar.SetStatusText(" Файлов: " + str(len(self.list_paths)), 0)
-        try:
-            fileinfo = get_meta(self.list_paths[self.list_files.GetSelection()])
-        except Exception as e:
-            self.statusbar.SetStatusText(f" Не удалось получить информацию о файле: {e}", 1)
-            return
+    def RequestFileInfo(self):
+        self.statusbar.SetStatusText(self.FilesStatus(), 0)
+        self.statusbar.SetStatusText(" Получение информации о файле…", 1)
+        file_path = self.list_paths[self.list_files.GetSelection()]
+        self.selection_worker.submit(get_meta, file_path, on_done=self.ShowStatusbar, on_error=self.ShowStatusbarError)
 
+    def ShowStatusbarError(self, error):
+        self.statusbar.SetStatusText(f" Не удалось получить информацию о файле: {error}", 1)
+
+    def ShowStatusbar(self, fileinfo):
         if fileinfo and fileinfo["ffprobe"]:
             frate = "✔" if fileinfo["framerate_check"] else "✘"
             self.statusbar.SetStatusText(
@@ -627,22 +450,34 @@ class MyFrame(wx.Frame):
         else:
             self.statusbar.SetStatusText(" Нет видео дорожки в файле! 😠", 1)
 
-    def GetTags(self):
-        self.tags.title = self.t_title.Value
-        self.tags.year = self.t_year.Value
-        self.tags.country = self.t_country.Value.split(", ")
+    def GetTags(self, tags: Mp4TagsClass | None = None):
+        tags = tags or self.tags
+        tags.title = self.t_title.Value
+        tags.year = self.t_year.Value
+        tags.country = self.t_country.Value.split(", ")
         if self.choice.GetSelection() == 0:
-            self.tags.rating = self.t_rating.Value
+            tags.rating = self.t_rating.Value
         elif self.choice.GetSelection() == 1 and self.t_rating.Value:
-            self.tags.rating = "i" + self.t_rating.Value
+            tags.rating = "i" + self.t_rating.Value
         else:
-            self.tags.rating = self.t_rating.Value
-        self.tags.directors = self.t_director.Value.split(", ")
-        self.tags.kpid = self.t_kpid.Value
-        self.tags.actors = self.t_actors.Value.split(", ")
-        self.tags.description = self.t_description.Value
-        self.tags.genres = self.t_genres.Value.split(", ")
-        self.tags.main_genre = self.c_main_genre.GetValue()
+            tags.rating = self.t_rating.Value
+        tags.directors = self.t_director.Value.split(", ")
+        tags.kpid = self.t_kpid.Value
+        tags.actors = self.t_actors.Value.split(", ")
+        tags.description = self.t_description.Value
+        tags.genres = self.t_genres.Value.split(", ")
+        tags.main_genre = self.c_main_genre.GetValue()
+
+    def HasUnsavedEdits(self) -> bool:
+        """Есть несохранённые изменения: в полях ввода или в тегах (вставка, Кинопоиск, постер)."""
+        if not self.tags.is_ok:
+            return False  # теги не прочитаны, поля ввода отключены
+        if self.tags.dirty:
+            return True
+        edited = self.tags.copy()
+        edited.mark_clean()
+        self.GetTags(edited)
+        return bool(edited.dirty)
 
     def OpenFiles(self):
         if len(sys.argv) != 2:
@@ -650,21 +485,97 @@ class MyFrame(wx.Frame):
             return
 
         if os.path.isfile(sys.argv[1]):
-            self.list_paths.append(sys.argv[1])
-            self.list_files.AppendItems(os.path.basename(self.list_paths[0]))
-
-        if os.path.isdir(sys.argv[1]):
-            self.list_paths = glob(os.path.join(sys.argv[1], "*.mp4"))
-            self.list_paths.sort()
-            if not self.list_paths:
-                self.DisableInterface()
-                return
-            for path in self.list_paths:
-                self.list_files.AppendItems(os.path.basename(path))
+            self.AddFiles([sys.argv[1]])
+        elif os.path.isdir(sys.argv[1]):
+            # файлы появляются в списке по мере обхода каталога и подкаталогов
+            self.DisableInterface()
+            self.statusbar.SetStatusText(" Поиск файлов…", 0)
+            self.scanner = Scanner(sys.argv[1], on_batch=self.AddFiles, on_done=self.onScanDone, dispatch=wx.CallAfter).start()
+        else:
+            self.DisableInterface()
 
-        self.list_files.Select(0)
-        self.current_file = self.list_paths[self.list_files.GetSelection()]
+    def AddFiles(self, paths):
+        """Добавление пачки найденных файлов в список с сохранением сортировки."""
+        first = not self.list_paths
+        paths = self.file_model.add(paths)
+        if not paths:
+            return  # файлы уже в списке
+        self.list_files.SetItemCount(len(self.list_paths))
+        self.KeepSelection()
+        self.list_files.RefreshVisible()
+
+        if first:
+            self.SelectFirstFile()
+        else:
+            self.prefetch.add(paths)
+        self.statusbar.SetStatusText(self.FilesStatus(), 0)
+
+    def KeepSelection(self):
+        """Выделение выбранного файла после вставки или сортировки (позиция могла сдвинуться)."""
+        if self.current_file is not None:
+            index = self.list_paths.index(self.current_file)
+            if self.list_files.GetSelection() != index:
+                self.list_files.SetSelection(index)
+
+    def onFilesSorted(self):
+        self.KeepSelection()
+        if self.current_file is not None:
+            self.list_files.EnsureVisible(self.list_files.GetSelection())
+        self.list_files.RefreshVisible()
+
+    def onRowsLoaded(self, paths):
+        self.list_files.RefreshVisible()
+
+    def onScanDone(self, found):
+        self.scanner = None
+        # изменения, сделанные во время поиска, придут первым набором (отличия от known);
+        # очередь предзагрузки остаётся в ожидании новых файлов до закрытия окна
+        self.watcher = DirectoryWatcher(
+            sys.argv[1], on_changes=self.onFilesChanged, dispatch=wx.CallAfter, known=list(self.list_paths)
+        ).start()
+        if not found:
+            self.DisableInterface()
+        self.statusbar.SetStatusText(self.FilesStatus(), 0)
+
+    def onFilesChanged(self, changes):
+        """Файлы в открытом каталоге добавлены, удалены или изменены другими программами."""
+        for path in changes.stale:
+            self.tag_cache.invalidate(path)
+            self.file_model.invalidate(path)
+        current = self.current_file
+        if changes.removed:
+            index = max(0, self.list_files.GetSelection())
+            self.file_model.remove(changes.removed)
+            self.list_files.SetItemCount(len(self.list_paths))
+            if current in changes.removed:
+                self.current_file = None
+                if self.list_paths:
+                    # выбирается файл, оказавшийся на месте удалённого
+                    index = min(index, len(self.list_paths) - 1)
+                    self.current_file = self.list_paths[index]
+                    self.list_files.SetSelection(index)
+                    self.ShowFile(self.current_file)
+                else:
+                    self.DisableInterface()
+        if changes.added:
+            self.AddFiles(changes.added)
+        if current is not None and current == self.current_file and current in changes.modified:
+            if file_key(current) == self.saved_key:
+                pass  # изменение - это наше сохранение
+            elif self.HasUnsavedEdits():
+                self.statusbar.SetStatusText(" Файл изменён другой программой, несохранённые изменения не сброшены", 1)
+            else:
+                self.ShowFile(current)
+        self.KeepSelection()
+        self.list_files.RefreshVisible()
+        self.statusbar.SetStatusText(self.FilesStatus(), 0)
+
+    def SelectFirstFile(self):
+        self.current_file = self.list_paths[0]
+        self.list_files.SetSelection(0)
+        self.StartPrefetch()
         self.tags = self.ReadTags(self.current_file)
+        self.PrefetchNeighbors()
         if not self.tags.is_ok:
             self.ClearTags()
             self.DisableInterface()
@@ -672,59 +583,77 @@ class MyFrame(wx.Frame):
         self.EnableInterface()
         self.ShowTags()
 
+    def StartPrefetch(self):
+        """Фоновая загрузка данных Кинопоиска для всех файлов с kpid."""
+        if self.prefetch:
+            self.prefetch.cancel()  # список был пуст после удаления всех файлов
+        self.prefetch = PrefetchQueue(on_progress=lambda done, total: wx.CallAfter(self.onPrefetchProgress))
+        self.prefetch.add([self.current_file], priority=PRIORITY_SELECTED)
+        self.prefetch.add(self.list_paths)
+        if self.scanner or self.watcher:
+            self.prefetch.hold()  # файлы ещё будут добавляться
+        self.prefetch.start()
+
+    def onPrefetchProgress(self):
+        self.statusbar.SetStatusText(self.FilesStatus(), 0)
+
+    def FilesStatus(self):
+        text = " Файлов: " + str(len(self.list_paths))
+        if self.scanner:
+            text += " (поиск…)"
+        if self.prefetch and self.prefetch.quota_stopped:
+            text += f", Кинопоиск: {self.prefetch.done}/{self.prefetch.total} (остановлено, квота API)"
+        elif self.prefetch and self.prefetch.done < self.prefetch.total:
+            text += f", Кинопоиск: {self.prefetch.done}/{self.prefetch.total}"
+        return text
+
+    def onClose(self, event):
+        self.file_model.close()
+        if self.scanner:
+            self.scanner.cancel()
+        if self.watcher:
+            self.watcher.stop()
+        self.selection_worker.close()
+        self.neighbor_worker.close()
+        if self.prefetch:
+            self.prefetch.cancel()
+        event.Skip()
+
+    @timed("gui_save")
     def onSaveTags(self, event):
         self.GetTags()
         file_path = self.list_paths[self.list_files.GetSelection()]
         try:
-            video = MP4(file_path)
+            report = write_tags(file_path, self.tags)
         except MP4StreamInfoError as error:
-            wx.MessageDialog(None, "Ошибка! Не удалось открыть файл!\n({error})", "Ошибка!", wx.OK | wx.ICON_ERROR).ShowModal()
+            wx.MessageDialog(None, f"Ошибка! Не удалось открыть файл!\n({error})", "Ошибка!", wx.OK | wx.ICON_ERROR).ShowModal()
             log.error(f"Ошибка! Не удалось открыть файл ({error}): {os.path.basename(file_path)}")
             return False
-        video["\xa9nam"] = self.tags.title  # title
-        if self.tags.description:
-            video["desc"] = self.tags.description  # description
-            video["ldes"] = self.tags.description  # long description
-        else:
-            video["desc"] = " "  # description
-            video["ldes"] = " "  # long description
-        if self.tags.year:
-            video["\xa9day"] = self.tags.year  # year
-
-        if self.tags.has_cover:
-            video["covr"] = [MP4Cover(image_to_file(self.tags.cover).getvalue(), imageformat=MP4Cover.FORMAT_PNG)]
-        else:
-            video["covr"] = b""
-
-        video["----:com.apple.iTunes:DIRECTOR"] = MP4FreeForm((";".join(self.tags.directors)).encode(), AtomDataType.UTF8)
-        bufferlist = []
-        for item in self.tags.actors:
-            bufferlist.append("")
-            bufferlist.append(item)
-        video["----:com.apple.iTunes:Actors"] = MP4FreeForm(("\r\n".join(bufferlist)).encode(), AtomDataType.UTF8)
-        if self.tags.rating:
-            video["----:com.apple.iTunes:kpra"] = MP4FreeForm(self.tags.rating.encode(), AtomDataType.UTF8)
-        else:
-            video["----:com.apple.iTunes:kpra"] = MP4FreeForm(("").encode(), AtomDataType.UTF8)
-        if self.tags.country:
-            video["----:com.apple.iTunes:countr"] = MP4FreeForm((";".join(self.tags.country)).encode(), AtomDataType.UTF8)
-        if self.tags.kpid:
-            video["----:com.apple.iTunes:kpid"] = MP4FreeForm((self.tags.kpid).encode(), AtomDataType.UTF8)
-        if self.tags.genres:
-            video["----:com.apple.iTunes:genre"] = MP4FreeForm((";".join(self.tags.genres)).encode(), AtomDataType.UTF8)
-        if self.tags.main_genre:
-            video["\xa9gen"] = self.tags.main_genre
-        try:
-            video.save()
         except Exception as error:
             wx.MessageDialog(None, f"Ошибка при сохранении тегов в файл!\n{error}", "Ошибка!", wx.OK | wx.ICON_ERROR).ShowModal()
             log.error(f"Ошибка при сохранении тегов в файл! ({error})!")
             return False
+        finally:
+            self.tag_cache.invalidate(file_path)
+            self.file_model.invalidate(file_path)
+            self.list_files.RefreshItem(self.list_files.GetSelection())
+        self.saved_key = file_key(file_path)
+        log.info(f"Теги сохранены, {report}: {os.path.basename(file_path)}")
         return True
 
     def onListClick(self, event):
-        self.current_file = self.list_paths[self.list_files.GetSelection()]
+        path = self.list_paths[event.GetIndex()]
+        if path == self.current_file:
+            return  # выделение восстановлено после сортировки или вставки файлов
+        self.ShowFile(path)
+
+    def ShowFile(self, path):
+        """Чтение и показ тегов файла из списка."""
+        self.current_file = path
+        if self.prefetch:
+            self.prefetch.prioritize(self.current_file)
         self.tags = self.ReadTags(self.current_file)
+        self.PrefetchNeighbors()
         if not self.tags.is_ok:
             self.ClearTags()
             self.DisableInterface()
@@ -768,28 +697,10 @@ class MyFrame(wx.Frame):
             self.ShowTags()
             self.ShowPoster()
 
-    def scale_picture(self, picture: Image.Image):
-        def PIL2wx(image):
-            width, height = image.size
-            return wx.Bitmap.FromBuffer(width, height, image.tobytes())
-
-        bmp_source = PIL2wx(picture)
-        bmp_source.SetScaleFactor(self.GetDPIScaleFactor())
-        image = bmp_source.ConvertToImage()
-        new_width, new_height = self.FromDIP((200, 300))
-        image = image.Scale(new_width, new_height, quality=wx.IMAGE_QUALITY_HIGH)
-        return image
-
     @staticmethod
-    def image_cut(image: Image.Image):
-        width, height = image.size
-        # обрезка до соотношения сторон 1x1.5
-        if width > (height / 1.5):
-            image = image.crop((((width - height / 1.5) / 2), 0, ((width - height / 1.5) / 2) + height / 1.5, height))
-        elif height > (1.5 * width):
-            image = image.crop((0, ((height - width * 1.5) / 2), width, ((height + width * 1.5) / 2)))
-        image.thumbnail((360, 540))
-        return image
+    def PreviewBitmap(preview: Preview) -> wx.Bitmap:
+        # превью уже в пикселях экрана (FromDIP((200, 300))), масштабирование в wx не нужно
+        return wx.Bitmap.FromBuffer(preview.width, preview.height, preview.data)
 
     def onAddPoster(self, event):
         with wx.FileDialog(
@@ -803,9 +714,8 @@ class MyFrame(wx.Frame):
             if fileDialog.ShowModal() == wx.ID_CANCEL:
                 return
             image_path = fileDialog.GetPath()
-        cover = Image.open(image_path)
-        cover = self.image_cut(cover)
-        cover = cover.convert("RGB")
+        with open(image_path, "rb") as f:
+            cover = prepare_cover(f.read())
         self.tags.cover = cover
         self.tags.has_cover = True
         self.ShowPoster()
@@ -894,6 +804,7 @@ class MyFrame(wx.Frame):
             self.b_openkp.Enable()
             self.b_loadkp.Enable()
 
+    @timed("gui_load_kp")
     def onLoadKP(self, event):
         try:
             film_id = int(self.t_kpid.GetValue())
@@ -907,29 +818,7 @@ class MyFrame(wx.Frame):
             wx.MessageDialog(None, "Ошибка! Не удалось получить информацию о фильме!", "Ошибка!", wx.OK | wx.ICON_ERROR).ShowModal()
             return
 
-        self.tags.title = film_info["title"]
-        self.tags.year = film_info["year"]
-        self.tags.country = film_info["country"]
-        if film_info["rating"] and film_info["is_rating_kp"]:
-            self.tags.rating = film_info["rating"]
-        elif not film_info["is_rating_kp"] and film_info["rating"]:
-            self.tags.rating = "i" + film_info["rating"]
-        else:
-            self.tags.rating = film_info["rating"]
-        self.tags.directors = film_info["director"]
-        self.tags.actors = film_info["actors"]
-        self.tags.description = film_info["description"]
-        self.tags.genres = film_info["genres"]
-        self.tags.main_genre = film_info["main_genre"]
-        if film_info["cover"]:
-            cover = film_info["cover"]
-            cover = self.image_cut(cover)
-            cover = cover.convert("RGB")
-            self.tags.cover = cover
-            self.tags.has_cover = True
-        else:
-            self.tags.cover = ""
-            self.tags.has_cover = False
+        apply_film_info(self.tags, film_info)
         self.ShowTags()
         self.ShowPoster()
 
@@ -956,10 +845,11 @@ class MyFrame(wx.Frame):
 
 
 def main():
+    configure_from_env()
     app = wx.App()
     top = MyFrame(None, title=f"Kinolist Tag Editor {__VERSION__}")
     top.SetIcon(wx.Icon(get_resource_path("./images/favicon.ico")))
-    top.SetClientSize(top.FromDIP(wx.Size(1150, 600)))
+    top.SetClientSize(top.FromDIP(wx.Size(1360, 600)))
     top.Centre()
     top.SetMinSize(top.Size)
     top.Show()
@@ -0,0 +1,189 @@
+"""Дисковый кэш ответов API Кинопоиска и постеров.
+
+Для каждого фильма части хранятся отдельными файлами: `<id>.staff`, `<id>.film`
+и `<id>.poster`. Время записи хранится в mtime файла (по нему считается TTL),
+время последнего обращения - в atime (по нему выбираются файлы для вытеснения).
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import logging
+import tempfile
+from collections import Counter
+
+__all__ = ["FilmCache", "default_cache_dir", "get_cache", "set_cache"]
+
+log = logging.getLogger("KL_Tag")
+
+DAY = 24 * 60 * 60
+
+DEFAULT_TTL = {
+    "staff": 90 * DAY,  # состав съёмочной группы меняется редко
+    "film": 7 * DAY,  # рейтинг обновляется
+    "poster": 180 * DAY,
+}
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def default_cache_dir(name="kinopoisk"):
+    """Каталог кэша приложения (`name` - подкаталог или файл внутри него)."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "kl_tag", name)
+
+
+class FilmCache:
+    """Кэш с ограничением по времени жизни записей и по общему размеру (LRU)."""
+
+    def __init__(self, path=None, ttl: dict | None = None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or default_cache_dir()
+        self.ttl = {**DEFAULT_TTL, **(ttl or {})}
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evictions = 0
+        self._size = None  # считается при первой записи
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, film_id, part):
+        if part not in self.ttl:
+            raise ValueError(f"Неизвестная часть кэша: {part}")
+        return os.path.join(self.path, f"{int(film_id)}.{part}")
+
+    def get(self, film_id, part) -> bytes | None:
+        file = self._file(film_id, part)
+        now = time.time()
+        try:
+            st = os.stat(file)
+            if now - st.st_mtime > self.ttl[part]:
+                self.misses[part] += 1
+                return None
+            with open(file, "rb") as f:
+                data = f.read()
+            os.utime(file, (now, st.st_mtime))  # отметка последнего обращения для LRU
+        except OSError:
+            self.misses[part] += 1
+            return None
+        self.hits[part] += 1
+        return data
+
+    def put(self, film_id, part, data: bytes):
+        file = self._file(film_id, part)
+        # запись через временный файл, чтобы параллельные процессы не читали недописанные данные
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            try:
+                old_size = os.path.getsize(file)
+            except OSError:
+                old_size = 0
+            os.replace(tmp, file)
+        except OSError as e:
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+            log.warning(f"Не удалось записать в кэш {file}: {e}")
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def get_json(self, film_id, part):
+        data = self.get(film_id, part)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def put_json(self, film_id, part, value):
+        self.put(film_id, part, json.dumps(value, ensure_ascii=False).encode())
+
+    def invalidate(self, film_id):
+        for part in self.ttl:
+            try:
+                os.remove(self._file(film_id, part))
+            except OSError:
+                pass
+        self._size = None
+
+    def clear(self):
+        for entry in self._entries():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self._size = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "evictions": self.evictions,
+            "bytes": self._scan_size(),
+        }
+
+    def _entries(self):
+        with os.scandir(self.path) as it:
+            return [entry for entry in it if entry.is_file() and not entry.name.startswith(".tmp-")]
+
+    def _scan_size(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _evict(self):
+        """Удаление давно не использованных файлов до 90% от `max_bytes`."""
+        files = []
+        for entry in self._entries():
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((st.st_atime, st.st_size, entry.path))
+        files.sort()
+        size = sum(f[1] for f in files)
+        target = self.max_bytes * 0.9
+        for _, file_size, file in files:
+            if size <= target:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                continue
+            size -= file_size
+            self.evictions += 1
+        self._size = size
+
+
+_cache: FilmCache | None = None
+_cache_configured = False
+
+
+def get_cache() -> FilmCache | None:
+    """Общий кэш процесса (создаётся при первом обращении)."""
+    global _cache, _cache_configured
+    if not _cache_configured:
+        try:
+            _cache = FilmCache()
+        except OSError:
+            _cache = None
+        _cache_configured = True
+    return _cache
+
+
+def set_cache(cache: FilmCache | None):
+    """Замена общего кэша; `None` отключает кэширование."""
+    global _cache, _cache_configured
+    _cache = cache
+    _cache_configured = True
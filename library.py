@@ -0,0 +1,302 @@
+"""Индекс библиотеки: теги, техническая информация и хэш постера всех файлов в SQLite.
+
+При повторном сканировании перечитываются только новые и изменённые файлы
+(по размеру и `mtime_ns`), запросы выполняются только по индексу. Изменения,
+найденные `watcher`, применяются к индексу без обхода каталогов (`apply`).
+"""
+
+import os
+import json
+import logging
+import hashlib
+import sqlite3
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+from engine import read_tags, get_meta, LazyCover
+from kpcache import default_cache_dir
+from scanner import MEDIA_EXTENSIONS, scan
+
+__all__ = ["LibraryIndex", "ScanStats", "index_entry", "MEDIA_EXTENSIONS"]
+
+log = logging.getLogger("KL_Tag")
+
+LIST_FIELDS = ("country", "directors", "actors", "genres")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    is_ok INTEGER,
+    title TEXT,
+    kpid TEXT,
+    year TEXT,
+    country TEXT,
+    rating TEXT,
+    directors TEXT,
+    actors TEXT,
+    description TEXT,
+    genres TEXT,
+    main_genre TEXT,
+    has_cover INTEGER,
+    cover_hash TEXT,
+    cover_format TEXT,
+    cover_width INTEGER,
+    cover_height INTEGER,
+    video INTEGER,
+    width INTEGER,
+    height INTEGER,
+    bit_rate TEXT,
+    running_time TEXT,
+    audio_streams INTEGER,
+    subtitle_streams INTEGER,
+    framerate REAL,
+    framerate_check INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_kpid ON files (kpid);
+-- year хранится как текст тега, поиск по диапазону лет идёт по числовому значению
+DROP INDEX IF EXISTS files_year;
+CREATE INDEX IF NOT EXISTS files_year_int ON files (CAST(year AS INTEGER));
+"""
+
+COLUMNS = (
+    "path",
+    "size",
+    "mtime_ns",
+    "is_ok",
+    "title",
+    "kpid",
+    "year",
+    "country",
+    "rating",
+    "directors",
+    "actors",
+    "description",
+    "genres",
+    "main_genre",
+    "has_cover",
+    "cover_hash",
+    "cover_format",
+    "cover_width",
+    "cover_height",
+    "video",
+    "width",
+    "height",
+    "bit_rate",
+    "running_time",
+    "audio_streams",
+    "subtitle_streams",
+    "framerate",
+    "framerate_check",
+)
+
+
+def index_entry(path) -> dict:
+    """Строка индекса для файла. Выполняется в рабочем процессе."""
+    st = os.stat(path)
+    row = dict.fromkeys(COLUMNS)
+    row.update(path=path, size=st.st_size, mtime_ns=st.st_mtime_ns)
+
+    tags = read_tags(path)
+    row["is_ok"] = tags.is_ok
+    for name in ("title", "kpid", "year", "rating", "description", "main_genre"):
+        row[name] = getattr(tags, name)
+    for name in LIST_FIELDS:
+        value = getattr(tags, name)
+        row[name] = json.dumps(value if isinstance(value, list) else [], ensure_ascii=False)
+    row["has_cover"] = tags.has_cover
+    if tags.has_cover and isinstance(tags.cover, LazyCover):
+        row["cover_hash"] = hashlib.sha1(tags.cover.data).hexdigest()
+        row["cover_format"] = tags.cover.format
+        row["cover_width"], row["cover_height"] = tags.cover.size
+
+    try:
+        meta = get_meta(path)
+    except Exception:
+        meta = {}
+    for name in ("video", "width", "height", "bit_rate", "running_time", "audio_streams", "subtitle_streams", "framerate", "framerate_check"):
+        row[name] = meta.get(name)
+    return row
+
+
+@dataclass
+class ScanStats:
+    added: int = 0
+    updated: int = 0
+    removed: int = 0
+    unchanged: int = 0
+    errors: int = 0
+
+
+class LibraryIndex:
+    def __init__(self, path=None):
+        self.path = path or default_cache_dir("library.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def walk(root):
+        """Все медиафайлы в каталоге и подкаталогах."""
+        if os.path.isfile(root):
+            yield os.path.abspath(root)
+            return
+        yield from scan(root)
+
+    def rescan(self, roots, jobs=None, on_file=None) -> ScanStats:
+        """Инкрементальное обновление индекса для каталогов `roots`.
+
+        `on_file(path, status)` вызывается для каждого перечитанного файла.
+        """
+        stats = ScanStats()
+        roots = [roots] if isinstance(roots, str) else roots
+        with self._lock:
+            known = {row[0]: (row[1], row[2]) for row in self._db.execute("SELECT path, size, mtime_ns FROM files")}
+
+        found = set()
+        changed = []
+        for root in roots:
+            for path in self.walk(root):
+                found.add(path)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if known.get(path) == (st.st_size, st.st_mtime_ns):
+                    stats.unchanged += 1
+                else:
+                    changed.append(path)
+
+        abs_roots = [os.path.abspath(root) for root in roots]
+        prefixes = tuple(os.path.join(root, "") for root in abs_roots)
+        removed = [path for path in known if path not in found and (path.startswith(prefixes) or path in abs_roots)]
+
+        rows = []
+        if changed:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = {path: executor.submit(index_entry, path) for path in changed}
+                for path, future in futures.items():
+                    try:
+                        rows.append(future.result())
+                    except Exception as e:
+                        log.error(f"Не удалось проиндексировать файл {path}: {e}")
+                        stats.errors += 1
+                        status = "error"
+                    else:
+                        if path in known:
+                            stats.updated += 1
+                            status = "updated"
+                        else:
+                            stats.added += 1
+                            status = "added"
+                    if on_file:
+                        on_file(path, status)
+
+        self.update(rows)
+        self.remove(removed)
+        stats.removed = len(removed)
+        return stats
+
+    def apply(self, changes, on_file=None) -> ScanStats:
+        """Обновление индекса по набору изменений (`watcher.Changes`) без обхода каталогов."""
+        stats = ScanStats()
+        rows = []
+        for status, paths in (("added", changes.added), ("updated", changes.modified)):
+            for path in paths:
+                try:
+                    rows.append(index_entry(path))
+                except Exception as e:
+                    log.error(f"Не удалось проиндексировать файл {path}: {e}")
+                    stats.errors += 1
+                    if on_file:
+                        on_file(path, "error")
+                    continue
+                setattr(stats, status, getattr(stats, status) + 1)
+                if on_file:
+                    on_file(path, status)
+        self.update(rows)
+        self.remove(changes.removed)
+        stats.removed = len(changes.removed)
+        return stats
+
+    def lookup(self, paths) -> dict[str, dict]:
+        """Актуальные (по размеру и `mtime_ns`) строки индекса для `paths`, без разбора списков."""
+        rows = {}
+        paths = list(paths)
+        with self._lock:
+            for i in range(0, len(paths), 500):
+                chunk = paths[i : i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                for row in self._db.execute(f"SELECT * FROM files WHERE path IN ({placeholders})", chunk):
+                    rows[row["path"]] = dict(row)
+        for path, row in list(rows.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is None or (st.st_size, st.st_mtime_ns) != (row["size"], row["mtime_ns"]):
+                del rows[path]
+        return rows
+
+    def update(self, rows):
+        """Запись строк, полученных из `index_entry`."""
+        placeholders = ", ".join("?" * len(COLUMNS))
+        with self._lock:
+            self._db.executemany(f"INSERT OR REPLACE INTO files VALUES ({placeholders})", [tuple(row[c] for c in COLUMNS) for row in rows])
+            self._db.commit()
+
+    def remove(self, paths):
+        with self._lock:
+            self._db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+            self._db.commit()
+
+    def values(self, expression) -> dict[str, object]:
+        """Значение SQL выражения (например, `width * height`) для каждого файла индекса."""
+        with self._lock:
+            return dict(self._db.execute(f"SELECT path, {expression} FROM files"))
+
+    def query(self, where="1", params=(), order_by="path") -> list[dict]:
+        """Выборка из индекса, например `query("kpid = ?", ("43911",))`."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT * FROM files WHERE {where} ORDER BY {order_by}", params).fetchall()
+        result = []
+        for row in rows:
+            item = dict(row)
+            for name in LIST_FIELDS:
+                item[name] = json.loads(item[name]) if item[name] else []
+            result.append(item)
+        return result
+
+    def without_cover(self) -> list[dict]:
+        return self.query("is_ok AND NOT has_cover")
+
+    def without_kpid(self) -> list[dict]:
+        return self.query("is_ok AND (kpid IS NULL OR kpid = '')")
+
+    def find(self, genre: str | None = None, year_from: int | None = None, year_to: int | None = None) -> list[dict]:
+        conditions = ["is_ok"]
+        params = []
+        if genre:
+            conditions.append("EXISTS (SELECT 1 FROM json_each(files.genres) WHERE value = ?)")
+            params.append(genre)
+        if year_from is not None:
+            conditions.append("CAST(year AS INTEGER) >= ?")
+            params.append(year_from)
+        if year_to is not None:
+            conditions.append("CAST(year AS INTEGER) <= ?")
+            params.append(year_to)
+        return self.query(" AND ".join(conditions), params, order_by="year, title")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
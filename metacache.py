@@ -0,0 +1,124 @@
+"""Постоянный кэш технической информации о файлах (результатов `get_meta`).
+
+Запись действительна, пока у файла не изменились размер и `mtime_ns`;
+устаревшие записи перезаписываются при следующем обращении.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+
+from kpcache import default_cache_dir
+
+__all__ = ["MetaCache", "get_meta_cache", "set_meta_cache", "file_key"]
+
+
+def file_key(path) -> tuple[str, int, int] | None:
+    """Ключ кэша `(path, size, mtime_ns)` или `None`, если файл недоступен."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+class MetaCache:
+    def __init__(self, path=None):
+        self.path = path or default_cache_dir("meta.sqlite")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT)")
+        self._db.commit()
+
+    def get(self, path) -> dict | None:
+        key = file_key(path)
+        if key is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns, data FROM meta WHERE path = ?", (key[0],)).fetchone()
+        if row is None or (row[0], row[1]) != key[1:]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[2])
+
+    def put(self, path, data: dict, key=None):
+        """Сохранение результата. `key` - ключ файла на момент запуска ffprobe."""
+        key = key or file_key(path)
+        if key is None:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?)", (*key, json.dumps(data, ensure_ascii=False)))
+            self._db.commit()
+
+    def put_many(self, items):
+        """Сохранение списка пар `(key, data)` одной транзакцией."""
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?)", [(*key, json.dumps(data, ensure_ascii=False)) for key, data in items]
+            )
+            self._db.commit()
+
+    def is_fresh(self, path) -> bool:
+        key = file_key(path)
+        if key is None:
+            return False
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns FROM meta WHERE path = ?", (key[0],)).fetchone()
+        return row is not None and (row[0], row[1]) == key[1:]
+
+    def invalidate(self, path):
+        with self._lock:
+            self._db.execute("DELETE FROM meta WHERE path = ?", (os.path.abspath(path),))
+            self._db.commit()
+
+    def invalidate_many(self, paths):
+        """Удаление записей для списка файлов одной транзакцией."""
+        with self._lock:
+            self._db.executemany("DELETE FROM meta WHERE path = ?", [(os.path.abspath(path),) for path in paths])
+            self._db.commit()
+
+    def purge(self) -> int:
+        """Удаление записей для файлов, которых больше нет или которые изменились."""
+        with self._lock:
+            rows = self._db.execute("SELECT path, size, mtime_ns FROM meta").fetchall()
+        stale = [(path,) for path, size, mtime_ns in rows if file_key(path) != (path, size, mtime_ns)]
+        with self._lock:
+            self._db.executemany("DELETE FROM meta WHERE path = ?", stale)
+            self._db.commit()
+        return len(stale)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_cache: MetaCache | None = None
+_cache_configured = False
+_cache_lock = threading.Lock()
+
+
+def get_meta_cache() -> MetaCache | None:
+    """Общий кэш процесса (создаётся при первом обращении)."""
+    global _cache, _cache_configured
+    with _cache_lock:
+        if not _cache_configured:
+            try:
+                _cache = MetaCache()
+            except (OSError, sqlite3.Error):
+                _cache = None
+            _cache_configured = True
+    return _cache
+
+
+def set_meta_cache(cache: MetaCache | None):
+    """Замена общего кэша; `None` отключает кэширование."""
+    global _cache, _cache_configured
+    with _cache_lock:
+        _cache = cache
+        _cache_configured = True
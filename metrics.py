@@ -0,0 +1,238 @@
+"""Замеры времени по этапам работы и счётчики событий.
+
+Этапы (открытие MP4, декодирование постера, ffprobe, запросы к API Кинопоиска,
+сохранение файла) оборачиваются в `span("имя")`, время попадает в гистограммы
+внутри процесса. Выгрузка - JSON lines или текстовый формат Prometheus.
+
+По умолчанию замеры выключены и `span()` возвращает общий пустой контекст,
+поэтому накладные расходы сводятся к одной проверке флага. Включение:
+переменная окружения `KL_TAG_METRICS=1` или `enable()`; `KL_TAG_METRICS_FILE`
+задаёт файл, в который метрики выгружаются при завершении программы
+(`.prom` - формат Prometheus, иначе JSON lines).
+"""
+
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+from contextlib import nullcontext
+from functools import wraps
+
+__all__ = ["span", "count", "timed", "enable", "enabled", "registry", "Registry", "Histogram", "configure_from_env"]
+
+# границы корзин гистограммы, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    __slots__ = ("count", "sum", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # последняя - больше всех границ
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+
+    def merge(self, other: dict):
+        self.count += other["count"]
+        self.sum += other["sum"]
+        self.min = min(self.min, other["min"])
+        self.max = max(self.max, other["max"])
+        for i, n in enumerate(other["buckets"]):
+            self.buckets[i] += n
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля: линейная интерполяция внутри корзины."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for i, n in enumerate(self.buckets):
+            if n and total + n >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                value = lower + (upper - lower) * (rank - total) / n
+                return min(max(value, self.min), self.max)
+            total += n
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {"count": self.count, "sum": self.sum, "min": self.min, "max": self.max, "buckets": list(self.buckets)}
+
+
+class Registry:
+    def __init__(self):
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "histograms": {name: h.as_dict() for name, h in self.histograms.items()},
+                "counters": dict(self.counters),
+            }
+
+    def take(self) -> dict:
+        """Снимок с обнулением, для передачи метрик из рабочих процессов."""
+        with self._lock:
+            snapshot = {
+                "histograms": {name: h.as_dict() for name, h in self.histograms.items()},
+                "counters": dict(self.counters),
+            }
+            self.histograms.clear()
+            self.counters.clear()
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        with self._lock:
+            for name, data in snapshot["histograms"].items():
+                self.histograms.setdefault(name, Histogram()).merge(data)
+            for name, n in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def to_jsonl(self) -> str:
+        """По строке JSON на метрику, времена в миллисекундах."""
+        now = time.time()
+        lines = []
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                lines.append(
+                    {
+                        "time": now,
+                        "type": "span",
+                        "name": name,
+                        "count": h.count,
+                        "total_ms": h.sum * 1000,
+                        "mean_ms": h.sum / h.count * 1000,
+                        "min_ms": h.min * 1000,
+                        "max_ms": h.max * 1000,
+                        "p50_ms": h.quantile(0.5) * 1000,
+                        "p95_ms": h.quantile(0.95) * 1000,
+                    }
+                )
+            for name, n in sorted(self.counters.items()):
+                lines.append({"time": now, "type": "counter", "name": name, "value": n})
+        return "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines)
+
+    def to_prometheus(self, prefix="kl_tag") -> str:
+        out = []
+        with self._lock:
+            if self.histograms:
+                out.append(f"# HELP {prefix}_stage_seconds Время этапов работы.")
+                out.append(f"# TYPE {prefix}_stage_seconds histogram")
+            for name, h in sorted(self.histograms.items()):
+                total = 0
+                for bound, n in zip(BUCKETS, h.buckets):
+                    total += n
+                    out.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {total}')
+                out.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {h.count}')
+                out.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {h.sum}')
+                out.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {h.count}')
+            if self.counters:
+                out.append(f"# HELP {prefix}_events_total Счётчики событий.")
+                out.append(f"# TYPE {prefix}_events_total counter")
+            for name, n in sorted(self.counters.items()):
+                out.append(f'{prefix}_events_total{{event="{name}"}} {n}')
+        return "\n".join(out) + "\n"
+
+    def dump(self, path):
+        """Запись в файл: `.prom` - формат Prometheus (файл перезаписывается), иначе дописываются строки JSON."""
+        if path.endswith(".prom"):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+        else:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(self.to_jsonl())
+
+
+registry = Registry()
+_enabled = os.environ.get("KL_TAG_METRICS", "") not in ("", "0")
+_NULL_SPAN = nullcontext()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(flag=True):
+    """Включение замеров. Флаг передаётся и в дочерние процессы через окружение."""
+    global _enabled
+    _enabled = flag
+    os.environ["KL_TAG_METRICS"] = "1" if flag else "0"
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        registry.observe(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            registry.count(f"{self.name}_errors")
+
+
+def span(name):
+    """`with span("ffprobe"): ...` - время блока попадает в гистограмму `name`."""
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+def count(name, n=1):
+    if _enabled:
+        registry.count(name, n)
+
+
+def timed(name):
+    """Декоратор: `span(name)` вокруг вызова функции."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def configure_from_env():
+    """Выгрузка метрик при завершении, если задан `KL_TAG_METRICS_FILE` (включает замеры)."""
+    path = os.environ.get("KL_TAG_METRICS_FILE")
+    if path:
+        enable()
+        atexit.register(registry.dump, path)
@@ -0,0 +1,315 @@
+"""Разбор структуры MP4 (ISO BMFF) без сторонних библиотек.
+
+Читаются только заголовки боксов верхнего уровня и содержимое `moov`, данные
+`mdat` не затрагиваются. Используется для получения технической информации
+о файле без запуска ffprobe и для быстрого чтения тегов.
+"""
+
+import os
+import mmap
+import struct
+from collections import Counter
+from typing import NamedTuple, Iterator
+
+__all__ = ["Mp4ParseError", "Box", "iter_boxes", "iter_file_boxes", "find_box", "read_moov", "read_stream_info", "find_ilst", "read_ilst"]
+
+AUDIO_HANDLERS = {b"soun"}
+SUBTITLE_HANDLERS = {b"sbtl", b"subt", b"text", b"clcp"}
+
+
+class Mp4ParseError(ValueError):
+    """Файл не является MP4 или его структура не поддерживается."""
+
+
+class Box(NamedTuple):
+    type: bytes
+    offset: int  # смещение начала заголовка
+    header_size: int
+    size: int  # полный размер вместе с заголовком
+
+    @property
+    def start(self) -> int:
+        """Смещение начала содержимого."""
+        return self.offset + self.header_size
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+def _parse_header(data, offset, end) -> Box:
+    if end - offset < 8:
+        raise Mp4ParseError(f"Обрезанный заголовок бокса по смещению {offset}")
+    size, box_type = struct.unpack_from(">I4s", data, offset)
+    header_size = 8
+    if size == 1:
+        if end - offset < 16:
+            raise Mp4ParseError(f"Обрезанный заголовок бокса по смещению {offset}")
+        (size,) = struct.unpack_from(">Q", data, offset + 8)
+        header_size = 16
+    elif size == 0:
+        size = end - offset
+    if size < header_size or offset + size > end:
+        raise Mp4ParseError(f"Некорректный размер бокса {box_type!r} по смещению {offset}")
+    return Box(box_type, offset, header_size, size)
+
+
+def iter_boxes(data, start=0, end=None) -> Iterator[Box]:
+    """Боксы одного уровня в буфере (`bytes`, `memoryview` или `mmap`)."""
+    end = len(data) if end is None else end
+    offset = start
+    while offset < end:
+        box = _parse_header(data, offset, end)
+        yield box
+        offset = box.end
+
+
+def iter_file_boxes(f, start=0, end=None) -> Iterator[Box]:
+    """Боксы одного уровня в файле: читаются только заголовки, содержимое пропускается."""
+    if end is None:
+        end = os.fstat(f.fileno()).st_size
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(16)
+        box = _parse_header(header, 0, end - offset)._replace(offset=offset)
+        yield box
+        offset = box.end
+
+
+def meta_children_start(data, box: Box) -> int:
+    """Начало дочерних боксов `meta`: в MP4 это full box, в QuickTime - обычный контейнер."""
+    if box.end - box.start >= 12:
+        (version_flags,) = struct.unpack_from(">I", data, box.start)
+        if version_flags == 0:
+            return box.start + 4
+    return box.start
+
+
+def find_box(data, path: list[bytes], start=0, end=None) -> Box | None:
+    """Поиск бокса по пути, например `[b"trak", b"mdia", b"mdhd"]` (первое совпадение).
+
+    Если в боксе нет продолжения пути, поиск продолжается в следующих боксах
+    с тем же типом (например, пустой `udta` перед `udta` с тегами).
+    """
+    end = len(data) if end is None else end
+    for box in iter_boxes(data, start, end):
+        if box.type != path[0]:
+            continue
+        if len(path) == 1:
+            return box
+        child_start = meta_children_start(data, box) if box.type == b"meta" else box.start
+        found = find_box(data, path[1:], child_start, box.end)
+        if found:
+            return found
+    return None
+
+
+def read_moov(f) -> bytes:
+    """Содержимое бокса `moov` целиком (вместе с заголовком)."""
+    has_ftyp = False
+    for box in iter_file_boxes(f):
+        if box.type == b"ftyp":
+            has_ftyp = True
+        elif box.type == b"moov":
+            f.seek(box.offset)
+            data = f.read(box.size)
+            if len(data) != box.size:
+                raise Mp4ParseError("Обрезанный бокс moov")
+            return data
+        elif box.type == b"moof":
+            raise Mp4ParseError("Фрагментированные MP4 не поддерживаются")
+        elif not has_ftyp:
+            raise Mp4ParseError("Файл не является MP4")
+    raise Mp4ParseError("Не найден бокс moov")
+
+
+def _full_box_version(data, box: Box) -> int:
+    return data[box.start]
+
+
+def _read_time(data, box: Box) -> tuple[int, int]:
+    """`(timescale, duration)` из `mvhd` или `mdhd`."""
+    if _full_box_version(data, box) == 1:
+        return struct.unpack_from(">IQ", data, box.start + 4 + 16)
+    return struct.unpack_from(">II", data, box.start + 4 + 8)
+
+
+def _track_id(data, tkhd: Box) -> int:
+    offset = 16 if _full_box_version(data, tkhd) == 1 else 8
+    return struct.unpack_from(">I", data, tkhd.start + 4 + offset)[0]
+
+
+def _parse_track(data, trak: Box) -> dict:
+    track = {}
+    tkhd = find_box(data, [b"tkhd"], trak.start, trak.end)
+    track["id"] = _track_id(data, tkhd) if tkhd else 0
+    track["chapters"] = []
+    chap = find_box(data, [b"tref", b"chap"], trak.start, trak.end)
+    if chap:
+        track["chapters"] = list(struct.unpack_from(f">{(chap.end - chap.start) // 4}I", data, chap.start))
+
+    mdia = find_box(data, [b"mdia"], trak.start, trak.end)
+    if mdia is None:
+        raise Mp4ParseError("Не найден бокс mdia")
+    hdlr = find_box(data, [b"hdlr"], mdia.start, mdia.end)
+    mdhd = find_box(data, [b"mdhd"], mdia.start, mdia.end)
+    if hdlr is None or mdhd is None:
+        raise Mp4ParseError("Не найдены боксы hdlr/mdhd")
+    track["handler"] = bytes(data[hdlr.start + 8 : hdlr.start + 12])
+    track["timescale"], track["duration"] = _read_time(data, mdhd)
+
+    stbl = find_box(data, [b"minf", b"stbl"], mdia.start, mdia.end)
+    if stbl is None:
+        return track
+    stsd = find_box(data, [b"stsd"], stbl.start, stbl.end)
+    if stsd and track["handler"] == b"vide":
+        entry = _parse_header(data, stsd.start + 8, stsd.end)
+        track["codec"] = entry.type
+        track["width"], track["height"] = struct.unpack_from(">HH", data, entry.start + 24)
+    stts = find_box(data, [b"stts"], stbl.start, stbl.end)
+    if stts:
+        (count,) = struct.unpack_from(">I", data, stts.start + 4)
+        if stts.start + 8 + count * 8 > stts.end:
+            raise Mp4ParseError("Обрезанный бокс stts")
+        entries = struct.unpack_from(f">{count * 2}I", data, stts.start + 8)
+        track["stts"] = list(zip(entries[::2], entries[1::2]))
+    return track
+
+
+def _frame_rates(track) -> tuple[str, str]:
+    """`r_frame_rate` и `avg_frame_rate` в виде дробей, как их выводит ffprobe."""
+    timescale = track["timescale"]
+    stts = track.get("stts") or []
+    deltas = Counter()
+    sample_count = 0
+    total = 0
+    for count, delta in stts:
+        deltas[delta] += count
+        sample_count += count
+        total += count * delta
+    if not sample_count or not total or not timescale:
+        raise Mp4ParseError("Не удалось определить частоту кадров")
+    common_delta = deltas.most_common(1)[0][0] or 1
+    return f"{timescale}/{common_delta}", f"{timescale * sample_count}/{total}"
+
+
+def read_stream_info(file) -> dict:
+    """Техническая информация о файле в формате `engine.get_meta`.
+
+    Бросает `Mp4ParseError`, если контейнер не удалось разобрать.
+    """
+    # импорт здесь, чтобы избежать циклической зависимости с engine
+    from engine import convert_bytes, convert_seconds, check_framerate
+
+    with open(file, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        moov = read_moov(f)
+
+    mvhd = find_box(moov, [b"moov", b"mvhd"])
+    moov_box = _parse_header(moov, 0, len(moov))
+    tracks = [_parse_track(moov, box) for box in iter_boxes(moov, moov_box.start, moov_box.end) if box.type == b"trak"]
+    if not tracks:
+        raise Mp4ParseError("В файле нет дорожек")
+
+    if mvhd:
+        timescale, duration_units = _read_time(moov, mvhd)
+        duration = duration_units / timescale if timescale else 0
+    else:
+        duration = 0
+    if not duration:
+        duration = max(t["duration"] / t["timescale"] for t in tracks if t["timescale"])
+
+    chapter_tracks = {track_id for t in tracks for track_id in t["chapters"]}
+    audio_streams = sum(1 for t in tracks if t["handler"] in AUDIO_HANDLERS)
+    subtitle_streams = sum(1 for t in tracks if t["handler"] in SUBTITLE_HANDLERS and t["id"] not in chapter_tracks)
+
+    result = {}
+    video = tracks[0]
+    if video["handler"] != b"vide":
+        result["video"] = False
+        return result
+    else:
+        result["video"] = True
+    if "width" not in video:
+        raise Mp4ParseError("Не найдено описание видеодорожки")
+
+    result["width"] = video["width"]
+    result["height"] = video["height"]
+    result["size"] = convert_bytes(size)
+    result["bit_rate"] = convert_bytes(int(size * 8 / duration), is_rate=True) if duration else convert_bytes(0, is_rate=True)
+    result["audio_streams"] = audio_streams
+    result["subtitle_streams"] = subtitle_streams
+    result["running_time"] = convert_seconds(duration)
+    result["framerate"], result["framerate_check"] = check_framerate(*_frame_rates(video))
+    return {"ffprobe": True, **result}
+
+
+DATA_TYPE_UTF8 = 1
+DATA_TYPE_UTF16 = 2
+
+
+def _ilst_item_key(data, item: Box) -> str:
+    name = bytes(item.type).decode("latin-1")
+    if name != "----":
+        return name
+    mean = find_box(data, [b"mean"], item.start, item.end)
+    name_box = find_box(data, [b"name"], item.start, item.end)
+    if mean is None or name_box is None:
+        return name
+    mean_text = bytes(data[mean.start + 4 : mean.end]).decode("utf-8", "replace")
+    name_text = bytes(data[name_box.start + 4 : name_box.end]).decode("utf-8", "replace")
+    return f"----:{mean_text}:{name_text}"
+
+
+def _ilst_values(data, item: Box, freeform: bool) -> list:
+    values = []
+    for box in iter_boxes(data, item.start, item.end):
+        if box.type != b"data":
+            continue
+        (type_indicator,) = struct.unpack_from(">I", data, box.start)
+        value = bytes(data[box.start + 8 : box.end])
+        data_type = type_indicator & 0xFFFFFF
+        if not freeform and data_type == DATA_TYPE_UTF8:
+            value = value.decode("utf-8", "replace")
+        elif not freeform and data_type == DATA_TYPE_UTF16:
+            value = value.decode("utf-16-be", "replace")
+        values.append(value)
+    return values
+
+
+def find_ilst(data) -> Box | None:
+    """Бокс `moov/udta/meta/ilst` (в буфере или `mmap` со всем файлом)."""
+    for box in iter_boxes(data):
+        if box.type == b"moov":
+            return find_box(data, [b"udta", b"meta", b"ilst"], box.start, box.end)
+        if box.type == b"moof":
+            break
+    return None
+
+
+def read_ilst(file, wanted: set[str] | None = None) -> dict[str, list]:
+    """Теги из `moov/udta/meta/ilst` в виде `{ключ: [значения]}` с ключами как в mutagen.
+
+    Файл отображается в память, поэтому с диска читаются только заголовки
+    боксов верхнего уровня и сам `ilst`. Декодируются только атомы из `wanted`.
+    Текстовые атомы возвращаются строками, `----` и `covr` - байтами.
+    Если `ilst` не найден, выбрасывается `Mp4ParseError`.
+    """
+    with open(file, "rb") as f:
+        if os.fstat(f.fileno()).st_size < 8:
+            raise Mp4ParseError("Файл не является MP4")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            first = _parse_header(mm, 0, len(mm))
+            if first.type != b"ftyp":
+                raise Mp4ParseError("Файл не является MP4")
+            ilst = find_ilst(mm)
+            if ilst is None:
+                raise Mp4ParseError("Не найден бокс ilst")
+            result = {}
+            for item in iter_boxes(mm, ilst.start, ilst.end):
+                key = _ilst_item_key(mm, item)
+                if wanted is not None and key not in wanted:
+                    continue
+                result[key] = _ilst_values(mm, item, freeform=key.startswith("----") or key == "covr")
+            return result
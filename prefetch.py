@@ -0,0 +1,142 @@
+"""Фоновая загрузка данных Кинопоиска для всех открытых файлов.
+
+Очередь принимает пути к файлам, рабочие потоки читают из них kpid и заполняют
+дисковый кэш (`kpcache`), так что «Загрузить из Кинопоиска» для уже
+обработанного файла не обращается к сети. Частота запросов ограничивается
+общим лимитером клиента (`kinopoisk.get_limiter`). Когда израсходована
+большая часть дневной квоты API (`quota_reserved`), предзагрузка
+останавливается: остаток нужен для «Загрузить из Кинопоиска».
+"""
+
+import logging
+import threading
+from queue import PriorityQueue, Empty
+from itertools import count
+
+from engine import read_tags
+
+__all__ = ["PrefetchQueue", "PRIORITY_SELECTED", "PRIORITY_NORMAL"]
+
+log = logging.getLogger("KL_Tag")
+
+PRIORITY_SELECTED = 0
+PRIORITY_NORMAL = 10
+
+
+class PrefetchQueue:
+    """Очередь предзагрузки с приоритетом для выбранного файла.
+
+    `on_progress(done, total)` вызывается из рабочих потоков после каждого файла.
+    """
+
+    def __init__(self, client=None, workers=4, on_progress=None):
+        self.client = client
+        self.workers = workers
+        self.on_progress = on_progress
+        self.done = 0
+        self.total = 0
+        self.failed = 0
+        self.quota_stopped = False  # остановлена, чтобы не расходовать остаток квоты
+        self._queue = PriorityQueue()
+        self._seq = count()
+        self._seen = set()
+        self._finished = set()
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._held = False
+        self._threads = []
+
+    def start(self):
+        if self.client is None:
+            # импорт здесь: клиент создаётся только при запуске очереди
+            from kinopoisk import get_client
+
+            self.client = get_client()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"prefetch-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def add(self, paths, priority=PRIORITY_NORMAL):
+        for path in paths:
+            with self._lock:
+                if path in self._seen:
+                    continue
+                self._seen.add(path)
+                self.total += 1
+            self._queue.put((priority, next(self._seq), path))
+
+    def hold(self):
+        """Файлы ещё будут добавляться (идёт поиск): рабочие потоки не завершаются на пустой очереди."""
+        self._held = True
+
+    def release(self):
+        self._held = False
+
+    def prioritize(self, path):
+        """Перемещение файла в начало очереди (например, при выборе в списке)."""
+        with self._lock:
+            if path in self._finished:
+                return
+            if path not in self._seen:
+                self._seen.add(path)
+                self.total += 1
+        # старая запись останется в очереди и будет пропущена
+        self._queue.put((PRIORITY_SELECTED, next(self._seq), path))
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _quota_reserved(self) -> bool:
+        limiter = getattr(self.client, "limiter", None)
+        if limiter is None or not limiter.quota_reserved():
+            return False
+        with self._lock:
+            first, self.quota_stopped = not self.quota_stopped, True
+        if first:
+            log.info(f"Предзагрузка данных Кинопоиска остановлена: остаток дневной квоты API оставлен для запросов из окна ({self.done}/{self.total})")
+            if self.on_progress and not self._cancel.is_set():
+                self.on_progress(self.done, self.total)
+        self._cancel.set()
+        return True
+
+    def _worker(self):
+        while not self._cancel.is_set():
+            try:
+                _, _, path = self._queue.get(timeout=0.5)
+            except Empty:
+                if self.done >= self.total and not self._held:
+                    return
+                continue
+            with self._lock:
+                if path in self._finished:
+                    continue
+                self._finished.add(path)
+            if self._quota_reserved():
+                break
+            ok = self._prefetch(path)
+            with self._lock:
+                self.done += 1
+                if not ok:
+                    self.failed += 1
+            if self.on_progress and not self._cancel.is_set():
+                self.on_progress(self.done, self.total)
+
+    def _prefetch(self, path) -> bool:
+        tags = read_tags(path)
+        if not tags.kpid:
+            return True
+        try:
+            return self.client.prefetch(int(tags.kpid))
+        except Exception as e:
+            log.error(f"Не удалось загрузить данные Кинопоиска для {path}: {e}")
+            return False
@@ -0,0 +1,123 @@
+"""Превью постера для окна программы.
+
+Постер уменьшается на стороне PIL сразу до размера 200×300 DIP с учётом
+масштаба экрана, результат - буфер RGB, из которого GUI создаёт `wx.Bitmap`.
+Готовые превью кэшируются по хэшу постера и масштабу. Модуль не зависит от wx.
+"""
+
+import io
+import hashlib
+import threading
+from dataclasses import dataclass
+from collections import OrderedDict
+
+from PIL import Image
+
+from covers import LazyCover
+
+__all__ = ["Preview", "PreviewRenderer", "PREVIEW_SIZE", "preview_size", "cover_key"]
+
+PREVIEW_SIZE = (200, 300)
+
+
+@dataclass(frozen=True)
+class Preview:
+    width: int
+    height: int
+    data: bytes  # RGB, 3 байта на пиксель
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+
+def preview_size(scale: float, size=PREVIEW_SIZE) -> tuple[int, int]:
+    """Размер превью в пикселях, как `wx.Window.FromDIP(size)`."""
+    return (round(size[0] * scale), round(size[1] * scale))
+
+
+def cover_key(cover) -> str | None:
+    """Ключ кэша для постера. Для изображений, не связанных с байтами файла, - None."""
+    if isinstance(cover, LazyCover):
+        return hashlib.sha1(cover.data).hexdigest()
+    return None
+
+
+def _open(cover, target) -> Image.Image:
+    if isinstance(cover, LazyCover):
+        if cover.decoded:
+            return cover.image
+        # отдельное декодирование с уменьшением, пиксели LazyCover не заполняются
+        image = Image.open(io.BytesIO(cover.data))
+        image.draft(None, target)
+        return image
+    return cover
+
+
+def render(cover: "LazyCover | Image.Image", scale=1.0, size=PREVIEW_SIZE) -> Preview:
+    """Превью без кэша."""
+    target = preview_size(scale, size)
+    image = _open(cover, target)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if image.size != target:
+        image = image.resize(target, Image.Resampling.BICUBIC, reducing_gap=2.0)
+    return Preview(target[0], target[1], image.tobytes())
+
+
+class PreviewRenderer:
+    """Превью постеров с LRU кэшем, ограниченным `max_bytes`. Можно вызывать из любого потока."""
+
+    def __init__(self, placeholder: Image.Image | None = None, size=PREVIEW_SIZE, max_bytes=16 * 1024 * 1024):
+        self.placeholder_image = placeholder
+        self.size = size
+        self.max_bytes = max_bytes
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[tuple, Preview] = OrderedDict()
+        self._placeholders: dict[float, Preview] = {}  # не вытесняются
+        self._lock = threading.Lock()
+
+    def _get(self, key) -> Preview | None:
+        with self._lock:
+            preview = self._cache.get(key)
+            if preview is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return preview
+
+    def _put(self, key, preview: Preview):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = preview
+            self.cached_bytes += preview.nbytes
+            while self.cached_bytes > self.max_bytes and len(self._cache) > 1:
+                _, old = self._cache.popitem(last=False)
+                self.cached_bytes -= old.nbytes
+
+    def render(self, cover: "LazyCover | Image.Image", scale=1.0) -> Preview:
+        key = cover_key(cover)
+        if key is None:
+            return render(cover, scale, self.size)
+        key = (key, scale)
+        preview = self._get(key)
+        if preview is None:
+            preview = render(cover, scale, self.size)
+            self._put(key, preview)
+        return preview
+
+    def placeholder(self, scale=1.0) -> Preview:
+        """Превью заглушки «нет постера», строится один раз для каждого масштаба."""
+        preview = self._placeholders.get(scale)
+        if preview is None:
+            preview = self._placeholders[scale] = render(self.placeholder_image, scale, self.size)
+        return preview
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.cached_bytes = 0
@@ -0,0 +1,195 @@
+"""Ограничение частоты запросов к API."""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+__all__ = ["TokenBucket", "SharedRateLimiter", "QuotaExceeded", "DAILY_QUOTA"]
+
+log = logging.getLogger("KL_Tag")
+
+DAILY_QUOTA = 500  # запросов в сутки на бесплатном ключе неофициального API
+
+
+class QuotaExceeded(RuntimeError):
+    """Дневной лимит запросов к API исчерпан."""
+
+
+class TokenBucket:
+    """Алгоритм «ведро с токенами»: `rate` токенов в секунду, не более `capacity` в запасе."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1) -> bool:
+        with self._lock:
+            self._refill()
+            if self.updated >= self.paused_until and self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, cancel: threading.Event | None = None) -> bool:
+        """Ожидание токенов. Возвращает `False`, если ожидание прервано через `cancel`."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.updated < self.paused_until:
+                    wait = self.paused_until - self.updated
+                elif self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                else:
+                    wait = (tokens - self.tokens) / self.rate
+            if cancel is None:
+                time.sleep(wait)
+            elif cancel.wait(wait):
+                return False
+
+    def pause(self, seconds: float):
+        """Приостановка выдачи токенов (например, по заголовку `Retry-After`)."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def quota_reserved(self) -> bool:
+        """Дневная квота не учитывается, фоновые запросы не ограничиваются."""
+        return False
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL,
+    updated REAL,
+    paused_until REAL
+);
+CREATE TABLE IF NOT EXISTS quota (
+    name TEXT,
+    day TEXT,
+    used INTEGER,
+    PRIMARY KEY (name, day)
+);
+"""
+
+
+class SharedRateLimiter:
+    """Ведро с токенами и дневная квота, общие для всех потоков и процессов.
+
+    Состояние хранится в SQLite, каждая выдача токена - одна короткая транзакция
+    `BEGIN IMMEDIATE`. Когда за сутки израсходовано больше `soft_limit` квоты,
+    скорость линейно снижается (не ниже `min_rate_factor`), чтобы пакетная
+    обработка растянулась, а не упёрлась в лимит. При исчерпании квоты `acquire`
+    бросает `QuotaExceeded`. Остаток квоты сверх `soft_limit` оставляется для
+    запросов пользователя: фоновые задачи проверяют `quota_reserved()`.
+    """
+
+    def __init__(self, path, rate: float, capacity: float | None = None, daily_quota=DAILY_QUOTA, soft_limit=0.8, min_rate_factor=0.05, name="kinopoisk"):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.daily_quota = daily_quota
+        self.soft_limit = soft_limit
+        self.min_rate_factor = min_rate_factor
+        self.name = name
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")  # состояние лимитера не нужно сохранять при сбое
+        self._db.executescript(SCHEMA)
+        self._db.execute("INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, 0)", (name, self.capacity, time.time()))
+
+    @staticmethod
+    def _today():
+        return time.strftime("%Y-%m-%d")
+
+    def rate_factor(self, used) -> float:
+        """Множитель скорости в зависимости от израсходованной части квоты."""
+        if not self.daily_quota:
+            return 1.0
+        share = used / self.daily_quota
+        if share <= self.soft_limit:
+            return 1.0
+        return max(self.min_rate_factor, (1 - share) / (1 - self.soft_limit))
+
+    def _try_acquire(self, tokens) -> float:
+        """0, если токены выданы, иначе время ожидания в секундах."""
+        with self._lock:
+            db = self._db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                day = self._today()
+                available, updated, paused_until = db.execute("SELECT tokens, updated, paused_until FROM buckets WHERE name = ?", (self.name,)).fetchone()
+                row = db.execute("SELECT used FROM quota WHERE name = ? AND day = ?", (self.name, day)).fetchone()
+                used = row[0] if row else 0
+                if self.daily_quota and used + tokens > self.daily_quota:
+                    raise QuotaExceeded(f"Дневной лимит запросов к API исчерпан ({used}/{self.daily_quota})")
+                rate = self.rate * self.rate_factor(used)
+                available = min(self.capacity, available + max(0.0, now - updated) * rate)
+                if now < paused_until:
+                    wait = paused_until - now
+                elif available >= tokens:
+                    available -= tokens
+                    wait = 0.0
+                    db.execute("INSERT INTO quota VALUES (?, ?, ?) ON CONFLICT (name, day) DO UPDATE SET used = used + ?", (self.name, day, tokens, tokens))
+                else:
+                    wait = (tokens - available) / rate
+                db.execute("UPDATE buckets SET tokens = ?, updated = ? WHERE name = ?", (available, now, self.name))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return wait
+
+    def try_acquire(self, tokens=1) -> bool:
+        return self._try_acquire(tokens) == 0
+
+    def acquire(self, tokens=1, cancel: threading.Event | None = None) -> bool:
+        """Ожидание токенов. Возвращает `False`, если ожидание прервано через `cancel`."""
+        while True:
+            wait = self._try_acquire(tokens)
+            if not wait:
+                return True
+            if cancel is None:
+                time.sleep(wait)
+            elif cancel.wait(wait):
+                return False
+
+    def pause(self, seconds: float):
+        """Приостановка выдачи токенов во всех процессах (например, по заголовку `Retry-After`)."""
+        with self._lock:
+            self._db.execute("UPDATE buckets SET paused_until = MAX(paused_until, ?) WHERE name = ?", (time.time() + seconds, self.name))
+
+    def exhaust(self):
+        """API сообщило об исчерпании квоты: до конца суток запросы не выполняются."""
+        with self._lock:
+            day = self._today()
+            self._db.execute(
+                "INSERT INTO quota VALUES (?, ?, ?) ON CONFLICT (name, day) DO UPDATE SET used = MAX(used, ?)", (self.name, day, self.daily_quota, self.daily_quota)
+            )
+
+    def quota_reserved(self) -> bool:
+        """Израсходовано больше `soft_limit` квоты: остаток - для запросов пользователя."""
+        return bool(self.daily_quota) and self.quota_used() >= self.soft_limit * self.daily_quota
+
+    def quota_used(self) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT used FROM quota WHERE name = ? AND day = ?", (self.name, self._today())).fetchone()
+        return row[0] if row else 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
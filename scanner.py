@@ -0,0 +1,143 @@
+"""Поиск медиафайлов в каталогах.
+
+`scan` - генератор на `os.scandir`: файлы выдаются по мере обхода, без
+построения полного списка, тип записи берётся из результата `scandir` без
+лишних `stat`. `Scanner` выполняет обход в фоновом потоке и передаёт найденные
+файлы пачками, чтобы список в окне заполнялся сразу, а не после обхода всей
+библиотеки.
+"""
+
+import os
+import time
+import logging
+import threading
+
+__all__ = ["MEDIA_EXTENSIONS", "scan_entries", "scan", "scan_batches", "sort_key", "Scanner"]
+
+log = logging.getLogger("KL_Tag")
+
+MEDIA_EXTENSIONS = (".mp4", ".m4v")
+
+
+def scan_entries(root, recursive=True, extensions=MEDIA_EXTENSIONS, cancel: threading.Event | None = None, on_directory=None):
+    """Записи `os.DirEntry` файлов с расширениями `extensions` в каталоге `root` (и подкаталогах).
+
+    Файлы каталога выдаются раньше файлов его подкаталогов, символические ссылки
+    на каталоги не обходятся. Недоступные каталоги пропускаются.
+    `on_directory(path)` вызывается перед чтением каждого каталога.
+    """
+    stack = [os.path.abspath(root)]
+    while stack:
+        if cancel and cancel.is_set():
+            return
+        directory = stack.pop()
+        if on_directory:
+            on_directory(directory)
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            if entry.name.lower().endswith(extensions):
+                                yield entry
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            log.warning(f"Не удалось прочитать каталог ({e}): {directory}")
+            continue
+        # обратный порядок: при извлечении из стека подкаталоги идут по алфавиту
+        subdirs.sort(reverse=True)
+        stack.extend(subdirs)
+
+
+def scan(root, recursive=True, extensions=MEDIA_EXTENSIONS, cancel: threading.Event | None = None):
+    """Абсолютные пути файлов с расширениями `extensions` в `root` (и подкаталогах).
+
+    `root` может быть и отдельным файлом. Порядок обхода - как у `scan_entries`.
+    """
+    root = os.path.abspath(root)
+    if os.path.isfile(root):
+        if root.lower().endswith(extensions):
+            yield root
+        return
+    for entry in scan_entries(root, recursive, extensions, cancel):
+        yield entry.path
+
+
+def scan_batches(root, batch_size=500, interval=0.1, recursive=True, extensions=MEDIA_EXTENSIONS, cancel: threading.Event | None = None):
+    """Файлы из `scan` пачками.
+
+    Первая пачка отдаётся сразу после первого найденного файла, следующие - при
+    накоплении `batch_size` файлов или не реже раза в `interval` секунд.
+    """
+    batch = []
+    deadline = 0.0  # первый найденный файл отдаётся без ожидания
+    for path in scan(root, recursive, extensions, cancel):
+        batch.append(path)
+        if len(batch) >= batch_size or time.monotonic() >= deadline:
+            yield batch
+            batch = []
+            deadline = time.monotonic() + interval
+    if batch and not (cancel and cancel.is_set()):
+        yield batch
+
+
+def sort_key(path):
+    """Порядок файлов в списке: по имени файла, затем по полному пути."""
+    return (os.path.basename(path), path)
+
+
+class Scanner:
+    """Обход каталога в фоновом потоке.
+
+    `on_batch(paths)` и `on_done(count)` вызываются через `dispatch` (в GUI это
+    `wx.CallAfter`). После `cancel()` колбэки больше не вызываются.
+    """
+
+    def __init__(self, root, on_batch, on_done=None, dispatch=None, recursive=True, batch_size=500, interval=0.1):
+        self.root = root
+        self.on_batch = on_batch
+        self.on_done = on_done
+        self.dispatch = dispatch or (lambda func, *args: func(*args))
+        self.recursive = recursive
+        self.batch_size = batch_size
+        self.interval = interval
+        self.found = 0
+        self.finished = False
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="Scanner", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _deliver(self, callback, *args):
+        if not self._cancel.is_set():
+            callback(*args)
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            for batch in scan_batches(self.root, self.batch_size, self.interval, self.recursive, cancel=self._cancel):
+                self.found += len(batch)
+                self.dispatch(self._deliver, self.on_batch, batch)
+        except Exception as e:
+            log.error(f"Ошибка при поиске файлов в {self.root}: {e}")
+        self.finished = True
+        if not self._cancel.is_set():
+            log.info(f"Найдено файлов: {self.found} за {time.perf_counter() - start:.2f} с: {self.root}")
+            if self.on_done:
+                self.dispatch(self._deliver, self.on_done, self.found)
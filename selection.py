@@ -0,0 +1,108 @@
+"""Фоновая работа, зависящая от выбранного в списке файла.
+
+Вся работа выполняется в одном потоке: при быстрой смене выбора (например, при
+удержании стрелки в списке) запускается только последняя задача, выполняемая
+задача отменяется, а результаты устаревших задач отбрасываются.
+"""
+
+import time
+import logging
+import threading
+
+__all__ = ["SelectionWorker"]
+
+log = logging.getLogger("KL_Tag")
+
+
+def _call(func, *args):
+    func(*args)
+
+
+class SelectionWorker:
+    """Один рабочий поток с задержкой запуска (debounce) и номерами поколений.
+
+    `submit(func, *args, on_done=..., on_error=...)` заменяет ожидающую задачу и
+    отменяет выполняемую: `func` получает аргумент `cancel` (`threading.Event`)
+    и должна проверять его сама. Колбэки вызываются через `dispatch` (в GUI это
+    `wx.CallAfter`) и только если с момента `submit` не было новых задач.
+    """
+
+    def __init__(self, dispatch=None, delay=0.15):
+        self.dispatch = dispatch or _call
+        self.delay = delay
+        self.generation = 0
+        self.dropped = 0  # задачи, заменённые до запуска или отменённые
+        self._pending = None
+        self._cancel = threading.Event()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="SelectionWorker", daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, on_done=None, on_error=None) -> int:
+        with self._cond:
+            self.generation += 1
+            if self._pending is not None:
+                self.dropped += 1
+            self._cancel.set()
+            self._cancel = threading.Event()
+            self._pending = (self.generation, func, args, on_done, on_error, time.monotonic() + self.delay)
+            self._cond.notify()
+            return self.generation
+
+    def cancel(self):
+        """Отмена ожидающей и выполняемой задачи без запуска новой."""
+        with self._cond:
+            self.generation += 1
+            self._pending = None
+            self._cancel.set()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending = None
+            self._cancel.set()
+            self._cond.notify()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def is_current(self, generation) -> bool:
+        return generation == self.generation
+
+    def _next(self):
+        """Ожидание задачи, для которой истекла задержка. None - поток завершается."""
+        with self._cond:
+            while not self._closed:
+                if self._pending is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._pending[-1] - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                task = self._pending[:-1] + (self._cancel,)
+                self._pending = None
+                return task
+            return None
+
+    def _deliver(self, generation, callback, value):
+        if callback and self.is_current(generation):
+            callback(value)
+
+    def _run(self):
+        while (task := self._next()) is not None:
+            generation, func, args, on_done, on_error, cancel = task
+            try:
+                result = func(*args, cancel=cancel)
+            except Exception as e:
+                if cancel.is_set():
+                    self.dropped += 1
+                    continue
+                log.error(f"Ошибка фоновой задачи: {e}")
+                self.dispatch(self._deliver, generation, on_error, e)
+                continue
+            if cancel.is_set():
+                self.dropped += 1
+                continue
+            self.dispatch(self._deliver, generation, on_done, result)
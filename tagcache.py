@@ -0,0 +1,180 @@
+"""Кэш прочитанных тегов для файлов из списка.
+
+Записи проверяются по размеру и `mtime_ns` файла, общий объём ограничен
+`max_bytes` (вытесняются давно не использованные записи). Соседние с выбранным
+файлы читаются заранее в фоне (`prefetch`) вместе с превью постеров, поэтому
+переход по списку не ждёт диска.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+from engine import Mp4TagsClass, read_tags, LIST_FIELDS
+from covers import LazyCover
+
+__all__ = ["TagCache", "neighbors", "NEIGHBOR_RADIUS"]
+
+log = logging.getLogger("KL_Tag")
+
+NEIGHBOR_RADIUS = 3
+
+
+def neighbors(paths, index, radius=NEIGHBOR_RADIUS):
+    """Файлы вокруг `index` в порядке удаления: следующий, предыдущий, через один..."""
+    for distance in range(1, radius + 1):
+        for i in (index + distance, index - distance):
+            if 0 <= i < len(paths):
+                yield paths[i]
+
+
+def _stat_key(path) -> tuple[int, int]:
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def tags_size(tags: Mp4TagsClass) -> int:
+    """Примерный объём тегов в памяти, вместе с постером."""
+    size = 1024
+    for name in ("title", "kpid", "year", "rating", "description", "long_descriplion", "main_genre"):
+        size += 2 * len(getattr(tags, name) or "")
+    for name in LIST_FIELDS:
+        value = getattr(tags, name)
+        size += 2 * sum(len(item) for item in value) if isinstance(value, list) else 2 * len(value or "")
+    cover = tags.cover
+    if isinstance(cover, LazyCover):
+        size += len(cover.data)
+        if cover.decoded:
+            size += cover.size[0] * cover.size[1] * len(cover.image.getbands())
+    return size
+
+
+class _Entry:
+    __slots__ = ("key", "tags", "nbytes")
+
+    def __init__(self, key, tags):
+        self.key = key
+        self.tags = tags
+        self.nbytes = tags_size(tags)
+
+
+class TagCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fresh(self, path) -> _Entry | None:
+        """Актуальная запись (вызывается под блокировкой)."""
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        try:
+            key = _stat_key(path)
+        except OSError:
+            key = None
+        if key != entry.key:
+            self._remove(path)
+            return None
+        self._entries.move_to_end(path)
+        return entry
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.size -= entry.nbytes
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            path = next(iter(self._entries))
+            self._remove(path)
+
+    def get(self, path) -> Mp4TagsClass | None:
+        """Копия тегов из кэша или None, если файла нет в кэше или он изменился."""
+        with self._lock:
+            entry = self._fresh(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry.tags.copy()
+
+    def put(self, path, tags: Mp4TagsClass, key=None, speculative=False):
+        """`speculative`: запись из предварительного чтения, вытесняется первой."""
+        if not tags.is_ok:
+            return
+        try:
+            key = key or _stat_key(path)
+        except OSError:
+            return
+        entry = _Entry(key, tags.copy())
+        with self._lock:
+            self._remove(path)
+            self._entries[path] = entry
+            if speculative:
+                self._entries.move_to_end(path, last=False)
+            self.size += entry.nbytes
+            self._evict()
+
+    def load(self, path, speculative=False) -> Mp4TagsClass:
+        """Теги файла: из кэша или с диска (с сохранением в кэш). Возвращается копия для редактирования."""
+        tags = self.get(path)
+        if tags is not None:
+            return tags
+        try:
+            key = _stat_key(path)
+        except OSError:
+            key = None
+        tags = read_tags(path)
+        if key:
+            self.put(path, tags, key, speculative)
+        return tags
+
+    def invalidate(self, path):
+        with self._lock:
+            self._remove(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def prefetch(self, paths, cancel: threading.Event | None = None, on_cover=None):
+        """Фоновое чтение тегов для `paths`.
+
+        Постеры передаются в `on_cover(cover)` (например, для построения превью),
+        если он не задан - декодируются, чтобы GUI получил готовые пиксели.
+        """
+        for path in paths:
+            if cancel and cancel.is_set():
+                return
+            with self._lock:
+                entry = self._fresh(path)
+            if entry is None:
+                try:
+                    tags = self.load(path, speculative=True)
+                except Exception as e:
+                    log.error(f"Не удалось прочитать теги ({e}): {os.path.basename(path)}")
+                    continue
+            else:
+                tags = entry.tags
+            if not isinstance(tags.cover, LazyCover):
+                continue
+            if on_cover:
+                on_cover(tags.cover)
+            elif not tags.cover.decoded:
+                tags.cover.image
+                with self._lock:
+                    entry = self._entries.get(path)
+                    if entry is not None and entry.tags.cover is tags.cover:
+                        size = tags_size(entry.tags)
+                        self.size += size - entry.nbytes
+                        entry.nbytes = size
+                        self._evict()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import audit  # noqa: E402
+from audit import audit_file, run_audit, _read_rows  # noqa: E402
+from metacache import set_meta_cache  # noqa: E402
+from synthetic import make_mp4  # noqa: E402
+
+
+def stuck_probe(path, timeout, use_cache):
+    """Как чтение с недоступного сетевого диска: не реагирует на таймаут."""
+    if "hang" in os.path.basename(path):
+        while True:
+            time.sleep(60)
+    return audit_file(path, timeout, use_cache=False)
+
+
+def crashing_probe(path, timeout, use_cache):
+    if "crash" in os.path.basename(path):
+        os._exit(1)
+    return audit_file(path, timeout, use_cache=False)
+
+
+def make_library(tmp_path, names):
+    library = tmp_path / "library"
+    library.mkdir()
+    for name in names:
+        make_mp4(str(library / name), frames=10, mdat_size=1024)
+    return library
+
+
+def statuses(report):
+    return {os.path.basename(row["path"]): row["status"] for row in _read_rows(str(report))}
+
+
+def test_stuck_worker_is_replaced(tmp_path, monkeypatch):
+    monkeypatch.setattr(audit, "KILL_GRACE", 0.5)
+    library = make_library(tmp_path, ["a.mp4", "hang.mp4", "b.mp4", "c.mp4"])
+    report = tmp_path / "report.csv"
+
+    start = time.monotonic()
+    stats = run_audit(str(library), str(report), jobs=2, timeout=1, audit=stuck_probe)
+
+    assert time.monotonic() - start < 20
+    assert statuses(report) == {"a.mp4": "ok", "hang.mp4": "timeout", "b.mp4": "ok", "c.mp4": "ok"}
+    assert (stats.total, stats.ok, stats.timeouts, stats.errors) == (4, 3, 1, 0)
+
+
+def test_crashed_worker_fails_only_its_file(tmp_path):
+    library = make_library(tmp_path, ["a.mp4", "crash.mp4", "b.mp4", "c.mp4"])
+    report = tmp_path / "report.jsonl"
+
+    stats = run_audit(str(library), str(report), jobs=2, timeout=10, audit=crashing_probe)
+
+    assert statuses(report) == {"a.mp4": "ok", "crash.mp4": "error", "b.mp4": "ok", "c.mp4": "ok"}
+    assert (stats.total, stats.ok, stats.errors) == (4, 3, 1)
+
+
+def test_missing_file_is_error_row(tmp_path):
+    set_meta_cache(None)
+    row = audit_file(str(tmp_path / "missing.mp4"), timeout=5, use_cache=False)
+    assert row["status"] == "error"
+    assert row["error"]
+    assert row["elapsed"] is not None
@@ -0,0 +1,21 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from library import COLUMNS, LibraryIndex  # noqa: E402
+
+
+def test_find_by_years_uses_index(tmp_path):
+    index = LibraryIndex(str(tmp_path / "library.sqlite"))
+    rows = []
+    for i, year in enumerate(["1968", "1975", "1980", "", None, "2001"]):
+        row = dict.fromkeys(COLUMNS)
+        row.update(path=f"/x/{i}.mp4", is_ok=1, title=f"t{i}", year=year, genres="[]")
+        rows.append(row)
+    index.update(rows)
+
+    assert [row["year"] for row in index.find(year_from=1970, year_to=1980)] == ["1975", "1980"]
+    plan = " ".join(r[3] for r in index._db.execute("EXPLAIN QUERY PLAN SELECT * FROM files WHERE is_ok AND CAST(year AS INTEGER) >= 1970"))
+    assert "USING INDEX files_year_int" in plan
@@ -0,0 +1,90 @@
+import os
+import struct
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import engine  # noqa: E402
+from engine import convert_bytes, convert_seconds, ffprobe_meta, read_tags, write_tags  # noqa: E402
+from mp4box import Mp4ParseError, find_ilst, iter_boxes, read_ilst, read_stream_info  # noqa: E402
+from synthetic import box, make_mp4, make_tags  # noqa: E402
+
+
+def insert_into_moov(path, payload: bytes):
+    """Вставка бокса в начало `moov` (в конце файла, смещения сэмплов не меняются)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    moov = next(b for b in iter_boxes(data) if b.type == b"moov")
+    assert moov.end == len(data)
+    header = struct.pack(">I", moov.end - moov.offset + len(payload)) + b"moov"
+    with open(path, "wb") as f:
+        f.write(data[: moov.offset] + header + payload + data[moov.start :])
+
+
+def test_ilst_after_empty_udta(tmp_path):
+    path = make_mp4(str(tmp_path / "a.mp4"), frames=10, mdat_size=1024, moov_at_end=True)
+    write_tags(path, make_tags(3))
+    insert_into_moov(path, box(b"udta", box(b"name", b"\0\0\0\0x")))
+
+    with open(path, "rb") as f:
+        assert find_ilst(f.read()) is not None
+    assert read_ilst(path)["\xa9nam"] == [make_tags(3).title]
+    assert read_tags(path).title == make_tags(3).title
+
+
+def test_no_ilst_falls_back_to_mutagen(tmp_path):
+    path = make_mp4(str(tmp_path / "a.mp4"), frames=10, mdat_size=1024)
+    with pytest.raises(Mp4ParseError):
+        read_ilst(path)
+    tags = read_tags(path)
+    assert tags.is_ok
+    assert tags.title == ""
+
+
+STREAM_CASES = {
+    "default": {},
+    "tracks": {"audio_tracks": 3, "subtitle_tracks": 2},
+    "no_audio": {"audio_tracks": 0, "width": 720, "height": 576},
+    "moov_at_end": {"moov_at_end": True, "audio_tracks": 2},
+    "vfr": {"vfr": True},
+}
+
+
+@pytest.fixture(params=list(STREAM_CASES), ids=list(STREAM_CASES))
+def stream_case(request, tmp_path):
+    options = STREAM_CASES[request.param]
+    path = make_mp4(str(tmp_path / f"{request.param}.mp4"), frames=2400, mdat_size=256 * 1024, codec=b"raw ", **options)
+    return path, options
+
+
+def test_read_stream_info(stream_case):
+    path, options = stream_case
+    info = read_stream_info(path)
+
+    deltas = [(1200, 1001), (1200, 2002)] if options.get("vfr") else [(2400, 1001)]
+    video_duration = sum(c * d for c, d in deltas) / 24000
+    audio_duration = 2400 * 2 * 1024 / 48000 if options.get("audio_tracks", 1) else 0
+    duration = max(video_duration, audio_duration)
+    assert info["ffprobe"] and info["video"]
+    assert (info["width"], info["height"]) == (options.get("width", 1920), options.get("height", 800))
+    assert info["audio_streams"] == options.get("audio_tracks", 1)
+    assert info["subtitle_streams"] == options.get("subtitle_tracks", 0)
+    assert info["running_time"] == convert_seconds(duration)
+    assert info["size"] == convert_bytes(os.path.getsize(path))
+    assert info["bit_rate"] == convert_bytes(int(os.path.getsize(path) * 8 / duration), is_rate=True)
+    assert info["framerate"] == pytest.approx(2400 / video_duration)
+    assert info["framerate_check"] is not options.get("vfr", False)
+
+
+@pytest.mark.skipif(not os.path.isfile(engine.FFPROBE), reason="ffprobe не найден")
+def test_stream_info_matches_ffprobe(stream_case):
+    path, _ = stream_case
+    info = read_stream_info(path)
+    expected = ffprobe_meta(path)
+    assert expected["ffprobe"]
+    assert {name: info[name] for name in expected if name != "framerate"} == {name: value for name, value in expected.items() if name != "framerate"}
+    assert info["framerate"] == pytest.approx(expected["framerate"], rel=1e-3)
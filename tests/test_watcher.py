@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+from queue import Queue, Empty
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from filelist import FileListModel  # noqa: E402
+from library import LibraryIndex  # noqa: E402
+from metacache import set_meta_cache  # noqa: E402
+from scanner import scan  # noqa: E402
+from synthetic import make_mp4  # noqa: E402
+from watcher import DirectoryWatcher, inotify_available  # noqa: E402
+
+BACKENDS = ["poll"] + (["inotify"] if inotify_available() else [])
+
+
+@pytest.fixture(autouse=True)
+def no_meta_cache():
+    set_meta_cache(None)
+    yield
+    set_meta_cache(None)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_rename_while_watching(tmp_path, backend):
+    """Переименование в окне: `model.rename`, затем `watcher` сообщает о новом имени как о добавленном файле."""
+    library = tmp_path / "library"
+    library.mkdir()
+    for name in ("a.mp4", "b.mp4"):
+        make_mp4(str(library / name), frames=10, mdat_size=1024)
+    old, new, other = str(library / "a.mp4"), str(library / "z.mp4"), str(library / "b.mp4")
+
+    model = FileListModel(index=LibraryIndex(str(tmp_path / "library.sqlite")))
+    model.add(scan(library))
+    queue = Queue()
+    watcher = DirectoryWatcher(library, queue.put, known=list(model.paths), interval=0.1, backend=backend).start()
+    try:
+        time.sleep(0.3)  # снимок каталога для опроса
+        # как FileListCtrl.rename_file
+        os.rename(old, new)
+        model.rename(old, new)
+
+        # как MyFrame.onFilesChanged; при опросе удаление и добавление приходят разными наборами
+        seen_added, seen_removed = [], []
+        deadline = time.monotonic() + 5
+        while new not in seen_added and time.monotonic() < deadline:
+            try:
+                changes = queue.get(timeout=0.2)
+            except Empty:
+                continue
+            model.remove(changes.removed)
+            model.add(changes.added)
+            seen_added += changes.added
+            seen_removed += changes.removed
+    finally:
+        watcher.stop()
+        watcher.join(5)
+        model.close()
+        model.join(5)
+
+    assert seen_added == [new]
+    assert seen_removed == [old]
+    assert sorted(model.paths) == sorted([other, new])
+
+
+def test_add_skips_present_paths(tmp_path):
+    model = FileListModel(index=LibraryIndex(str(tmp_path / "library.sqlite")))
+    try:
+        assert model.add(["/x/b.mp4", "/x/a.mp4"]) == ["/x/b.mp4", "/x/a.mp4"]
+        assert model.add(["/x/a.mp4", "/x/c.mp4", "/x/c.mp4"]) == ["/x/c.mp4"]
+        assert model.add(["/x/b.mp4"]) == []
+        assert model.paths == ["/x/a.mp4", "/x/b.mp4", "/x/c.mp4"]
+    finally:
+        model.close()
+        model.join(5)
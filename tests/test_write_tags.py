@@ -0,0 +1,104 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import engine  # noqa: E402
+from engine import read_tags, write_tags  # noqa: E402
+from mp4box import read_stream_info  # noqa: E402
+from synthetic import make_mp4, make_tags, make_poster  # noqa: E402
+
+
+class RecordingMP4(engine.MP4):
+    """MP4, запоминающий атомы, которые write_tags изменил перед сохранением."""
+
+    written = []
+
+    def __setitem__(self, key, value):
+        RecordingMP4.written.append(key)
+        super().__setitem__(key, value)
+
+
+@pytest.fixture
+def written(monkeypatch):
+    RecordingMP4.written = []
+    monkeypatch.setattr(engine, "MP4", RecordingMP4)
+    return RecordingMP4.written
+
+
+@pytest.fixture(params=[False, True], ids=["moov_front", "moov_end"])
+def tagged(request, tmp_path):
+    """Файл с тегами, постером и запасом 64 Кб."""
+    path = make_mp4(str(tmp_path / "a.mp4"), frames=200, mdat_size=64 * 1024, moov_at_end=request.param)
+    report = write_tags(path, make_tags(1, cover=make_poster()), padding=64 * 1024)
+    assert not report.in_place and report.padding == 64 * 1024
+    return path
+
+
+def test_unchanged_tags_are_not_saved(tagged, written):
+    mtime = os.stat(tagged).st_mtime_ns
+    tags = read_tags(tagged)
+    tags.title = tags.title  # то же значение
+    tags.actors = list(tags.actors)
+
+    report = write_tags(tagged, tags)
+
+    assert report.skipped
+    assert str(report) == "без изменений"
+    assert written == []
+    assert os.stat(tagged).st_mtime_ns == mtime
+
+
+def test_only_changed_atoms_are_written(tagged, written):
+    tags = read_tags(tagged)
+    tags.title = "Солярис"
+    tags.rating = "8.0"
+
+    write_tags(tagged, tags)
+
+    assert sorted(written) == sorted(["\xa9nam", "----:com.apple.iTunes:kpra"])
+    saved = read_tags(tagged)
+    assert (saved.title, saved.rating) == ("Солярис", "8.0")
+    assert saved.description == make_tags(1).description
+    assert saved.has_cover
+    assert tags.dirty == set()
+
+
+def test_save_in_place_within_padding(tagged):
+    size = os.path.getsize(tagged)
+    info = read_stream_info(tagged)
+    tags = read_tags(tagged)
+    tags.description = "Экранизация романа Станислава Лема. " * 100
+
+    report = write_tags(tagged, tags, padding=64 * 1024)
+
+    assert report.in_place
+    assert report.moved_bytes == 0
+    assert 0 < report.padding < 64 * 1024
+    assert os.path.getsize(tagged) == size
+    assert read_tags(tagged).description == tags.description
+    assert read_stream_info(tagged) == info
+
+
+def test_rewrite_when_padding_overflows(tagged):
+    size = os.path.getsize(tagged)
+    info = read_stream_info(tagged)
+    tags = read_tags(tagged)
+    tags.description = "Экранизация романа Станислава Лема. " * 2000  # больше запаса
+
+    report = write_tags(tagged, tags, padding=64 * 1024)
+
+    assert not report.in_place
+    assert report.moved_bytes > 0
+    assert report.padding == 64 * 1024
+    assert os.path.getsize(tagged) > size
+    saved = read_tags(tagged)
+    assert saved.description == tags.description
+    assert saved.title == make_tags(1).title
+    assert {k: v for k, v in read_stream_info(tagged).items() if k not in ("size", "bit_rate")} == {
+        k: v for k, v in info.items() if k not in ("size", "bit_rate")
+    }
@@ -0,0 +1,206 @@
+"""Транспорт HTTP для клиента Кинопоиска: сеть, запись ответов и их воспроизведение.
+
+- `LiveTransport` - обычные запросы через `requests.Session` с пулом соединений;
+- `RecordTransport` - запросы в сеть с сохранением ответов (JSON API и постеров)
+  в каталог с фикстурами;
+- `ReplayTransport` - ответы из каталога с фикстурами без сети и токена,
+  с заданной задержкой, для работы без доступа к API и нагрузочных тестов.
+
+Фикстуры хранятся парами файлов `<ключ>.json` (URL, статус, заголовки) и
+`<ключ>.body`, ключ - хэш пути и параметров запроса без имени хоста, поэтому
+записанные ответы воспроизводятся и для другого `api_url`. Токен API в
+фикстуры не попадает.
+
+С `max_bytes` тело ответа читается потоком в буфер и обрывается исключением
+`ResponseTooLarge`, если оно больше лимита; `timeout` тогда ограничивает и
+общее время загрузки. `accept(head)` проверяет начало тела по мере загрузки
+(например, размер изображения по заголовку): `False` прерывает загрузку
+исключением `ResponseRejected`, `None` - нужно больше данных.
+
+Режим для `get_client()` задаётся переменными окружения (наследуются рабочими
+процессами): `KL_TAG_KP_TRANSPORT=live|record:<каталог>|replay:<каталог>` и
+`KL_TAG_KP_LATENCY_MS` - задержка воспроизведения.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+from urllib.parse import urlsplit, urlencode, parse_qsl
+
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import Timeout
+from requests.structures import CaseInsensitiveDict
+
+__all__ = ["LiveTransport", "RecordTransport", "ReplayTransport", "ResponseTooLarge", "ResponseRejected", "fixture_key", "transport_from_env", "configure"]
+
+log = logging.getLogger("KL_Tag")
+
+RECORDED_HEADERS = ("Content-Type", "Retry-After")
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}  # такие ответы не записываются
+
+
+class ResponseTooLarge(IOError):
+    """Тело ответа больше допустимого размера."""
+
+
+class ResponseRejected(IOError):
+    """Загрузка прервана: начало тела не прошло проверку `accept`."""
+
+
+def fixture_key(url: str, params: dict | None = None) -> str:
+    """Ключ фикстуры: путь и отсортированные параметры запроса, без схемы и хоста."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query) + [(str(k), str(v)) for k, v in (params or {}).items()]
+    target = parts.path + ("?" + urlencode(sorted(query)) if query else "")
+    return hashlib.sha1(target.encode()).hexdigest()
+
+
+def make_response(url: str, status: int, body: bytes, headers: dict | None = None) -> Response:
+    r = Response()
+    r.url = url
+    r.status_code = status
+    r._content = body
+    r.headers = CaseInsensitiveDict(headers or {})
+    r.encoding = "utf-8"
+    return r
+
+
+class LiveTransport:
+    offline = False
+
+    def __init__(self, pool_size=10):
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url, timeout=None, headers=None, params=None, max_bytes=None, accept=None) -> Response:
+        if max_bytes is None and accept is None:
+            return self.session.get(url, headers=headers, params=params, timeout=timeout)
+        total = sum(timeout) if isinstance(timeout, tuple) else timeout
+        deadline = time.monotonic() + total if total else None
+        with self.session.get(url, headers=headers, params=params, timeout=timeout, stream=True) as r:
+            if max_bytes is not None and int(r.headers.get("Content-Length") or 0) > max_bytes:
+                raise ResponseTooLarge(f"Ответ больше {max_bytes} байт: {url}")
+            if r.status_code != 200:
+                accept = None
+            buffer = bytearray()
+            # пока начало тела не проверено, читается мелкими частями
+            for chunk in r.iter_content(4096 if accept else 64 * 1024):
+                buffer += chunk
+                if max_bytes is not None and len(buffer) > max_bytes:
+                    raise ResponseTooLarge(f"Ответ больше {max_bytes} байт: {url}")
+                if accept is not None:
+                    verdict = accept(bytes(buffer))
+                    if verdict is False:
+                        raise ResponseRejected(f"Загрузка прервана после {len(buffer)} байт: {url}")
+                    if verdict:
+                        accept = None
+                if deadline and time.monotonic() > deadline:
+                    raise Timeout(f"Загрузка не завершилась за {timeout} с: {url}")
+            # соединение возвращается в пул, тело уже в памяти
+            r._content = bytes(buffer)
+        return r
+
+    def close(self):
+        self.session.close()
+
+
+class RecordTransport:
+    """Запросы через `inner` с записью ответов в `directory`."""
+
+    offline = False
+
+    def __init__(self, directory, inner=None, pool_size=10):
+        self.directory = directory
+        self.inner = inner or LiveTransport(pool_size)
+        self.recorded = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, url, timeout=None, headers=None, params=None, max_bytes=None, accept=None) -> Response:
+        # тело загружается целиком и без `accept`: при воспроизведении проверка та же, что в сети
+        r = self.inner.get(url, timeout=timeout, headers=headers, params=params, max_bytes=max_bytes)
+        if r.status_code not in TRANSIENT_STATUSES:
+            self.save(fixture_key(url, params), url, r)
+        if accept is not None and r.status_code == 200 and accept(r.content) is False:
+            raise ResponseRejected(f"Загрузка прервана: {url}")
+        return r
+
+    def save(self, key, url, r: Response):
+        meta = {
+            "url": url,
+            "status": r.status_code,
+            "headers": {name: r.headers[name] for name in RECORDED_HEADERS if name in r.headers},
+        }
+        # запись через временный файл: каталог могут заполнять несколько процессов
+        for suffix, data in ((".body", r.content), (".json", json.dumps(meta, ensure_ascii=False, indent=1).encode())):
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.directory, key + suffix))
+        self.recorded += 1
+
+    def close(self):
+        self.inner.close()
+
+
+class ReplayTransport:
+    """Ответы из каталога с фикстурами. Для отсутствующих - 404.
+
+    `latency` - задержка каждого ответа в секундах (имитация сети).
+    """
+
+    offline = True
+
+    def __init__(self, directory, latency=0.0):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"Каталог с фикстурами не найден: {directory}")
+        self.directory = directory
+        self.latency = latency
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url, timeout=None, headers=None, params=None, max_bytes=None, accept=None) -> Response:
+        if self.latency:
+            time.sleep(self.latency)
+        path = os.path.join(self.directory, fixture_key(url, params))
+        try:
+            with open(path + ".json", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(path + ".body", "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            log.warning(f"Нет записанного ответа: {url} {params or ''}")
+            return make_response(url, 404, b"", {})
+        self.hits += 1
+        if max_bytes is not None and len(body) > max_bytes:
+            raise ResponseTooLarge(f"Ответ больше {max_bytes} байт: {url}")
+        if accept is not None and meta["status"] == 200 and accept(body) is False:
+            raise ResponseRejected(f"Загрузка прервана: {url}")
+        return make_response(url, meta["status"], body, meta["headers"])
+
+    def close(self):
+        pass
+
+
+def configure(mode="live", directory=None, latency=0.0):
+    """Выбор транспорта для `get_client()` в этом и дочерних процессах."""
+    os.environ["KL_TAG_KP_TRANSPORT"] = mode if mode == "live" else f"{mode}:{directory}"
+    os.environ["KL_TAG_KP_LATENCY_MS"] = str(latency * 1000)
+
+
+def transport_from_env(pool_size=10):
+    value = os.environ.get("KL_TAG_KP_TRANSPORT", "live")
+    mode, _, directory = value.partition(":")
+    if mode == "record":
+        return RecordTransport(directory, pool_size=pool_size)
+    if mode == "replay":
+        return ReplayTransport(directory, float(os.environ.get("KL_TAG_KP_LATENCY_MS") or 0) / 1000)
+    if mode != "live":
+        raise ValueError(f"Неизвестный режим KL_TAG_KP_TRANSPORT: {value}")
+    return LiveTransport(pool_size)
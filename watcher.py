@@ -0,0 +1,434 @@
+"""Отслеживание изменений в открытом каталоге без повторного чтения всей библиотеки.
+
+`watch` - генератор наборов изменений (`Changes`): добавленные, удалённые и
+изменённые медиафайлы. Для локальных каталогов в Linux изменения приходят от
+inotify (через `ctypes`, без сторонних пакетов). В остальных случаях (Windows,
+сетевые диски, изменения на которых inotify не видит, исчерпан лимит inotify)
+каталог опрашивается: снимок размеров и `mtime_ns` файлов сравнивается с
+предыдущим. О файле, который ещё записывается (например, загружается), сообщается
+только после окончания записи.
+
+`DirectoryWatcher` выполняет `watch` в фоновом потоке и сбрасывает записи кэша
+`get_meta` для изменённых файлов. Теги и строки списка получатель изменений
+сбрасывает сам, только для перечисленных файлов.
+"""
+
+import os
+import re
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import logging
+import threading
+from dataclasses import dataclass, field
+
+from metacache import get_meta_cache
+from scanner import MEDIA_EXTENSIONS, scan_entries
+
+__all__ = ["Changes", "SnapshotPoller", "InotifySource", "DirectoryWatcher", "watch", "open_source", "inotify_available", "POLL_INTERVAL"]
+
+log = logging.getLogger("KL_Tag")
+
+POLL_INTERVAL = 5.0  # секунды между опросами каталога
+DEBOUNCE = 0.5  # события inotify собираются в один набор, пока идут чаще
+MAX_DELAY = 5.0  # при непрерывном потоке событий набор выдаётся не реже
+
+# файловые системы, изменения на которых с других компьютеров inotify не получает
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph", "glusterfs", "fuse.glusterfs", "fuse.sshfs", "fuse.rclone"}
+
+
+@dataclass
+class Changes:
+    added: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+    @property
+    def stale(self) -> list[str]:
+        """Файлы, данные которых в кэшах устарели: удалённые и изменённые."""
+        return self.removed + self.modified
+
+    @classmethod
+    def between(cls, before: set, after: set) -> "Changes":
+        """Добавленные и удалённые файлы между двумя наборами путей."""
+        return cls(sorted(after - before), sorted(before - after))
+
+
+class SnapshotPoller:
+    """Опрос каталога: сравнение снимков `{путь: (размер, mtime_ns)}`.
+
+    Новый или изменённый файл попадает в `Changes`, когда его размер и время
+    изменения совпали в двух опросах подряд (запись в файл закончилась).
+    """
+
+    kind = "poll"
+
+    def __init__(self, root, recursive=True, extensions=MEDIA_EXTENSIONS, interval=POLL_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.recursive = recursive
+        self.extensions = extensions
+        self.interval = interval
+        self._unstable: dict[str, tuple[int, int]] = {}
+        self.files = self.snapshot()
+
+    def snapshot(self) -> dict[str, tuple[int, int]]:
+        if os.path.isfile(self.root):
+            try:
+                st = os.stat(self.root)
+            except OSError:
+                return {}
+            return {self.root: (st.st_size, st.st_mtime_ns)}
+        files = {}
+        # в Windows размер и время изменения приходят из scandir без отдельного stat
+        for entry in scan_entries(self.root, self.recursive, self.extensions):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            files[entry.path] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    @property
+    def paths(self) -> set[str]:
+        return set(self.files)
+
+    def poll(self) -> Changes:
+        current = self.snapshot()
+        changes = Changes()
+        for path, key in current.items():
+            old = self.files.get(path)
+            if old == key:
+                self._unstable.pop(path, None)
+            elif self._unstable.get(path) != key:
+                self._unstable[path] = key  # файл изменился с прошлого опроса - ждём следующего
+            else:
+                del self._unstable[path]
+                self.files[path] = key
+                (changes.added if old is None else changes.modified).append(path)
+        for path in self.files.keys() - current.keys():
+            del self.files[path]
+            changes.removed.append(path)
+        for path in self._unstable.keys() - current.keys():
+            del self._unstable[path]
+        changes.removed.sort()
+        return changes
+
+    def wait(self, cancel: threading.Event) -> Changes:
+        if cancel.wait(self.interval):
+            return Changes()
+        return self.poll()
+
+    def close(self):
+        pass
+
+
+# константы из <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# IN_CREATE нужен только для каталогов: о новом файле сообщается после IN_CLOSE_WRITE
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT = struct.Struct("iIII")  # struct inotify_event без имени
+
+
+def _libc():
+    """libc с функциями inotify или None."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def inotify_available() -> bool:
+    return _libc() is not None
+
+
+def is_network_path(path) -> bool:
+    """Каталог на сетевой файловой системе (по /proc/self/mounts)."""
+    try:
+        with open("/proc/self/mounts", encoding="utf-8") as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return False
+    path = os.path.realpath(path)
+    best, fstype = "", ""
+    for point, kind in mounts:
+        point = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), point)
+        if (path == point or path.startswith(os.path.join(point, ""))) and len(point) >= len(best):
+            best, fstype = point, kind
+    return fstype in NETWORK_FILESYSTEMS
+
+
+class InotifySource:
+    """Изменения от inotify: по наблюдению на каждый подкаталог.
+
+    События собираются, пока идут чаще, чем раз в `debounce` секунд, и
+    сводятся к итоговому состоянию файла: созданный и сразу удалённый файл в
+    `Changes` не попадает.
+    """
+
+    kind = "inotify"
+
+    def __init__(self, root, recursive=True, extensions=MEDIA_EXTENSIONS, debounce=DEBOUNCE):
+        self._libc = _libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify недоступен")
+        self.root = os.path.abspath(root)
+        self.recursive = recursive
+        self.extensions = extensions
+        self.debounce = debounce
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._dirs: dict[int, str] = {}  # дескриптор наблюдения -> каталог
+        self._touched: dict[str, bool] = {}  # файл -> был ли он в `files` до первого события
+        self._since = 0.0
+        try:
+            self.files = set(self._add_tree(self.root))
+        except Exception:
+            os.close(self.fd)
+            raise
+
+    @property
+    def paths(self) -> set[str]:
+        return set(self.files)
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "исчерпан лимит наблюдений inotify (fs.inotify.max_user_watches)")
+            log.warning(f"Не удалось отслеживать каталог ({os.strerror(error)}): {directory}")
+            return
+        self._dirs[wd] = directory
+
+    def _add_tree(self, top) -> list[str]:
+        """Наблюдение за `top` и его подкаталогами. Возвращает найденные файлы."""
+        # наблюдение ставится до чтения каталога: файлы, появившиеся во время обхода, не теряются
+        return [entry.path for entry in scan_entries(top, self.recursive, self.extensions, on_directory=self._add_watch)]
+
+    def _forget_tree(self, top):
+        prefix = os.path.join(top, "")
+        for wd, directory in list(self._dirs.items()):
+            if directory == top or directory.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self._dirs[wd]
+        for path in [path for path in self.files if path.startswith(prefix)]:
+            self._set(path, False)
+
+    def _set(self, path, exists):
+        self._touched.setdefault(path, path in self.files)
+        if exists:
+            self.files.add(path)
+        else:
+            self.files.discard(path)
+
+    def _resync(self):
+        log.warning(f"Переполнение очереди inotify, каталог перечитывается: {self.root}")
+        found = set(self._add_tree(self.root))
+        for path in found ^ self.files:
+            self._set(path, path in found)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self._resync()
+            return
+        if mask & IN_IGNORED:
+            self._dirs.pop(wd, None)
+            return
+        directory = self._dirs.get(wd)
+        if directory is None:
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # подкаталоги обрабатываются по событиям родительского каталога
+            if directory == self.root:
+                log.warning(f"Отслеживаемый каталог удалён или перемещён: {self.root}")
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if not self.recursive:
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                for file in self._add_tree(path):
+                    self._set(file, True)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._forget_tree(path)
+            return
+        if not name.lower().endswith(self.extensions):
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._set(path, False)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) or (mask & IN_ATTRIB and path in self.files):
+            self._set(path, True)
+
+    def _read(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT.size : offset + EVENT.size + length].rstrip(b"\0"))
+            offset += EVENT.size + length
+            if not self._touched:
+                self._since = time.monotonic()
+            self._handle(wd, mask, name)
+
+    def _flush(self) -> Changes:
+        changes = Changes()
+        for path, known in sorted(self._touched.items()):
+            exists = path in self.files
+            if exists and not known:
+                changes.added.append(path)
+            elif known and not exists:
+                changes.removed.append(path)
+            elif exists:
+                changes.modified.append(path)
+        self._touched.clear()
+        return changes
+
+    def wait(self, cancel: threading.Event) -> Changes:
+        while not cancel.is_set():
+            ready, _, _ = select.select([self.fd], [], [], self.debounce if self._touched else 0.5)
+            if ready:
+                self._read()
+                if not self._touched or time.monotonic() - self._since < MAX_DELAY:
+                    continue
+            if self._touched:
+                return self._flush()
+        return Changes()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def open_source(root, recursive=True, extensions=MEDIA_EXTENSIONS, interval=POLL_INTERVAL, debounce=DEBOUNCE, backend="auto"):
+    """Источник изменений: inotify для локального каталога, если он доступен, иначе опрос.
+
+    `backend` - "auto", "inotify" или "poll".
+    """
+    if backend == "inotify" or (backend == "auto" and inotify_available() and os.path.isdir(root) and not is_network_path(root)):
+        try:
+            source = InotifySource(root, recursive, extensions, debounce)
+        except OSError as e:
+            if backend == "inotify":
+                raise
+            log.warning(f"Не удалось включить inotify ({e}), каталог будет опрашиваться раз в {interval:g} с: {root}")
+        else:
+            log.info(f"Отслеживание изменений (inotify, каталогов: {len(source._dirs)}): {root}")
+            return source
+    elif backend != "poll" and backend != "auto":
+        raise ValueError(f"Неизвестный способ отслеживания: {backend}")
+    source = SnapshotPoller(root, recursive, extensions, interval)
+    log.info(f"Отслеживание изменений (опрос раз в {interval:g} с, файлов: {len(source.files)}): {root}")
+    return source
+
+
+def watch(
+    root,
+    recursive=True,
+    known=None,
+    interval=POLL_INTERVAL,
+    debounce=DEBOUNCE,
+    backend="auto",
+    extensions=MEDIA_EXTENSIONS,
+    cancel: threading.Event | None = None,
+):
+    """Наборы изменений медиафайлов в `root`, пока не установлен `cancel`.
+
+    `known` - уже известные файлы (например, результат `scan`): отличия от них,
+    появившиеся до начала отслеживания, выдаются первым набором.
+    """
+    cancel = cancel or threading.Event()
+    source = open_source(root, recursive, extensions, interval, debounce, backend)
+    try:
+        if known is not None:
+            changes = Changes.between(set(known), source.paths)
+            if changes:
+                yield changes
+        while not cancel.is_set():
+            changes = source.wait(cancel)
+            if changes:
+                yield changes
+    finally:
+        source.close()
+
+
+class DirectoryWatcher:
+    """Отслеживание изменений в фоновом потоке.
+
+    `on_changes(changes)` вызывается через `dispatch` (в GUI это `wx.CallAfter`),
+    к этому моменту записи кэша `get_meta` для удалённых и изменённых файлов уже
+    сброшены. После `stop()` колбэк больше не вызывается.
+    """
+
+    def __init__(self, root, on_changes, dispatch=None, recursive=True, known=None, interval=POLL_INTERVAL, backend="auto"):
+        self.root = root
+        self.on_changes = on_changes
+        self.dispatch = dispatch or (lambda func, *args: func(*args))
+        self.recursive = recursive
+        self.known = known
+        self.interval = interval
+        self.backend = backend
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="DirectoryWatcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _deliver(self, callback, *args):
+        if not self._stop.is_set():
+            callback(*args)
+
+    def _run(self):
+        try:
+            for changes in watch(self.root, self.recursive, self.known, self.interval, backend=self.backend, cancel=self._stop):
+                cache = get_meta_cache()
+                if cache is not None and changes.stale:
+                    cache.invalidate_many(changes.stale)
+                log.info(
+                    f"Изменения в {self.root}: добавлено {len(changes.added)}, "
+                    f"удалено {len(changes.removed)}, изменено {len(changes.modified)}"
+                )
+                self.dispatch(self._deliver, self.on_changes, changes)
+        except Exception as e:
+            log.error(f"Ошибка при отслеживании изменений в {self.root}: {e}")